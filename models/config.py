@@ -3,7 +3,9 @@ from models.device import DeviceList
 
 class RequestCycle:
     def __init__(self, aliyun_access_key_secret: str, huawei_iam_username: str, huawei_iam_password: str,
-                 huawei_iam_domain: str, huawei_iam_area: str, values: list = None):
+                 huawei_iam_domain: str, huawei_iam_area: str, values: list = None, enabled: bool = False):
+        # 是否由 API 服务器内置的设备轮询定时请求设备，凭据为空时使用 API 服务器的凭据
+        self.enabled = enabled
         self.aliyun_access_key_secret = aliyun_access_key_secret
         self.huawei_iam_username = huawei_iam_username
         self.huawei_iam_password = huawei_iam_password
@@ -2,7 +2,8 @@ from models.enums import DeviceType
 
 
 class Device:
-    def __init__(self, id, url, device_type: DeviceType, alert_yellow: float, alert_orange: float, alert_red: float):
+    def __init__(self, id, url, device_type: DeviceType, alert_yellow: float, alert_orange: float, alert_red: float,
+                 alert_property: str = None):
         if not isinstance(device_type, DeviceType):
             raise ValueError("device_type must be an instance of DeviceType enum")
         self.id = id
@@ -11,6 +12,8 @@ class Device:
         self.yellow = float(alert_yellow)
         self.orange = float(alert_orange)
         self.red = float(alert_red)
+        # 与阈值比较的属性名，为空时取数值最大的属性
+        self.alert_property = alert_property or None
 
 class DeviceList:
     def __init__(self):
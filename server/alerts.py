@@ -0,0 +1,134 @@
+import logging
+
+import numpy as np
+
+from reading import Reading
+
+# 与 EmailAlertsTab 中警报等级的顺序一致
+ALERT_LEVEL_NAMES = ['正常', '黄色警报', '橙色警报', '红色警报']
+
+_LEVELS = np.array([1, 2, 3], dtype=np.int8)
+
+
+class AlertEvent:
+    """设备警报等级变化事件"""
+    __slots__ = ('device_id', 'level', 'previous_level', 'value')
+
+    def __init__(self, device_id, level, previous_level, value):
+        self.device_id = device_id
+        self.level = level
+        self.previous_level = previous_level
+        self.value = value
+
+    def to_dict(self):
+        return {
+            'id': self.device_id,
+            'level': self.level,
+            'level_name': ALERT_LEVEL_NAMES[self.level],
+            'previous_level': self.previous_level,
+            'value': self.value
+        }
+
+
+def reading_value(reading, alert_property=None):
+    """
+    取一条规范化读数中与阈值比较的值
+
+    Args:
+        reading: 规范化读数
+        alert_property: 可选，比较的属性名；不提供时取除时间戳外数值最大的属性
+
+    Returns:
+        比较值，读数中没有该属性或属性值不是数字时返回 NaN
+    """
+    if alert_property is not None:
+        value = reading.get(alert_property)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return float('nan')
+    if isinstance(reading, Reading):
+        return reading.peak
+    values = [v for k, v in reading.items() if k != 'time' and isinstance(v, (int, float)) and not isinstance(v, bool)]
+    return max(values) if values else float('nan')
+
+
+class ThresholdEvaluator:
+    """
+    黄/橙/红三级阈值的向量化判定
+
+    所有设备的阈值保存在一个 (N, 3) 的数组中，一轮读数只需一次数组运算即可得到全部设备的警报等级。
+    等级升高时立即生效；等级降低时读数需低于原等级阈值减去 `hysteresis` 比例的回差，避免在阈值附近反复跳变。
+    只有等级发生变化的设备会产生事件。设备设置了 `alert_property` 时只用该属性与阈值比较。
+    """
+
+    def __init__(self, devices, hysteresis=0.05):
+        self.device_ids = [device.id for device in devices]
+        self.positions = {device_id: i for i, device_id in enumerate(self.device_ids)}
+        self.alert_properties = [getattr(device, 'alert_property', None) for device in devices]
+        self.thresholds = np.array(
+            [[device.yellow, device.orange, device.red] for device in devices], dtype=np.float64
+        ).reshape(-1, 3)
+        # 未设置的阈值为 inf，inf - inf 会得到 NaN，比较结果始终为 False
+        with np.errstate(invalid='ignore'):
+            self.release_thresholds = self.thresholds - np.abs(self.thresholds) * hysteresis
+        self.levels = np.zeros(len(self.device_ids), dtype=np.int8)
+
+    def evaluate(self, values):
+        """
+        判定一轮读数
+
+        Args:
+            values: 长度为设备数量的数组，NaN 表示本轮没有读数，该设备等级保持不变
+
+        Returns:
+            等级发生变化的 AlertEvent 列表
+        """
+        values = np.asarray(values, dtype=np.float64)
+        column = values[:, None]
+        with np.errstate(invalid='ignore'):
+            raised = (np.where(column >= self.thresholds, _LEVELS, 0)).max(axis=1, initial=0)
+            held = (np.where(column >= self.release_thresholds, _LEVELS, 0)).max(axis=1, initial=0)
+        current = self.levels
+        new_levels = np.where(raised >= current, raised, np.minimum(current, held)).astype(np.int8)
+        new_levels = np.where(np.isnan(values), current, new_levels)
+
+        changed = np.flatnonzero(new_levels != current)
+        events = [
+            AlertEvent(self.device_ids[i], int(new_levels[i]), int(current[i]), float(values[i]))
+            for i in changed
+        ]
+        self.levels = new_levels
+        return events
+
+    def evaluate_readings(self, readings):
+        """
+        判定 `{设备ID: 规范化读数}` 形式的一轮读数
+
+        Returns:
+            等级发生变化的 AlertEvent 列表
+        """
+        values = np.full(len(self.device_ids), np.nan)
+        for device_id, reading in readings.items():
+            position = self.positions.get(device_id)
+            if position is not None:
+                values[position] = reading_value(reading, self.alert_properties[position])
+        events = self.evaluate(values)
+        for event in events:
+            logging.warning(f'设备 {event.device_id} 警报等级变化: '
+                            f'{ALERT_LEVEL_NAMES[event.previous_level]} -> {ALERT_LEVEL_NAMES[event.level]}（读数 {event.value}）')
+        return events
+
+    def value_of(self, device_id, reading):
+        """按设备的 `alert_property` 取读数的比较值，设备不在列表中时取数值最大的属性"""
+        position = self.positions.get(device_id)
+        return reading_value(reading, self.alert_properties[position] if position is not None else None)
+
+    def restore_levels(self, levels):
+        """沿用 `{设备ID: 等级}` 中仍在设备列表里的设备的等级，重新加载配置后不会重复产生警报"""
+        for device_id, level in levels.items():
+            position = self.positions.get(device_id)
+            if position is not None:
+                self.levels[position] = level
+
+    def current_levels(self):
+        return {device_id: int(level) for device_id, level in zip(self.device_ids, self.levels)}
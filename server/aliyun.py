@@ -4,7 +4,10 @@ import base64
 import json
 import datetime
 import random
-from hashlib import sha1
+from hashlib import sha1, sha256
+
+import fastjson
+from reading import Reading
 
 def aliyun_generate_sign(url, access_key_secret):
     parsed_url = urllib.parse.urlparse(url)
@@ -39,49 +42,112 @@ def aliyun_add_authentication(url, access_key_secret):
     url += "&SignatureNonce=" + str(random.randint(1, 999999))
     return aliyun_generate_sign(url, access_key_secret)
 
-def aliyun_beautify_response(response):
+def aliyun_normalize_response(response):
+    """
+    将阿里云 QueryDevicePropertyStatus 响应整理为 `[Reading]`
+
+    Args:
+        response: httpx 响应对象、响应字节串或字符串
+
+    Returns:
+        包含一条 Reading 的列表，响应结构不符合预期时返回空列表
+    """
     try:
-        # 确保以 UTF-8 编码解析响应文本
-        if isinstance(response, str):
-            response_text = response.encode('utf-8').decode('utf-8')
+        if isinstance(response, (str, bytes)):
+            response_dict = fastjson.loads(response)
         else:
-            response_text = response.text.encode('utf-8').decode('utf-8')
-        
-        response_dict = json.loads(response_text)
+            response_dict = fastjson.loads(response.content)
         
         # 检查是否存在需要的键
         if "Data" in response_dict and "List" in response_dict["Data"] and "PropertyStatusInfo" in response_dict["Data"]["List"]:
             property_status_info = response_dict["Data"]["List"]["PropertyStatusInfo"]
         else:
-            # 如果不存在，可以返回一个空的JSON字符串或者抛出一个异常
+            # 如果不存在，返回一个空的列表表示没有数据
             print("Error: Response does not contain expected data structure.")
-            return json.dumps([])  # 返回一个空的列表表示没有数据
-        
-        # 创建一个空字典来存储修改后的数据
-        modified_data = {}
-        for item in property_status_info:
-            # 尝试将值转换为浮点数，如果失败则保留原始字符串
-            try:
-                value = float(item["Value"])
-            except ValueError:
-                value = item["Value"]
-            modified_data[item["Name"]] = value
+            return []
         
-        # 将修改后的字典放入列表中
-        modified_data_list = [modified_data]
-        
-        # 搜索响应文本当中的时间戳
-        timestamps = [item["Time"] for item in property_status_info]
-        
-        # 在修改后的数据中添加时间戳
-        modified_data_list[0]["time"] = max(timestamps)
-        
-        # 将修改后的数据以 UTF-8 编码的形式进行编码，确保不转义 Unicode 字符
-        modified_data_json = json.dumps(modified_data_list, ensure_ascii=False)
-        return modified_data_json
+        # 搜索响应文本当中的时间戳，能转换为浮点数的值保存为浮点数，否则保留原始字符串
+        timestamp = max(item["Time"] for item in property_status_info)
+        return [Reading.from_pairs(((item["Name"], item["Value"]) for item in property_status_info), timestamp)]
     except KeyError as e:
         print(f"KeyError: {e} not found in response.")
-        return json.dumps([])  # 或者返回一个默认值/错误信息
+        return []
     except Exception as e:
         print(f"An error occurred: {e}")
-        return json.dumps([])  # 或者返回一个默认值/错误信息
\ No newline at end of file
+        return []
+
+def aliyun_beautify_response(response):
+    # 将修改后的数据编码为 JSON 字符串，不转义 Unicode 字符
+    return fastjson.dumps(aliyun_normalize_response(response)).decode('utf-8')
+
+class AliyunSigner:
+    """
+    阿里云请求签名器，每个 AccessKeySecret 创建一次
+
+    HMAC 密钥状态只计算一次，每次签名复制后使用；每个设备 URL 的固定参数只规范化一次，
+    之后每次请求只需拼接 Timestamp 和 SignatureNonce。签名结果与 aliyun_add_authentication 逐字节一致。
+    """
+
+    # 缓存的 URL 模板数量上限
+    max_templates = 4096
+
+    def __init__(self, access_key_secret):
+        self._hmac = hmac.new((access_key_secret + "&").encode('utf-8'), digestmod=sha1)
+        # 密钥的摘要，区分不同密钥签名的请求的缓存结果
+        self.fingerprint = sha256(access_key_secret.encode('utf-8')).hexdigest()[:16]
+        self._templates = {}
+
+    def _template(self, url):
+        template = self._templates.get(url)
+        if template is not None:
+            return template
+        parsed_url = urllib.parse.urlparse(url)
+        query_params = urllib.parse.parse_qs(parsed_url.query)
+        # 无法保证与通用实现一致的 URL 不使用模板
+        if '?' not in url or parsed_url.fragment or {'Timestamp', 'SignatureNonce'} & query_params.keys():
+            template = False
+        else:
+            sorted_params = sorted((k, v[0]) for k, v in query_params.items())
+            encoded = [
+                (k, urllib.parse.quote_plus(urllib.parse.urlencode([(k, v)], quote_via=urllib.parse.quote)))
+                for k, v in sorted_params
+            ]
+            template = (
+                [e for k, e in encoded if k < 'SignatureNonce'],
+                [e for k, e in encoded if 'SignatureNonce' < k < 'Timestamp'],
+                [e for k, e in encoded if k > 'Timestamp']
+            )
+        if len(self._templates) >= self.max_templates:
+            self._templates.clear()
+        self._templates[url] = template
+        return template
+
+    def sign(self, url, timestamp, nonce):
+        """为加入 Timestamp 和 SignatureNonce 后的 URL 计算签名，返回签名后的 URL"""
+        template = self._template(url)
+        if template is False:
+            return self._sign_generic(f"{url}&Timestamp={timestamp}&SignatureNonce={nonce}")
+        before, between, after = template
+        nonce_pair = urllib.parse.quote_plus('SignatureNonce=' + urllib.parse.quote(nonce, safe=''))
+        timestamp_pair = urllib.parse.quote_plus('Timestamp=' + urllib.parse.quote(timestamp, safe=''))
+        query_string = '%26'.join(before + [nonce_pair] + between + [timestamp_pair] + after)
+        string_to_sign = 'GET&%2F&' + query_string
+        return f"{url}&Timestamp={timestamp}&SignatureNonce={nonce}&Signature={self._signature(string_to_sign)}"
+
+    def _sign_generic(self, url):
+        parsed_url = urllib.parse.urlparse(url)
+        query_params = urllib.parse.parse_qs(parsed_url.query)
+        sorted_params = sorted((k, v[0]) for k, v in query_params.items())
+        query_string = urllib.parse.urlencode(sorted_params, quote_via=urllib.parse.quote)
+        string_to_sign = 'GET' + '&' + urllib.parse.quote_plus('/') + '&' + urllib.parse.quote_plus(query_string)
+        return f"{url}&Signature={self._signature(string_to_sign)}"
+
+    def _signature(self, string_to_sign):
+        keyed = self._hmac.copy()
+        keyed.update(string_to_sign.encode('utf-8'))
+        return urllib.parse.quote_plus(base64.b64encode(keyed.digest()).decode('utf-8'))
+
+    def add_authentication(self, url):
+        """与 aliyun_add_authentication 相同：加入时间戳、随机数和签名"""
+        current_time = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return self.sign(url, current_time, str(random.randint(1, 999999)))
@@ -0,0 +1,172 @@
+import time
+from collections import OrderedDict
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    单个上游主机的熔断器
+
+    连续失败 `failure_threshold` 次后打开，打开期间的请求立即失败而不再等待上游；
+    `reset_timeout` 秒后进入半开状态，只放行 `half_open_requests` 个试探请求，
+    试探成功则关闭，失败则重新打开。试探请求在 `reset_timeout` 秒内没有结果时允许新的试探。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_requests=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probes_started_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """是否允许发送请求；打开期间返回 False 并计入被拒绝的请求"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._probes = 0
+        if now - self._probes_started_at >= self.reset_timeout:
+            self._probes = 0
+        if self._probes >= self.half_open_requests:
+            self.rejected += 1
+            return False
+        if not self._probes:
+            self._probes_started_at = now
+        self._probes += 1
+        return True
+
+    def retry_after(self):
+        """距离下一次允许试探的秒数"""
+        if self.state == OPEN:
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+        return max(0.0, self._probes_started_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened,
+            'rejected': self.rejected
+        }
+
+
+class StaleEntry:
+    __slots__ = ('value', 'stored_at')
+
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+    @property
+    def age(self):
+        return time.time() - self.stored_at
+
+
+class CircuitBreakers:
+    """
+    按 (上游, 主机) 区分的熔断器，以及上游不可用时使用的最近一次成功结果
+
+    代理请求成功时按缓存键保存规范化后的结果；熔断打开或上游请求失败时，
+    不超过 `stale_max_age` 秒的旧结果仍可返回给客户端，并标明数据的时长。
+    旧结果最多保留 `stale_max_entries` 条，按 LRU 淘汰。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_requests=1,
+                 stale_max_age=3600.0, stale_max_entries=4096):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.stale_max_age = stale_max_age
+        self.stale_max_entries = stale_max_entries
+        self._breakers = {}
+        self._last_good = OrderedDict()
+        self.stale_served = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建熔断器"""
+        return cls(**cls.config_options(api_config))
+
+    @classmethod
+    def config_options(cls, api_config):
+        """解析 `api` 配置项中熔断器的参数"""
+        return dict(
+            failure_threshold=int(api_config.get('circuit_failure_threshold', 5)),
+            reset_timeout=float(api_config.get('circuit_reset_timeout', 30)),
+            half_open_requests=int(api_config.get('circuit_half_open_requests', 1)),
+            stale_max_age=float(api_config.get('stale_max_age', 3600)),
+            stale_max_entries=int(api_config.get('stale_max_entries', 4096))
+        )
+
+    def reconfigure(self, options):
+        """应用 config_options 解析出的新参数，已有熔断器保留当前状态"""
+        for name, value in options.items():
+            setattr(self, name, value)
+        for breaker in self._breakers.values():
+            breaker.failure_threshold = self.failure_threshold
+            breaker.reset_timeout = self.reset_timeout
+            breaker.half_open_requests = self.half_open_requests
+        while len(self._last_good) > self.stale_max_entries:
+            self._last_good.popitem(last=False)
+
+    def get(self, upstream, host):
+        """返回 (上游, 主机) 对应的熔断器"""
+        key = (upstream, host)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout, self.half_open_requests
+            )
+        return breaker
+
+    def remember(self, key, value):
+        """保存缓存键对应的最近一次成功结果"""
+        if self.stale_max_age <= 0:
+            return
+        self._last_good[key] = StaleEntry(value, time.time())
+        self._last_good.move_to_end(key)
+        while len(self._last_good) > self.stale_max_entries:
+            self._last_good.popitem(last=False)
+
+    def stale(self, key):
+        """返回缓存键对应的未超过 `stale_max_age` 的旧结果，没有时返回 None"""
+        entry = self._last_good.get(key)
+        if entry is None or entry.age > self.stale_max_age:
+            return None
+        self.stale_served += 1
+        return entry
+
+    def stats(self):
+        return {
+            'open': sum(1 for breaker in list(self._breakers.values()) if breaker.state != CLOSED),
+            'stale_entries': len(self._last_good),
+            'stale_served': self.stale_served,
+            'circuits': {
+                f'{upstream}:{host}': breaker.stats() for (upstream, host), breaker in list(self._breakers.items())
+            }
+        }
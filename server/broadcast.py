@@ -0,0 +1,128 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+
+import fastjson
+
+
+def sse_frame(event, data):
+    """编码一条 Server-Sent Events 消息"""
+    return b'event: ' + event.encode('utf-8') + b'\ndata: ' + fastjson.dumps(data) + b'\n\n'
+
+
+class UpdateBroadcaster:
+    """
+    设备数据和警报等级变化的推送
+
+    每条更新只编码一次，追加到所有订阅者共享的消息队列中，发布的开销与订阅者数量无关。
+    每个订阅者按自己的进度读取队列，一次取出积压的全部消息，同一设备的同类消息只发送最新一条。
+    队列最多保留 `buffer_size` 条消息，订阅者落后超过这个数量时跳过积压的消息，
+    并收到 `resync` 事件提示重新获取全部数据。
+    """
+
+    def __init__(self, buffer_size=4096, keepalive=15.0):
+        self.buffer_size = buffer_size
+        self.keepalive = keepalive
+        # (序号, 设备ID, (事件, 设备ID), 已编码的消息)
+        self._log = deque()
+        self._seq = 0
+        self._changed = asyncio.Event()
+        self._closed = False
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.resyncs = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建推送"""
+        return cls(
+            buffer_size=int(api_config.get('push_buffer_size', 4096)),
+            keepalive=float(api_config.get('push_keepalive', 15))
+        )
+
+    def publish(self, event, device_id, data):
+        """
+        推送一条消息
+
+        Args:
+            event: 事件名，如 `reading` 或 `alert`
+            device_id: 消息对应的设备ID
+            data: 可 JSON 序列化的消息内容
+        """
+        self.published += 1
+        if not self.subscribers:
+            return
+        self._seq += 1
+        self._log.append((self._seq, device_id, (event, device_id), sse_frame(event, data)))
+        if len(self._log) > self.buffer_size:
+            self._log.popleft()
+        # 唤醒正在等待的订阅者，之后的等待使用新的 Event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _take(self, cursor, ids):
+        # 返回 cursor 之后的消息，同一设备的同类消息只保留最新一条；落后过多时返回 None
+        first = self._log[0][0] if self._log else self._seq + 1
+        if cursor + 1 < first:
+            return None
+        latest = {}
+        count = 0
+        for _, device_id, key, frame in itertools.islice(self._log, cursor + 1 - first, None):
+            if ids is not None and device_id not in ids:
+                continue
+            count += 1
+            latest.pop(key, None)
+            latest[key] = frame
+        self.delivered += len(latest)
+        self.coalesced += count - len(latest)
+        return b''.join(latest.values())
+
+    async def stream(self, ids=None, initial=None):
+        """
+        订阅更新，产出 SSE 格式的字节串
+
+        Args:
+            ids: 可选，只订阅这些设备
+            initial: 可选，订阅后首先发送的 `snapshot` 事件内容
+        """
+        ids = set(ids) if ids else None
+        cursor = self._seq
+        self.subscribers += 1
+        logging.debug(f'新的推送订阅，当前共 {self.subscribers} 个')
+        try:
+            if initial is not None:
+                yield sse_frame('snapshot', initial)
+            while not self._closed:
+                if cursor == self._seq:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=self.keepalive)
+                    except asyncio.TimeoutError:
+                        # 注释行用于保持连接，避免被代理服务器断开
+                        yield b': keepalive\n\n'
+                    continue
+                data = self._take(cursor, ids)
+                cursor = self._seq
+                if data is None:
+                    self.resyncs += 1
+                    yield sse_frame('resync', {})
+                elif data:
+                    yield data
+        finally:
+            self.subscribers -= 1
+
+    def stats(self):
+        return {
+            'subscribers': self.subscribers,
+            'published': self.published,
+            'delivered': self.delivered,
+            'coalesced': self.coalesced,
+            'resyncs': self.resyncs
+        }
+
+    def close(self):
+        """结束所有订阅连接"""
+        self._closed = True
+        self._changed.set()
@@ -0,0 +1,46 @@
+import os
+import sys
+import logging
+
+# 服务器以脚本方式启动，需要将项目根目录加入搜索路径以复用 models 包
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.device import Device, DeviceList
+from models.enums import DeviceType
+
+
+def _threshold(value):
+    # GUI 中未填写的阈值保存为空字符串，视为不报警
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('inf')
+
+def load_device_list(config):
+    """
+    从配置文件内容中读取 `device_list` 配置项
+
+    Args:
+        config: settings.json 解析后的列表
+
+    Returns:
+        DeviceList 对象，类型无法识别的设备会被跳过
+    """
+    device_list = DeviceList()
+    device_config = next((item for item in config if item.get("setting") == "device_list"), {})
+    for item in device_config.get('value', []):
+        try:
+            device_type = DeviceType(item.get('type', DeviceType.ALIYUN.value))
+        except ValueError:
+            logging.warning(f"设备 {item.get('id')} 的类型 {item.get('type')} 无法识别，已跳过")
+            continue
+        device_list.add_device(Device(
+            item.get('id'),
+            item.get('url'),
+            device_type,
+            _threshold(item.get('alert_yellow')),
+            _threshold(item.get('alert_orange')),
+            _threshold(item.get('alert_red')),
+            item.get('alert_property')
+        ))
+    return device_list
@@ -1,27 +1,258 @@
-from typing import Annotated, Optional
-from fastapi import FastAPI, Body, Query, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from email.mime.text import MIMEText
-from email.header import Header
-import os
-import requests
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Optional
+from fastapi import FastAPI, Body, Query, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, EmailStr
+import asyncio
 import json
 import argparse
-import smtplib
 import logging
+import os
+import shutil
+import tempfile
+
+from alerts import ThresholdEvaluator, ALERT_LEVEL_NAMES
+from aliyun import AliyunSigner
+from breaker import CircuitBreakers
+from broadcast import UpdateBroadcaster
+from devices import load_device_list
+from history import ReadingStore
+from httpcache import not_modified, snapshot_response
+import fastjson
+from huawei import HuaweiIAMTokenManager
+from jsonstream import filter_data, stream_filtered
+from mailer import MailWorker, AlertDigest
+from metrics import MetricsRegistry, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from poller import DevicePoller
+from proxy import fetch_aliyun, fetch_huawei, fetch_device, huawei_http_exception
+from proxy_cache import ProxyResponseCache
+from ratelimit import UpstreamRateLimits
+from reqlog import RequestLogWriter
+from settings import Settings, ConfigWatcher
+from snapshot import SnapshotCache, SingleValueIndex, file_signature, signature_etag
+from upstream import UpstreamClient
+from workers import SharedSnapshots, SharedTokenStore, WorkerCoordinator
+
+# 修改后需要重启服务才能生效的 `api` 配置项（键名前缀），这些参数只在创建连接池、数据库、日志文件等时使用
+RESTART_REQUIRED_API_KEYS = ('port', 'workers', 'shared_dir', 'upstream_max_connections', 'upstream_keepalive_expiry',
+                             'metrics_', 'push_', 'history_', 'request_log_', 'config_', 'drain_timeout')
+RESTART_REQUIRED_MAIL_KEYS = ('queue_size',)
+
+# 设备轮询发布的快照
+POLLER_SNAPSHOTS = ('final.json', 'output.json', 'alert_levels.json')
+
+def start_leader_services():
+    """启动只应在一个进程中运行的后台任务：Token 续期、设备轮询、警报汇总、历史数据写入和日志轮转"""
+    app.state.request_log.rotate = True
+    app.state.huawei_token_manager.start()
+    if app.state.alert_digest:
+        app.state.alert_digest.start()
+    if app.state.reading_store:
+        app.state.reading_store.start()
+    app.state.poller = DevicePoller.from_config(app.state, app.state.config)
+    if app.state.poller:
+        app.state.poller.start()
+
+async def stop_poller(poller, unpublish=True):
+    """
+    停止设备轮询
+
+    Args:
+        poller: 要停止的 DevicePoller
+        unpublish: 是否撤销轮询发布的快照（多进程模式下包括共享存储中的快照），
+            撤销后 `/GetDVData` 等接口重新读取磁盘上的文件，而不是一直返回最后一轮轮询的结果
+    """
+    await poller.aclose()
+    if unpublish:
+        for path in POLLER_SNAPSHOTS:
+            app.state.snapshot_cache.unpublish(path)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    shared_dir = os.environ.get('FASTAPP_SHARED_DIR')
+    if shared_dir and not hasattr(app.state, 'config'):
+        # 多进程模式下的工作进程由 uvicorn 重新导入本模块，需要自行加载配置
+        logging.basicConfig(level=os.environ.get('FASTAPP_LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+        configure(os.environ['FASTAPP_CONFIG'])
+        app.state.snapshot_cache = SnapshotCache(shared=SharedSnapshots(shared_dir))
+        app.state.huawei_token_manager.shared_tokens = SharedTokenStore(shared_dir)
+    app.state.metrics = MetricsRegistry.from_config(app.state.api_config)
+    app.state.metrics.start()
+    # 代理接口共享的上游连接池，随服务启动和关闭
+    app.state.upstream = UpstreamClient.from_config(app.state.api_config)
+    app.state.upstream.metrics = app.state.metrics
+    app.state.proxy_cache = ProxyResponseCache.from_config(app.state.api_config)
+    app.state.rate_limits = UpstreamRateLimits.from_config(app.state.api_config)
+    app.state.circuit_breakers = CircuitBreakers.from_config(app.state.api_config)
+    app.state.rate_limits.metrics = app.state.metrics
+    app.state.request_log = RequestLogWriter.from_config(app.state.api_config)
+    app.state.request_log.rotate = False
+    app.state.request_log.start()
+    app.state.huawei_token_manager.client = app.state.upstream
+    app.state.mail_worker.metrics = app.state.metrics
+    app.state.mail_worker.start()
+    app.state.alert_digest = AlertDigest.from_config(app.state.mail_worker, app.state.mail_config)
+    app.state.broadcaster = UpdateBroadcaster.from_config(app.state.api_config)
+    app.state.reading_store = ReadingStore.from_config(app.state.api_config)
+    if app.state.reading_store:
+        app.state.reading_store.open()
+    app.state.poller = None
+    app.state.coordinator = None
+    if shared_dir:
+        app.state.coordinator = WorkerCoordinator(app.state, shared_dir)
+        app.state.coordinator.start(start_leader_services)
+    else:
+        start_leader_services()
+    app.state.reload_lock = asyncio.Lock()
+    app.state.config_watcher = None
+    if app.state.api_config.get('config_watch', True):
+        # 多进程模式下每个工作进程各自监视并重新加载
+        app.state.config_watcher = ConfigWatcher(
+            app.state.config_path, reload_settings,
+            poll_interval=float(app.state.api_config.get('config_poll_interval', 2))
+        )
+        app.state.config_watcher.start()
+    yield
+    if app.state.config_watcher:
+        await app.state.config_watcher.aclose()
+    app.state.broadcaster.close()
+    if app.state.coordinator:
+        await app.state.coordinator.aclose()
+    if app.state.poller:
+        await app.state.poller.aclose()
+    if app.state.reading_store:
+        await app.state.reading_store.aclose()
+    if app.state.alert_digest:
+        await app.state.alert_digest.aclose()
+    await app.state.mail_worker.aclose()
+    await app.state.huawei_token_manager.aclose()
+    await app.state.rate_limits.aclose()
+    await app.state.upstream.aclose()
+    await app.state.request_log.aclose()
+    await app.state.metrics.aclose()
+
+async def begin_drain():
+    """
+    平滑重启时旧进程停止监听前调用
+
+    结束推送连接，客户端会重新连接到新进程；停止设备轮询，避免与新进程重复请求上游。
+    已发布的快照保留，排空期间的请求和多进程模式下的其他进程仍可读取，直到新的主进程重新发布。
+    其他后台任务在请求排空后随服务一起关闭。
+    """
+    app.state.broadcaster.close()
+    if app.state.poller:
+        poller, app.state.poller = app.state.poller, None
+        await stop_poller(poller, unpublish=False)
+
+async def reload_settings():
+    """
+    重新加载配置文件并应用到正在运行的服务
+
+    先根据新配置解析全部参数、创建需要替换的对象，任何一步失败都不改变当前配置；随后在不让出事件循环的情况下
+    一次性替换，同时处理的请求看到的要么全是旧配置，要么全是新配置。连接池、缓存、熔断和限流状态保留，
+    AccessKeySecret 和 IAM 凭据未变化时签名器和 Token 也保留。设备列表变化时警报等级和最新读数按设备ID沿用。
+
+    Returns:
+        `{"version": 配置版本, "changes": 与之前配置的差异, "restart_required": 需要重启服务才能生效的配置项}`
+
+    Raises:
+        OSError: 配置文件无法读取
+        ValueError: 配置文件不合法
+    """
+    state = app.state
+    async with state.reload_lock:
+        old = state.settings
+        new = Settings.load(state.config_path, old.version + 1)
+        changes = old.diff(new)
+        if not changes:
+            return {"version": old.version, "changes": {}, "restart_required": []}
+        api, mail = new.api, new.mail
+
+        # 解析新配置并创建需要替换的对象，尚未修改任何状态
+        upstream_options = UpstreamClient.config_options(api)
+        breaker_options = CircuitBreakers.config_options(api)
+        rate_limit_options = UpstreamRateLimits.config_options(api)
+        proxy_cache_options = ProxyResponseCache.config_options(api)
+        mail_options = MailWorker.config_options(mail)
+        digest_options = AlertDigest.config_options(mail)
+        batch_concurrency = int(api.get('batch_concurrency', 16))
+        stream_threshold = int(api.get('stream_threshold', 16 * 1024 * 1024))
+        refresh_margin = float(api.get('huawei_iam_refresh_margin', 300))
+        secret = api['access-key-secret']
+        signer = state.aliyun_signer if secret == state.secret else AliyunSigner(secret)
+        device_list, evaluator = state.device_list, state.alert_evaluator
+        if 'device_list' in changes or mail.get('alert_hysteresis') != old.mail.get('alert_hysteresis'):
+            device_list = load_device_list(new.config)
+            evaluator = ThresholdEvaluator(device_list.devices, hysteresis=float(mail.get('alert_hysteresis', 0.05)))
+            evaluator.restore_levels(state.alert_evaluator.current_levels())
+        is_leader = state.coordinator is None or state.coordinator.is_leader
+        old_poller, poller = state.poller, state.poller
+        if is_leader and (device_list is not state.device_list or 'request_cycle' in changes):
+            poller = DevicePoller.from_config(state, new.config, devices=device_list.devices)
+        old_digest, digest = state.alert_digest, state.alert_digest
+        if digest_options is None:
+            digest = None
+        elif old_digest is None:
+            digest = AlertDigest(state.mail_worker, **digest_options)
 
-from aliyun import aliyun_beautify_response, aliyun_add_authentication
-from huawei import HuaweiIAMTokenManager, huawei_get_data
+        # 一次性替换，期间没有 await
+        state.settings = new
+        state.config = new.config
+        state.api_config = api
+        state.mail_config = mail
+        state.secret = secret
+        state.aliyun_signer = signer
+        state.device_list = device_list
+        state.alert_evaluator = evaluator
+        state.batch_concurrency = batch_concurrency
+        state.stream_threshold = stream_threshold
+        state.upstream.reconfigure(upstream_options)
+        state.circuit_breakers.reconfigure(breaker_options)
+        state.rate_limits.reconfigure(rate_limit_options)
+        state.proxy_cache.reconfigure(proxy_cache_options)
+        state.mail_worker.reconfigure(mail_options)
+        if digest is not None and digest is old_digest:
+            digest.reconfigure(digest_options)
+        state.alert_digest = digest
+        state.poller = poller
+        state.huawei_token_manager.refresh_margin = refresh_margin
+        state.huawei_token_manager.set_default_credentials(
+            api.get('huawei_iam_username'), api.get('huawei_iam_password'),
+            api.get('huawei_iam_area'), api.get('huawei_iam_domain')
+        )
+
+        # 启动新的后台任务，关闭被替换的任务；被替换的警报摘要关闭时按原设置发出尚未发送的警报
+        if poller is not old_poller:
+            if old_poller:
+                # 停用轮询时撤销它发布的快照；替换为新的轮询时由新轮询沿用读数并重新发布
+                await stop_poller(old_poller, unpublish=poller is None)
+            if poller:
+                poller.restore_readings(old_poller.readings if old_poller else {})
+                poller.start()
+        if digest is not old_digest:
+            if digest and is_leader:
+                digest.start()
+            if old_digest:
+                await old_digest.aclose()
+
+        restart_required = [f'api.{key}' for key in changes.get('api', {}) if key.startswith(RESTART_REQUIRED_API_KEYS)]
+        restart_required += [f'mail.{key}' for key in changes.get('mail', {}) if key in RESTART_REQUIRED_MAIL_KEYS]
+        logging.info(f'配置已重新加载（版本 {new.version}）: {changes}')
+        if restart_required:
+            logging.warning(f'以下配置项需要重启服务才能生效: {", ".join(restart_required)}')
+        return {"version": new.version, "changes": changes, "restart_required": restart_required}
 
 app = FastAPI(
     title="API 代理服务",
     version="2.0",
+    lifespan=lifespan,
+    default_response_class=fastjson.FastJSONResponse,
 )
+app.add_middleware(MetricsMiddleware)
 
 class SendMailRequest(BaseModel):
     subject: str
-    address: str
+    address: EmailStr
     body: str
 
 @app.head("/", summary="服务状态检查", responses={200: {"description": "Service is running"}})
@@ -29,7 +260,7 @@ async def service_status():
     """
     检查服务是否正常运行。
     """
-    return JSONResponse(content={"status": "Service is running"})
+    return fastjson.FastJSONResponse(content={"status": "Service is running"})
 
 @app.get("/GetDVData", summary="获取全部数据", responses={
     200: {
@@ -53,15 +284,42 @@ async def service_status():
     },
     500: {"description": "Internal Server Error"}
 })
-async def get_dv_data():
+async def get_dv_data(
+    request: Request,
+    id: Annotated[Optional[List[str]], Query(description="设备ID，可重复；只返回这些设备的数据", example="bridge-1")] = None,
+    start: Annotated[Optional[float], Query(description="时间范围起点（含），与数据中 time 的单位相同")] = None,
+    end: Annotated[Optional[float], Query(description="时间范围终点（含），与数据中 time 的单位相同")] = None
+):
     """
     返回 `final.json` 文件中的数据。
+    
+    启用内置设备轮询（`request_cycle` 配置项中 `enabled` 为 `true`）时，返回轮询得到的各设备最新数据 `{设备ID: 数据}`。
+    
+    提供 `id`、`start` 或 `end` 时只返回匹配的设备和读数；设备的数据为读数列表（历史数据）时按读数的 `time` 逐条过滤。
+    文件大于 `api` 配置项中的 `stream_threshold` 字节时不再整体解析：不过滤时直接以文件流返回，
+    过滤时增量解析文件并流式返回结果，内存占用与文件大小无关。
+    
+    响应带有由数据版本生成的 `ETag`（流式返回时由文件的修改时间、大小和 inode 生成），
+    请求头 `If-None-Match` 与之匹配时返回 `304 Not Modified`；
+    客户端接受时返回预先压缩的 gzip 或 br（需要安装 brotli）响应，流式返回的响应不压缩。
     """
+    filtering = bool(id) or start is not None or end is not None
     try:
-        final_file_path = os.path.expanduser('final.json')
-        with open(final_file_path, 'r', encoding='utf-8') as file:
-            json_data = json.load(file)
-        return JSONResponse(content=json_data)
+        snapshot = app.state.snapshot_cache.get_published('final.json')
+        if snapshot is None:
+            signature = file_signature('final.json')
+            if signature[1] > app.state.stream_threshold:
+                headers = {'ETag': signature_etag(signature)}
+                if not_modified(request, headers['ETag']):
+                    return Response(status_code=304, headers=headers)
+                if not filtering:
+                    return FileResponse('final.json', media_type="application/json", headers=headers)
+                return StreamingResponse(stream_filtered('final.json', id, start, end), media_type="application/json",
+                                         headers=headers)
+            snapshot = await app.state.snapshot_cache.aget('final.json')
+        if not filtering:
+            return await snapshot_response(request, snapshot)
+        return await snapshot_response(request, snapshot, body=fastjson.dumps(filter_data(snapshot.data, id, start, end)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"JSON文件读取失败: {str(e)}")
 
@@ -87,27 +345,259 @@ async def get_dv_data():
     500: {"description": "Internal Server Error"}
 })
 async def get_single_data(
-    id: Annotated[str, Query(description="数据ID", example="123")],
-    key: Annotated[str, Query(description="数据键", example="name")]
+    request: Request,
+    id: Annotated[List[str], Query(description="数据ID，可重复以批量查询", example="123")],
+    key: Annotated[List[str], Query(description="数据键，可重复以批量查询", example="name")]
 ):
     """
     根据 `id` 和 `key` 字段的值，返回 `output.json` 文件中的数据。
+    
+    只提供一个 `id` 和一个 `key` 时返回 `{key: value}`；提供多个 `id` 或 `key` 时（如 `?id=1&id=2&key=a&key=b`），
+    返回 `{id: {key: value}}`，不存在的组合会被忽略。
     """
-    if not id or not key:
+    if not all(id) or not all(key):
         raise HTTPException(status_code=400, detail="缺少必要的字段")
     
     try:
-        output_file_path = os.path.expanduser('output.json')
-        with open(output_file_path, 'r', encoding='utf-8') as file:
-            data_dict = json.load(file)
+        snapshot = await app.state.snapshot_cache.aget('output.json', indexer=SingleValueIndex)
         
-        if id in data_dict and key in data_dict[id]:
-            return JSONResponse(content={key: data_dict[id][key]})
+        if len(id) == 1 and len(key) == 1:
+            body = snapshot.index.single(id[0], key[0])
+        else:
+            body = snapshot.index.batch(id, key)
+        if body is not None:
+            return await snapshot_response(request, snapshot, body=body)
         
         raise HTTPException(status_code=404, detail="缺少必要的字段")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"输出文件处理失败: {str(e)}")
 
+@app.get("/GetCacheStats", summary="获取数据缓存统计")
+async def get_cache_stats():
+    """
+    返回 `final.json` 和 `output.json` 快照缓存，以及代理响应缓存的命中统计。
+    """
+    return {
+        "snapshot": app.state.snapshot_cache.stats(),
+        "proxy": app.state.proxy_cache.stats()
+    }
+
+@app.get("/metrics", summary="Prometheus 指标", responses={
+    200: {
+        "description": "Successful Response",
+        "content": {
+            "text/plain": {
+                "examples": {
+                    "metrics": {
+                        "summary": "Prometheus 指标",
+                        "description": "Prometheus 文本格式的服务指标。",
+                        "value": '# TYPE fastapp_requests_total counter\n'
+                                 'fastapp_requests_total{method="GET",route="/GetDVData",status="200"} 42\n'
+                    }
+                }
+            }
+        }
+    }
+})
+async def get_metrics():
+    """
+    以 Prometheus 文本格式返回服务指标：
+    
+    - `fastapp_requests_total`、`fastapp_request_duration_seconds`：按路由和状态码统计的请求次数和处理耗时
+    - `fastapp_requests_in_flight`：正在处理的请求数
+    - `fastapp_upstream_calls_total`、`fastapp_upstream_duration_seconds`：阿里云、华为云、IAM 和 SMTP 的调用次数、结果和耗时
+    - `fastapp_event_loop_lag_seconds`：事件循环调度延迟，每 `api` 配置项中 `metrics_lag_interval` 秒（默认 0.5）采样一次
+    - `fastapp_snapshot_cache_*`、`fastapp_proxy_cache_*` 等：各组件的命中率、队列长度等统计
+    
+    多进程模式下每个工作进程分别统计，返回的是处理本次请求的进程的指标。
+    """
+    return Response(content=app.state.metrics.render(app.state), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/GetRateLimitStats", summary="获取上游限流状态")
+async def get_rate_limit_stats():
+    """
+    返回每个上游平台和凭据的限流状态：剩余令牌、排队请求数、平均和最大排队时间、被拒绝的请求数。
+    
+    速率由 `api` 配置项中的 `rate_limits` 设置，如 `{"aliyun": {"rate": 50, "burst": 100}, "huawei": {"rate": 20}}`，
+    未配置的上游不限流。令牌不足时请求按设备 URL 公平排队，预计排队超过 `rate_limit_max_wait` 秒（默认 10）
+    的请求直接返回 `429 Too Many Requests`，并带有 `Retry-After` 响应头。
+    """
+    return app.state.rate_limits.stats()
+
+@app.get("/GetCircuitStatus", summary="获取上游熔断状态")
+async def get_circuit_status():
+    """
+    返回每个上游主机的熔断状态（`closed` 正常、`open` 熔断中、`half_open` 试探中）、连续失败次数和被拒绝的请求数，
+    以及保存的最近一次成功结果的数量和已返回的旧结果次数。
+    
+    连续失败 `api` 配置项中的 `circuit_failure_threshold` 次（默认 5）后熔断，`circuit_reset_timeout` 秒（默认 30）后
+    放行 `circuit_half_open_requests` 个（默认 1）试探请求。旧结果最多使用 `stale_max_age` 秒（默认 3600，0 表示不使用）。
+    """
+    return app.state.circuit_breakers.stats()
+
+@app.get("/GetUpstreamStatus", summary="获取上游耗时和超时")
+async def get_upstream_status():
+    """
+    返回每个上游主机最近请求耗时的 p50、p95、p99 和当前的读取超时，以及对冲请求的统计。
+    
+    读取超时为 p99 乘以 `api` 配置项中的 `upstream_timeout_multiplier`（默认 3），不小于 `upstream_min_timeout`（默认 1）
+    且不大于 `upstream_timeout`（默认 10），`upstream_adaptive_timeout` 为 `false` 时固定为 `upstream_timeout`。
+    
+    `upstream_hedge` 为 `true` 时，读取设备数据的请求超过该主机 p95 耗时仍未返回会再发送一次，采用先返回的结果；
+    对冲请求数不超过可对冲请求数的 `upstream_hedge_budget` 比例（默认 0.05）。`hedge_wins` 为对冲请求先返回的次数。
+    """
+    return app.state.upstream.stats()
+
+@app.post("/ReloadConfig", summary="重新加载配置文件", responses={400: {"description": "Invalid Config"}})
+async def reload_config():
+    """
+    重新读取启动时 `--config` 指定的配置文件，不重启服务即可应用设备、密钥、IAM 凭据和邮件设置的修改，返回应用的差异。
+    
+    服务默认监视配置文件，文件变化后自动重新加载（Linux 上使用 inotify，其他平台每 `api` 配置项中
+    `config_poll_interval` 秒检查一次，`config_watch` 为 `false` 时不监视），本接口用于立即重新加载。
+    
+    正在处理的请求、连接池、缓存和凭据未变化的 Token 不受影响。`changes` 中密码和密钥的取值以 `******` 代替；
+    `restart_required` 列出已修改但需要重启服务才能生效的配置项，如端口、工作进程数和日志路径。
+    配置文件不合法时返回 `400`，继续使用当前配置。多进程模式下只重新加载处理本次请求的进程，其他进程由文件监视重新加载。
+    """
+    try:
+        return await reload_settings()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"配置文件加载失败: {str(e)}")
+
+@app.get("/GetPollerStatus", summary="获取设备轮询状态", responses={404: {"description": "Not Found"}})
+async def get_poller_status():
+    """
+    返回内置设备轮询任务的请求次数、失败设备和调度延迟。仅当 `request_cycle` 配置项中 `enabled` 为 `true` 时可用。
+    """
+    if not app.state.poller:
+        raise HTTPException(status_code=404, detail="设备轮询未启用")
+    return app.state.poller.stats()
+
+@app.get("/GetAlertLevels", summary="获取设备警报等级")
+async def get_alert_levels():
+    """
+    返回每个设备当前的警报等级：`0` 正常、`1` 黄色、`2` 橙色、`3` 红色。
+    
+    警报等级由内置设备轮询的读数判定：设备设置了 `alert_property` 时取该属性，否则取读数中除 `time` 外数值最大的属性，与设备的阈值比较。
+    """
+    # 多进程模式下只有主进程判定警报，其他进程读取主进程发布的等级
+    snapshot = app.state.snapshot_cache.get_published('alert_levels.json')
+    levels = snapshot.data if snapshot else app.state.alert_evaluator.current_levels()
+    return {
+        device_id: {"level": level, "level_name": ALERT_LEVEL_NAMES[level]}
+        for device_id, level in levels.items()
+    }
+
+@app.get("/GetUpdates", summary="订阅设备数据更新", responses={
+    200: {
+        "description": "Successful Response",
+        "content": {
+            "text/event-stream": {
+                "examples": {
+                    "GetUpdates": {
+                        "summary": "订阅设备数据更新",
+                        "description": "Server-Sent Events 格式的推送消息。",
+                        "value": 'event: snapshot\ndata: {"bridge-1":{"strain":1.5,"time":1700000000}}\n\n'
+                                 'event: reading\ndata: {"id":"bridge-1","data":{"strain":1.6,"time":1700000060}}\n\n'
+                                 'event: alert\ndata: {"id":"bridge-1","level":1,"level_name":"黄色警报","previous_level":0,"value":1.6}\n\n'
+                    }
+                }
+            }
+        }
+    }
+})
+async def get_updates(
+    id: Annotated[Optional[List[str]], Query(description="设备ID，可重复；不提供时订阅全部设备", example="bridge-1")] = None
+):
+    """
+    以 Server-Sent Events 格式推送内置设备轮询的数据更新，客户端无需定时请求 `/GetDVData`。
+    
+    连接后首先发送 `snapshot` 事件，内容为当前各设备的最新数据；之后设备读数变化时发送 `reading` 事件，
+    警报等级变化时发送 `alert` 事件。客户端处理过慢时，同一设备尚未发送的旧消息会被新消息替换；
+    积压超过 `api` 配置项中的 `push_max_pending` 条时丢弃积压的消息并发送 `resync` 事件，客户端应重新获取全部数据。
+    """
+    snapshot = app.state.snapshot_cache.get_published('final.json')
+    readings = snapshot.data if snapshot else {}
+    initial = {device_id: reading for device_id, reading in readings.items() if not id or device_id in id}
+    return StreamingResponse(
+        app.state.broadcaster.stream(id, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/GetHistoryData", summary="查询历史读数", responses={
+    200: {
+        "description": "Successful Response",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "GetHistoryData": {
+                        "summary": "查询历史读数",
+                        "description": "按时间升序返回 [时间, 值] 列表。",
+                        "value": [[1700000000, 1.5], [1700000060, 1.6]]
+                    }
+                }
+            }
+        }
+    },
+    404: {"description": "Not Found"}
+})
+async def get_history_data(
+    id: Annotated[str, Query(description="设备ID", example="bridge-1")],
+    key: Annotated[str, Query(description="属性名", example="strain")],
+    start: Annotated[Optional[float], Query(description="时间范围起点（含），与读数中 time 的单位相同")] = None,
+    end: Annotated[Optional[float], Query(description="时间范围终点（不含），与读数中 time 的单位相同")] = None,
+    limit: Annotated[int, Query(description="最多返回的读数条数", gt=0, le=100000)] = 10000
+):
+    """
+    返回内置设备轮询保存的某个设备某个数值属性在时间范围内的历史读数。
+    
+    历史读数保存在 `api` 配置项中 `history_path` 指定的 SQLite 数据库中（默认 `history.db`），设为空字符串时不保存。
+    超过 `history_retention` 秒（默认 30 天，设为 0 时永久保存）的读数会被定期删除。
+    """
+    if app.state.reading_store is None:
+        raise HTTPException(status_code=404, detail="未启用历史数据存储")
+    return await asyncio.to_thread(app.state.reading_store.query, id, key, start, end, limit)
+
+@app.get("/GetHistorySummary", summary="查询降采样的历史读数", responses={
+    200: {
+        "description": "Successful Response",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "GetHistorySummary": {
+                        "summary": "查询降采样的历史读数",
+                        "description": "按时间桶返回最小值、最大值、平均值和读数条数，没有读数的桶不返回。",
+                        "value": [{"time": 1700000000, "min": 1.2, "max": 1.8, "avg": 1.5, "count": 60}]
+                    }
+                }
+            }
+        }
+    },
+    400: {"description": "Invalid Request"},
+    404: {"description": "Not Found"}
+})
+async def get_history_summary(
+    id: Annotated[str, Query(description="设备ID", example="bridge-1")],
+    key: Annotated[str, Query(description="属性名", example="strain")],
+    start: Annotated[float, Query(description="时间范围起点（含），也是第一个时间桶的起点")],
+    end: Annotated[float, Query(description="时间范围终点（不含）")],
+    bucket: Annotated[float, Query(description="时间桶宽度，与读数中 time 的单位相同", gt=0)]
+):
+    """
+    将某个设备某个数值属性在时间范围内的历史读数按固定宽度的时间桶汇总，返回每个桶的最小值、最大值和平均值。
+    
+    汇总在数据库中完成，只扫描该属性在时间范围内的读数。时间桶数量不能超过 100000。
+    """
+    if app.state.reading_store is None:
+        raise HTTPException(status_code=404, detail="未启用历史数据存储")
+    if end <= start or (end - start) / bucket > 100000:
+        raise HTTPException(status_code=400, detail="时间范围或时间桶宽度无效")
+    return await asyncio.to_thread(app.state.reading_store.downsample, id, key, start, end, bucket)
+
 @app.get("/aliyun", summary="阿里云物联网平台 API 代理", responses={
     200: {
         "description": "Successful Response",
@@ -137,17 +627,13 @@ async def aliyun_api_handler(
     代理请求阿里云物联网平台 URL 并返回响应。此处的 URL 不需要加入签名和时间戳信息。
     
     阿里云对于应用端的 URL 希望加入时间戳、签名等参数。请在你的配置文件中定义 AccessKeySecret，服务器会自动处理签名等步骤。
+    
+    上游连续失败时熔断，熔断期间或上游请求失败时返回该 URL 最近一次成功的结果，响应头 `Age` 为结果的时长（秒）；
+    没有可用的旧结果时立即返回 `503`。
     """
-    access_key_secret = app.state.secret
-    authenticated_url = aliyun_add_authentication(url, access_key_secret)
-    log_request(url, authenticated_url)
-    try:
-        response = requests.get(authenticated_url)
-    except:
-        raise HTTPException(status_code=500, detail="请求失败")
-    response_content = aliyun_beautify_response(response)
-    print(response_content)
-    return JSONResponse(content=json.loads(response_content), status_code=response.status_code)
+    status_code, response_data, age = await fetch_aliyun(app.state, url)
+    logging.debug(f'阿里云响应: {response_data}')
+    return fastjson.FastJSONResponse(content=response_data, status_code=status_code, headers=stale_headers(age))
 
 @app.get("/huawei", summary="华为云物联网平台 API 代理", responses={
     200: {
@@ -179,23 +665,79 @@ async def huawei_api_handler(
     请在你的配置文件中定义华为云 IAM 用户名、密码、区域和域名，服务器会自动处理 Token 的生成。
     
     请求的 URL 错误时，将返回原始的状态码，详见[华为云物联网平台 API 文档](https://support.huaweicloud.com/api-iothub/ErrorCode.html)。
+    
+    上游不可用时的熔断和旧结果处理与 `/aliyun` 相同。
     """
-    token = app.state.huawei_token_manager.get_iam_token(
-        username=app.state.huawei_token_manager.username,
-        password=app.state.huawei_token_manager.password,
-        area=app.state.huawei_token_manager.area,
-        domain_name=app.state.huawei_token_manager.domain_name
-    )
     try:
-        response_data = huawei_get_data(token, url)
-        return JSONResponse(content=response_data)
+        response_data, age = await fetch_huawei(app.state, url)
+        return fastjson.FastJSONResponse(content=response_data, headers=stale_headers(age))
     except Exception as e:
-        error_message = str(e)
-        if "Failed to get data" in error_message:
-            # 提取原始状态码
-            status_code = int(error_message.split(":")[1].strip().split()[0])
-            raise HTTPException(status_code=status_code, detail=f"请求失败: {error_message}")
-        raise HTTPException(status_code=500, detail=f"请求失败: {error_message}")
+        raise huawei_http_exception(e)
+
+def stale_headers(age):
+    """返回旧结果的响应头，`age` 为 None 时返回 None"""
+    if age is None:
+        return None
+    return {"Age": str(int(age)), "Warning": '110 - "Response is Stale"'}
+
+@app.get("/GetBatchDeviceData", summary="批量获取设备数据", responses={
+    200: {
+        "description": "Successful Response",
+        "content": {
+            "application/x-ndjson": {
+                "examples": {
+                    "GetBatchDeviceData": {
+                        "summary": "批量获取设备数据",
+                        "description": "每行一个设备的结果，按完成顺序返回。",
+                        "value": '{"id": "bridge-1", "status": "ok", "data": [{"strain": 1.5, "time": 1700000000}]}\n'
+                                 '{"id": "bridge-2", "status": "error", "status_code": 504, "detail": "请求超时"}\n'
+                    }
+                }
+            }
+        }
+    }
+})
+async def batch_device_data_handler(
+    id: Annotated[Optional[List[str]], Query(description="设备ID，可重复；不提供时请求全部已配置的设备", example="bridge-1")] = None
+):
+    """
+    并发请求多个已配置设备的数据，并以 JSON Lines 格式按完成顺序流式返回每个设备的结果。
+    
+    单个设备请求失败不会影响其他设备，失败的设备会以 `status: error` 返回状态码和错误信息。
+    上游不可用而返回最近一次成功的结果时，结果中的 `age` 为该结果的时长（秒）。
+    并发数由 `api` 配置项中的 `batch_concurrency` 控制。
+    """
+    devices = {device.id: device for device in app.state.device_list.devices}
+    ids = list(dict.fromkeys(id)) if id else list(devices)
+    semaphore = asyncio.Semaphore(app.state.batch_concurrency)
+
+    async def fetch_one(device_id):
+        device = devices.get(device_id)
+        if device is None:
+            return {"id": device_id, "status": "error", "status_code": 404, "detail": "设备未配置"}
+        try:
+            async with semaphore:
+                data, age = await fetch_device(app.state, device)
+            if age is not None:
+                return {"id": device_id, "status": "ok", "data": data, "age": age}
+            return {"id": device_id, "status": "ok", "data": data}
+        except HTTPException as e:
+            return {"id": device_id, "status": "error", "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            return {"id": device_id, "status": "error", "status_code": 500, "detail": str(e)}
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(fetch_one(device_id)) for device_id in ids]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                yield fastjson.dumps(result) + b"\n"
+        finally:
+            # 客户端断开时取消尚未完成的请求
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 @app.post("/GetHuaweiIAM", summary="获取华为云 IAM Token", responses={401: {"description": "Unauthorized"}, 500: {"description": "Internal Server Error"}})
 async def get_huawei_iam_token(
@@ -211,26 +753,24 @@ async def get_huawei_iam_token(
     """
     try:
         if iam_username and iam_password and domain_name and area:
-            token = app.state.huawei_token_manager.get_iam_token(
+            token = await app.state.huawei_token_manager.get_iam_token(
                 username=iam_username,
                 password=iam_password,
                 area=area,
                 domain_name=domain_name
             )
         else:
-            token = app.state.huawei_token_manager.get_iam_token(
-                username=app.state.huawei_token_manager.username,
-                password=app.state.huawei_token_manager.password,
-                area=app.state.huawei_token_manager.area,
-                domain_name=app.state.huawei_token_manager.domain_name
-            )
+            token = await app.state.huawei_token_manager.get_default_token()
         return {"token": token}
     except Exception as e:
         if "401" in str(e):
             raise HTTPException(status_code=401, detail="Unauthorized: Invalid credentials")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
-@app.post("/mail", summary="发送邮件", responses={500: {"description": "Internal Server Error"}})
+@app.post("/mail", summary="发送邮件", status_code=202, responses={
+    202: {"description": "邮件已加入发送队列"},
+    503: {"description": "Service Unavailable"}
+})
 async def send_mail_endpoint(request: Annotated[SendMailRequest, Body(
     openapi_examples={
         "example1": {
@@ -256,14 +796,26 @@ async def send_mail_endpoint(request: Annotated[SendMailRequest, Body(
     使用给定的 `subject`、`address` 和 `body` 字段的值，发送邮件。
     
     - `subject`：邮件主题。
-    - `address`：收件人地址。
+    - `address`：收件人地址，不是合法的邮箱地址时返回 `422`。
     - `body`：邮件正文。
+    
+    邮件加入后台发送队列后立即返回 `job_id`，可通过 `/mail/{job_id}` 查询发送结果。
     """
-    success, message = send_mail(request.subject, request.address, request.body)
-    if success:
-        return {"message": message}
-    else:
-        raise HTTPException(status_code=500, detail=f"邮件发送失败: {message}")
+    try:
+        job = app.state.mail_worker.submit(request.subject, [request.address], request.body)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="邮件发送队列已满")
+    return {"message": "邮件已加入发送队列", "job_id": job.id}
+
+@app.get("/mail/{job_id}", summary="查询邮件发送状态", responses={404: {"description": "Not Found"}})
+async def get_mail_status(job_id: str):
+    """
+    返回邮件发送任务的状态：`queued`、`sent` 或 `failed`。
+    """
+    job = app.state.mail_worker.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="邮件任务不存在")
+    return job.to_dict()
 
 def csv_to_json(csv_data):
     csv_data = csv_data.strip().split("\n")
@@ -279,28 +831,42 @@ def csv_to_json(csv_data):
                 json_data.append(row_dict)
     return json.dumps(json_data, ensure_ascii=False)
 
-def log_request(original_url, authenticated_url):
-    log_message = f"Original URL: {original_url}\nAuthenticated URL: {authenticated_url}\n\n"
-    log_file_path = os.path.expanduser('log_req.txt')
-    with open(log_file_path, "a") as log_file:
-        log_file.write(log_message)
-
-def send_mail(subject, address, body):
-    sender = app.state.mail_sender
-    receivers = [address]
-    message = MIMEText(body, 'plain', 'utf-8')
-    message['From'] = Header(sender, 'utf-8')
-    message['To'] = Header(address, 'utf-8')
-    message['Subject'] = Header(subject, 'utf-8')
-    try:
-        logging.info(f'Sending email to {address} with subject: {subject}')
-        smtpObj = smtplib.SMTP(app.state.mail_host, app.state.mail_port)
-        smtpObj.login(sender, app.state.mail_password)
-        logging.debug(f'SMTP login successful')
-        smtpObj.sendmail(sender, receivers, message.as_string())
-        return True, 'Successfully sent email'
-    except smtplib.SMTPException as e:
-        return False, f'Error: unable to send email, {str(e)}'
+def configure(config_path):
+    """
+    加载配置文件并初始化 `app.state`
+
+    Returns:
+        `api` 配置项
+    """
+    settings = Settings.load(config_path)
+    config, api_config, mail_config = settings.config, settings.api, settings.mail
+    secret = api_config['access-key-secret']
+    app.state.config_path = os.path.abspath(config_path)
+    app.state.settings = settings
+    app.state.secret = secret
+    app.state.aliyun_signer = AliyunSigner(secret)
+    app.state.config = config
+    app.state.api_config = api_config
+    app.state.device_list = load_device_list(config)
+    app.state.batch_concurrency = int(api_config.get('batch_concurrency', 16))
+    app.state.stream_threshold = int(api_config.get('stream_threshold', 16 * 1024 * 1024))
+    app.state.alert_evaluator = ThresholdEvaluator(
+        app.state.device_list.devices,
+        hysteresis=float(mail_config.get('alert_hysteresis', 0.05))
+    )
+    app.state.mail_config = mail_config
+    app.state.mail_worker = MailWorker.from_config(mail_config)
+    app.state.snapshot_cache = SnapshotCache()
+    app.state.huawei_token_manager = HuaweiIAMTokenManager(
+        refresh_margin=float(api_config.get('huawei_iam_refresh_margin', 300))
+    )
+    app.state.huawei_token_manager.username = api_config.get('huawei_iam_username')
+    app.state.huawei_token_manager.password = api_config.get('huawei_iam_password')
+    app.state.huawei_token_manager.domain_name = api_config.get('huawei_iam_domain')
+    app.state.huawei_token_manager.area = api_config.get('huawei_iam_area')
+    logging.info(f'FastAPI Config: {api_config}')
+    logging.info(f'Mail Config: {mail_config}')
+    return api_config
 
 def main():
     parser = argparse.ArgumentParser(description='启动FastAPI应用')
@@ -309,31 +875,41 @@ def main():
     args = parser.parse_args()
     log_level = getattr(logging, args.verbose, logging.INFO)
     logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
-    with open(args.config, 'r', encoding='utf-8') as file:
-        config = json.load(file)
-    api_config = next(item for item in config if item["setting"] == "api")
-    mail_config = next(item for item in config if item["setting"] == "mail")
+    api_config = configure(args.config)
     port = int(api_config.get('port', 5200))
-    secret = api_config.get('access-key-secret')
-    if not secret:
-        raise ValueError("阿里云平台的AccessKeySecret未在配置文件中指定")
-    app.state.secret = secret
-    app.state.mail_host = mail_config.get('host')
-    app.state.mail_port = mail_config.get('port') if mail_config.get('port') else 25
-    app.state.mail_sender = mail_config.get('sender')
-    app.state.mail_password = mail_config.get('password')
-    app.state.huawei_token_manager = HuaweiIAMTokenManager()
-    app.state.huawei_token_manager.username = api_config.get('huawei_iam_username')
-    app.state.huawei_token_manager.password = api_config.get('huawei_iam_password')
-    app.state.huawei_token_manager.domain_name = api_config.get('huawei_iam_domain')
-    app.state.huawei_token_manager.area = api_config.get('huawei_iam_area')
-    logging.info(f'FastAPI Config: {api_config}')
-    logging.info(f'Mail Config: {mail_config}')
+    workers = int(api_config.get('workers', 1))
+    # 收到终止信号后等待正在处理的请求完成的最长时间
+    drain_timeout = int(api_config.get('drain_timeout', 30))
     import uvicorn
+    from graceful import GracefulServer, bind_socket
+    if workers <= 1:
+        # 自行创建带 SO_REUSEPORT 的监听套接字，平滑重启时新进程可以在旧进程退出前绑定同一端口
+        server = GracefulServer(uvicorn.Config(
+            app,
+            host='0.0.0.0',
+            port=port,
+            proxy_headers=True,
+            forwarded_allow_ips='127.0.0.1',
+            timeout_graceful_shutdown=drain_timeout
+        ), on_drain=begin_drain)
+        server.run(sockets=[bind_socket('0.0.0.0', port)])
+        return
+
+    # 多进程模式：工作进程重新导入本模块，通过环境变量获取配置文件和共享目录
+    shared_dir = api_config.get('shared_dir') or os.path.join(tempfile.gettempdir(), f'fastapp-{port}')
+    shutil.rmtree(shared_dir, ignore_errors=True)
+    os.makedirs(shared_dir, exist_ok=True)
+    os.environ['FASTAPP_CONFIG'] = os.path.abspath(args.config)
+    os.environ['FASTAPP_SHARED_DIR'] = shared_dir
+    os.environ['FASTAPP_LOG_LEVEL'] = args.verbose
+    logging.info(f'以 {workers} 个工作进程启动，共享目录 {shared_dir}')
     uvicorn.run(
-        app,
+        'fastapp:app',
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
         host='0.0.0.0',
         port=port,
+        workers=workers,
+        timeout_graceful_shutdown=drain_timeout,
         proxy_headers=True,
         forwarded_allow_ips='127.0.0.1'
     )
@@ -0,0 +1,82 @@
+import json
+import math
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 当前使用的 JSON 实现：安装了 orjson 时使用 orjson，否则使用标准库
+# 两种实现的行为保持一致：序列化时 NaN 和 ±Infinity 写为 null，输出总是合法的 JSON；
+# 解析时接受标准库写出的 NaN、Infinity，旧版本保存的数据文件仍然可以读取
+BACKEND = 'orjson' if orjson else 'json'
+
+
+def _default(obj):
+    # Reading 等带有 to_dict 方法的对象按其字典形式序列化
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return to_dict()
+
+
+def _finite(obj):
+    # 把 NaN 和 ±Infinity 替换为 None，与 orjson 的输出一致
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if hasattr(obj, 'to_dict'):
+        return _finite(obj.to_dict())
+    return obj
+
+
+if orjson:
+    def dumps(obj):
+        """将对象序列化为 UTF-8 编码的 JSON 字节串，不转义非 ASCII 字符"""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(data):
+        """解析 JSON 字节串或字符串"""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson 不接受 NaN、Infinity，交给标准库解析；确实不合法时抛出标准库的 JSONDecodeError
+            if isinstance(data, memoryview):
+                data = bytes(data)
+            return json.loads(data)
+else:
+    def dumps(obj):
+        """将对象序列化为 UTF-8 编码的 JSON 字节串，不转义非 ASCII 字符"""
+        try:
+            text = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default, allow_nan=False)
+        except ValueError:
+            # 含有 NaN 或 ±Infinity 的少数情况才需要遍历替换
+            text = json.dumps(_finite(obj), ensure_ascii=False, separators=(',', ':'), default=_default)
+        return text.encode('utf-8')
+
+    def loads(data):
+        """解析 JSON 字节串或字符串"""
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+def load_file(path):
+    """读取并解析 JSON 文件"""
+    with open(path, 'rb') as file:
+        return loads(file.read())
+
+
+class FastJSONResponse(Response):
+    """使用 fastjson 序列化的 JSON 响应；内容已经是字节串时直接返回，不再序列化"""
+    media_type = "application/json"
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
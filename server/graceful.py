@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+import uvicorn
+
+from handoff import READY_MARKER, DRAIN_MARKER, DRAINED_MARKER, handoff_requested, reuse_port_supported
+
+
+def bind_socket(host, port, handoff=None):
+    """
+    创建监听套接字
+
+    支持 SO_REUSEPORT 时设置该选项，平滑重启时新进程可以在旧进程仍在监听时绑定同一端口，
+    两个进程同时接受连接，直到旧进程停止监听。内核要求共享端口的每个套接字都设置该选项，正常启动的进程同样设置，
+    但会先不带该选项试绑定一次：端口已有进程监听时启动失败，误启动的第二个实例不会悄悄分走一部分连接。
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        handoff: 是否为平滑重启启动的新进程，只有此时才与已在监听的进程共享端口；默认由环境变量 HANDOFF_ENV 决定
+
+    Raises:
+        OSError: 端口已被占用（平滑重启时为被不支持共享的进程占用）
+    """
+    if handoff is None:
+        handoff = handoff_requested()
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    if reuse_port_supported() and not handoff:
+        probe = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            # SO_REUSEADDR 只跳过 TIME_WAIT 状态的连接，端口上有监听的套接字时仍然绑定失败
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            probe.bind((host, port))
+        finally:
+            probe.close()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port_supported():
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        sock.bind((host, port))
+    except OSError:
+        sock.close()
+        raise
+    sock.set_inheritable(True)
+    return sock
+
+
+def _announce(marker, **fields):
+    # 不经过 logging，日志级别设为 WARNING 时 GUI 仍能收到
+    print(' '.join([marker] + [f'{key}={value}' for key, value in fields.items()]), flush=True)
+
+
+class GracefulServer(uvicorn.Server):
+    """
+    支持平滑重启的 uvicorn 服务
+
+    启动完成后输出就绪状态行；收到 SIGTERM（Windows 上为 CTRL_BREAK_EVENT）后先调用 `on_drain`，
+    再停止监听，等待正在处理的请求完成，最多等待 `timeout_graceful_shutdown` 秒，
+    期间每 `progress_interval` 秒输出一次剩余的连接数。
+    """
+
+    def __init__(self, config, on_drain=None, progress_interval=1.0):
+        super().__init__(config)
+        self.on_drain = on_drain
+        self.progress_interval = progress_interval
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            _announce(READY_MARKER, pid=os.getpid())
+
+    async def shutdown(self, sockets=None):
+        started = time.monotonic()
+        if self.on_drain is not None:
+            try:
+                await self.on_drain()
+            except Exception as e:
+                logging.warning(f'停止接收新任务时出错: {e}')
+        progress = asyncio.ensure_future(self._report_progress(started))
+        try:
+            await super().shutdown(sockets=sockets)
+        finally:
+            progress.cancel()
+            _announce(DRAINED_MARKER, pid=os.getpid(), elapsed=f'{time.monotonic() - started:.1f}')
+
+    async def _report_progress(self, started):
+        timeout = self.config.timeout_graceful_shutdown
+        while True:
+            _announce(DRAIN_MARKER, pid=os.getpid(), connections=len(self.server_state.connections),
+                      elapsed=f'{time.monotonic() - started:.1f}', timeout=timeout if timeout is not None else '')
+            await asyncio.sleep(self.progress_interval)
@@ -0,0 +1,21 @@
+import os
+import socket
+import sys
+
+# 平滑重启时服务进程写到标准输出的状态行，GUI 据此判断新进程已就绪并显示旧进程的排空进度。
+# 本模块只依赖标准库，GUI 导入时不需要安装服务端的依赖
+READY_MARKER = 'FASTAPP_READY'
+DRAIN_MARKER = 'FASTAPP_DRAIN'
+DRAINED_MARKER = 'FASTAPP_DRAINED'
+# GUI 平滑重启时为新进程设置的环境变量，值为旧进程的 PID；只有这样启动的进程才会与仍在监听的旧进程共享端口
+HANDOFF_ENV = 'FASTAPP_HANDOFF'
+
+
+def reuse_port_supported():
+    """当前平台是否支持 SO_REUSEPORT，多个进程可以同时监听同一端口"""
+    return hasattr(socket, 'SO_REUSEPORT') and not sys.platform.startswith('win')
+
+
+def handoff_requested():
+    """当前进程是否由平滑重启启动，需要与旧进程共享监听端口"""
+    return bool(os.environ.get(HANDOFF_ENV))
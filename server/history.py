@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS readings (
+    device_id TEXT NOT NULL,
+    property TEXT NOT NULL,
+    time REAL NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (device_id, property, time)
+) WITHOUT ROWID
+'''
+
+# 大于此值的 `time` 视为毫秒时间戳（阿里云），否则为秒（华为云）
+_MILLISECONDS = 1e11
+
+
+class ReadingStore:
+    """
+    设备读数的时序存储
+
+    基于 SQLite（WAL 模式），每个数值属性的每条读数保存为一行，按 (设备ID, 属性, 时间) 聚簇存储，
+    查询某个设备某个属性的一段时间只需扫描该范围内的行。同一时间戳的重复读数会被忽略。
+    与请求日志相同，读数先追加到内存队列，由后台任务在线程中批量写入。
+    后台任务每 `prune_interval` 秒删除一次早于 `retention` 秒之前的读数，`retention` 为 0 时永久保存。
+    """
+
+    def __init__(self, path='history.db', batch_size=1000, flush_interval=1.0, max_pending=100000,
+                 retention=30 * 86400.0, prune_interval=3600.0):
+        self.path = os.path.expanduser(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._local = threading.local()
+        self._readers = []
+        self._task = None
+        self._writing = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.pruned = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """
+        根据 `api` 配置项创建时序存储，`history_path` 为空时返回 None
+
+        `history_retention` 为读数保留的秒数（默认 30 天，0 为永久保存），`history_prune_interval` 为清理的间隔秒数。
+        """
+        path = api_config.get('history_path', 'history.db')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            batch_size=int(api_config.get('history_batch_size', 1000)),
+            flush_interval=float(api_config.get('history_flush_interval', 1)),
+            retention=float(api_config.get('history_retention', 30 * 86400)),
+            prune_interval=float(api_config.get('history_prune_interval', 3600))
+        )
+
+    def open(self):
+        """打开数据库并创建表"""
+        self._writer = sqlite3.connect(self.path, check_same_thread=False)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._writer.execute(_SCHEMA)
+        self._writer.commit()
+
+    def add(self, device_id, reading):
+        """
+        追加一个设备的一条读数，不会阻塞；只保存数值属性，队列已满时丢弃
+
+        Args:
+            device_id: 设备ID
+            reading: Reading 或 `{属性名: 值, ..., "time": 时间戳}` 形式的读数
+        """
+        try:
+            timestamp = float(reading['time'])
+        except (KeyError, TypeError, ValueError):
+            return
+        rows = [
+            (device_id, key, timestamp, value) for key, value in reading.items()
+            if key != 'time' and type(value) is float and value == value
+        ]
+        if len(self._pending) + len(rows) > self.max_pending:
+            self.dropped += len(rows)
+            return
+        self._pending.extend(rows)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._writer is None:
+            self.open()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+            if self.retention > 0 and time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + self.prune_interval
+                await self._prune()
+
+    async def _prune(self):
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self.prune))
+        try:
+            await asyncio.shield(self._writing)
+        except sqlite3.Error as e:
+            logging.error(f'历史读数清理失败: {e}')
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        rows = list(self._pending)
+        self._pending.clear()
+        # 关闭时取消后台任务不应中断正在进行的写入
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, rows))
+        try:
+            await asyncio.shield(self._writing)
+        except sqlite3.Error as e:
+            self.dropped += len(rows)
+            logging.error(f'读数写入失败: {e}')
+
+    def _write(self, rows):
+        with self._write_lock:
+            with self._writer:
+                self._writer.executemany('INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?)', rows)
+            self.written += len(rows)
+            self.batches += 1
+
+    def prune(self, now=None):
+        """
+        删除早于保留时长的读数
+
+        读数的 `time` 可能是秒或毫秒时间戳，按数值大小区分后分别与截止时间比较。
+
+        Args:
+            now: 可选，当前的 Unix 时间戳（秒）
+
+        Returns:
+            删除的行数
+        """
+        cutoff = (time.time() if now is None else now) - self.retention
+        with self._write_lock:
+            with self._writer:
+                deleted = self._writer.execute(
+                    'DELETE FROM readings WHERE time < ? OR (time >= ? AND time < ?)',
+                    (cutoff, _MILLISECONDS, cutoff * 1000)
+                ).rowcount
+            self.pruned += deleted
+        if deleted:
+            logging.debug(f'已删除 {deleted} 条超过保留时长的历史读数')
+        return deleted
+
+    def _reader(self):
+        # 每个线程使用自己的只读连接，WAL 模式下读取不会被写入阻塞
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA query_only=ON')
+            self._local.connection = connection
+            self._readers.append(connection)
+        return connection
+
+    def query(self, device_id, key, start=None, end=None, limit=10000):
+        """
+        查询一个属性在时间范围内的原始读数
+
+        Args:
+            device_id: 设备ID
+            key: 属性名
+            start: 可选，时间范围起点（含），与读数的 `time` 单位相同
+            end: 可选，时间范围终点（不含）
+            limit: 最多返回的读数条数
+
+        Returns:
+            按时间升序排列的 `[时间, 值]` 列表
+        """
+        cursor = self._reader().execute(
+            'SELECT time, value FROM readings WHERE device_id = ? AND property = ? AND time >= ? AND time < ? '
+            'ORDER BY time LIMIT ?',
+            (device_id, key, -float('inf') if start is None else start, float('inf') if end is None else end, limit)
+        )
+        return [list(row) for row in cursor]
+
+    def downsample(self, device_id, key, start, end, bucket):
+        """
+        按固定宽度的时间桶汇总一个属性的读数
+
+        Args:
+            device_id: 设备ID
+            key: 属性名
+            start: 时间范围起点（含），也是第一个桶的起点
+            end: 时间范围终点（不含）
+            bucket: 桶宽度，与读数的 `time` 单位相同
+
+        Returns:
+            按时间升序排列的 `{"time": 桶起点, "min", "max", "avg", "count"}` 列表，没有读数的桶不返回
+        """
+        cursor = self._reader().execute(
+            'SELECT CAST((time - :start) / :bucket AS INTEGER) AS b, MIN(value), MAX(value), AVG(value), COUNT(*) '
+            'FROM readings WHERE device_id = :device_id AND property = :key AND time >= :start AND time < :end '
+            'GROUP BY b ORDER BY b',
+            {'device_id': device_id, 'key': key, 'start': start, 'end': end, 'bucket': bucket}
+        )
+        return [
+            {'time': start + b * bucket, 'min': low, 'max': high, 'avg': avg, 'count': count}
+            for b, low, high, avg, count in cursor
+        ]
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'pruned': self.pruned
+        }
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+        await self._flush()
+        for connection in self._readers:
+            connection.close()
+        self._readers.clear()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
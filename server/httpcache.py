@@ -0,0 +1,88 @@
+import asyncio
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from snapshot import COMPRESSORS
+
+# 小于此大小的响应体不压缩
+MIN_COMPRESS_SIZE = 1024
+
+
+def accepted_encoding(accept_encoding):
+    """
+    根据 Accept-Encoding 请求头选择压缩方式
+
+    Returns:
+        COMPRESSORS 中客户端接受的第一个压缩方式，都不接受时返回 None
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSORS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 中是否包含 `etag` 或它的任一压缩版本，按弱比较处理"""
+    if if_none_match.strip() == '*':
+        return True
+    base = etag[:-1]
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag or (candidate.startswith(base + '-') and candidate[len(base) + 1:-1] in COMPRESSORS):
+            return True
+    return False
+
+
+def not_modified(request: Request, etag):
+    """请求头 If-None-Match 是否与 `etag` 匹配，即客户端缓存仍然有效"""
+    if_none_match = request.headers.get('if-none-match')
+    return bool(if_none_match) and etag_matches(if_none_match, etag)
+
+
+async def snapshot_response(request: Request, snapshot, body=None, media_type="application/json"):
+    """
+    返回快照的响应，使用快照的 ETag 处理 If-None-Match
+
+    客户端缓存仍然有效时返回 304。响应体足够大且客户端接受压缩时返回预先压缩的版本，
+    每个快照的每种压缩方式只压缩一次，压缩版本的 ETag 带有压缩方式后缀。
+
+    Args:
+        request: 当前请求
+        snapshot: Snapshot 对象
+        body: 可选，由该快照生成的其他响应体（如单值查询结果），不提供时使用快照本身的响应体；
+            这类响应体较小，只处理 ETag 不压缩
+        media_type: 响应的媒体类型
+    """
+    headers = {'ETag': snapshot.etag, 'Vary': 'Accept-Encoding'}
+    if not_modified(request, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    if body is not None:
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    encoding = None
+    if len(snapshot.body) >= MIN_COMPRESS_SIZE:
+        encoding = accepted_encoding(request.headers.get('accept-encoding', ''))
+    if encoding is None:
+        return Response(content=snapshot.body, media_type=media_type, headers=headers)
+    if encoding in snapshot.encodings:
+        content = snapshot.encodings[encoding]
+    else:
+        # 大文件的压缩耗时较长，放到线程中执行
+        content = await asyncio.to_thread(snapshot.encoded, encoding)
+    headers['ETag'] = f'{snapshot.etag[:-1]}-{encoding}"'
+    headers['Content-Encoding'] = encoding
+    return Response(content=content, media_type=media_type, headers=headers)
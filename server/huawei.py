@@ -1,21 +1,126 @@
-import requests
+import asyncio
 import datetime
-import json
+import logging
+import time
+
+import fastjson
+from reading import Reading
+
+class HuaweiIAMToken:
+    __slots__ = ('token', 'expires_at')
+
+    def __init__(self, token, expires_at):
+        self.token = token
+        self.expires_at = expires_at
 
 class HuaweiIAMTokenManager:
-    def __init__(self):
-        self.cached_token = None
-        self.token_expiry = None
+    # 自定义凭据最多缓存的 Token 数量
+    max_cached_credentials = 32
+
+    def __init__(self, refresh_margin=300, retry_interval=30):
         self.username = None
         self.password = None
         self.domain_name = None
         self.area = None
+        self.client = None
+        # 在过期前多少秒开始续期
+        self.refresh_margin = refresh_margin
+        # 后台续期失败后的重试间隔
+        self.retry_interval = retry_interval
+        # 按 (username, password, area, domain_name) 缓存的 Token
+        self._tokens = {}
+        # 正在进行的 IAM 请求，同一组凭据同时只会有一个
+        self._inflight = {}
+        # 后台续期失败的凭据 -> 允许再次后台续期的时间（time.monotonic()）
+        self._retry_at = {}
+        self._renew_task = None
+        # 多进程模式下各工作进程共享默认凭据 Token 的存储（workers.SharedTokenStore）
+        self.shared_tokens = None
+        self.iam_requests = 0
+
+    @property
+    def default_credentials(self):
+        return (self.username, self.password, self.area, self.domain_name)
+
+    def set_default_credentials(self, username, password, area, domain_name):
+        """
+        更换默认凭据
+
+        凭据没有变化时保留已缓存的 Token；变化时丢弃旧凭据的 Token，并让后台续期任务立即为新凭据获取 Token。
+        """
+        credentials = (username, password, area, domain_name)
+        if credentials == self.default_credentials:
+            return
+        self._tokens.pop(self.default_credentials, None)
+        self.username, self.password, self.area, self.domain_name = credentials
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+            self.start()
 
-    def get_iam_token(self, username, password, area, domain_name):
+    async def get_default_token(self):
+        return await self.get_iam_token(*self.default_credentials)
+
+    async def get_iam_token(self, username, password, area, domain_name):
+        credentials = (username, password, area, domain_name)
+        cached = self._tokens.get(credentials)
+        now = datetime.datetime.now(datetime.timezone.utc)
         # 检查是否有未过期的 Token
-        if self.cached_token and self.token_expiry and datetime.datetime.now(datetime.timezone.utc) < self.token_expiry:
-            return self.cached_token
+        if cached and now < cached.expires_at:
+            # 即将过期时在后台续期，当前请求继续使用旧 Token
+            if (cached.expires_at - now).total_seconds() < self.refresh_margin:
+                self._refresh_in_background(credentials)
+            return cached.token
+        return await self._refresh(credentials)
+
+    async def _refresh(self, credentials):
+        task = self._inflight.get(credentials)
+        if task is None:
+            task = asyncio.ensure_future(self._request_token(credentials))
+            self._inflight[credentials] = task
+            task.add_done_callback(lambda _: self._inflight.pop(credentials, None))
+        # 单个等待方被取消时不影响其他等待方
+        return await asyncio.shield(task)
+
+    def _refresh_in_background(self, credentials):
+        if credentials in self._inflight or time.monotonic() < self._retry_at.get(credentials, 0.0):
+            return
+        task = asyncio.ensure_future(self._refresh(credentials))
+        task.add_done_callback(lambda task: self._background_done(credentials, task))
+
+    def _background_done(self, credentials, task):
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self._retry_at.pop(credentials, None)
+            return
+        # 旧 Token 仍然有效，失败后 retry_interval 秒内不再续期，避免每个请求都去请求 IAM
+        self._retry_at[credentials] = time.monotonic() + self.retry_interval
+        logging.warning(f'华为云 IAM Token 后台续期失败，{self.retry_interval} 秒后重试: {task.exception()}')
+
+    def _cache_token(self, credentials, token):
+        if credentials not in self._tokens and len(self._tokens) >= self.max_cached_credentials:
+            evicted = next(k for k in self._tokens if k != self.default_credentials)
+            self._tokens.pop(evicted)
+            self._retry_at.pop(evicted, None)
+        self._tokens[credentials] = token
+
+    async def _request_token(self, credentials):
+        if self.shared_tokens is None or credentials != self.default_credentials:
+            token = await self._fetch_token(credentials)
+        else:
+            # 持有跨进程锁期间其他进程可能已经获取了新 Token，直接使用
+            async with self.shared_tokens:
+                token = self.shared_tokens.load(credentials)
+                now = datetime.datetime.now(datetime.timezone.utc)
+                if token is None or (token.expires_at - now).total_seconds() < self.refresh_margin:
+                    token = await self._fetch_token(credentials)
+                    self.shared_tokens.store(credentials, token)
+        self._cache_token(credentials, token)
+        return token.token
 
+    async def _fetch_token(self, credentials):
+        username, password, area, domain_name = credentials
         # 请求新的 Token
         iam_url = f"https://iam.{area}.myhuaweicloud.com/v3/auth/tokens"
         headers = {
@@ -43,74 +148,94 @@ class HuaweiIAMTokenManager:
             }
         }
 
-        response = requests.post(iam_url, headers=headers, json=payload)
+        self.iam_requests += 1
+        response = await self.client.post(iam_url, upstream='iam', headers=headers, json=payload)
         if response.status_code != 201:
             raise Exception(f"Failed to get IAM token: {response.status_code} {response.text}")
 
         # 提取 Token 和过期时间
-        self.cached_token = response.headers.get("X-Subject-Token")
+        token = response.headers.get("X-Subject-Token")
         token_data = response.json().get("token")
-        self.token_expiry = datetime.datetime.strptime(token_data["expires_at"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=datetime.timezone.utc)
+        expires_at = datetime.datetime.strptime(token_data["expires_at"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=datetime.timezone.utc)
 
-        return self.cached_token
+        logging.debug(f'已获取华为云 IAM Token，过期时间 {expires_at.isoformat()}')
+        return HuaweiIAMToken(token, expires_at)
 
-def huawei_get_data(token, url):
+    def start(self):
+        """启动默认凭据的后台续期任务"""
+        if all(self.default_credentials) and self._renew_task is None:
+            self._renew_task = asyncio.ensure_future(self._renew_loop())
+
+    async def _renew_loop(self):
+        while True:
+            credentials = self.default_credentials
+            cached = self._tokens.get(credentials)
+            if cached:
+                now = datetime.datetime.now(datetime.timezone.utc)
+                delay = (cached.expires_at - now).total_seconds() - self.refresh_margin
+                # Token 有效期短于续期提前量时，避免连续请求 IAM
+                await asyncio.sleep(max(delay, self.retry_interval))
+            try:
+                await self._refresh(credentials)
+            except Exception as e:
+                logging.warning(f'华为云 IAM Token 续期失败，{self.retry_interval} 秒后重试: {e}')
+                await asyncio.sleep(self.retry_interval)
+
+    async def aclose(self):
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+
+async def huawei_get_data(client, token, url, hedge=False, admit=None):
     headers = {
         "X-Auth-Token": token,
         "Content-Type": "application/json"
     }
 
-    response = requests.get(url, headers=headers)
+    response = await client.get(url, upstream='huawei', hedge=hedge, admit=admit, headers=headers)
     if response.status_code != 200:
         raise Exception(f"Failed to get data: {response.status_code} {response.text}")
 
-    return response.json()
+    return fastjson.loads(response.content)
 
-def huawei_beautify_response(response):
+def huawei_normalize_response(response):
+    """
+    将华为云设备影子响应整理为 `[Reading]`，时间戳为 Unix 时间戳
+
+    Args:
+        response: 已解析的字典，或 JSON 字节串/字符串
+
+    Returns:
+        包含一条 Reading 的列表，响应结构不符合预期时返回空列表
+    """
     try:
-        # 如果 response 是字典，直接使用它；否则假设它是字符串并进行解析
+        # 如果 response 是字典，直接使用它；否则假设它是 JSON 文本并进行解析
         if isinstance(response, dict):
             response_dict = response
         else:
-            # 确保以 UTF-8 编码解析响应文本
-            response_text = response.encode('utf-8').decode('utf-8')
-            response_dict = json.loads(response_text)
+            response_dict = fastjson.loads(response)
         
         # 检查是否存在需要的键
         if "shadow" in response_dict and len(response_dict["shadow"]) > 0 and "reported" in response_dict["shadow"][0] and "properties" in response_dict["shadow"][0]["reported"]:
             property_status_info = response_dict["shadow"][0]["reported"]["properties"]
         else:
-            # 如果不存在，可以返回一个空的JSON字符串或者抛出一个异常
+            # 如果不存在，返回一个空的列表表示没有数据
             print("Error: Response does not contain expected data structure.")
-            return json.dumps([])  # 返回一个空的列表表示没有数据
-        
-        # 创建一个空字典来存储修改后的数据
-        modified_data = {}
-        for key, value in property_status_info.items():
-            # 尝试将值转换为浮点数，如果失败则保留原始值
-            try:
-                value = float(value)
-            except ValueError:
-                pass
-            modified_data[key] = value
-        
-        # 将修改后的字典放入列表中
-        modified_data_list = [modified_data]
+            return []
         
         # 搜索响应文本当中的时间戳并转换为 Unix 时间戳
         event_time_str = response_dict["shadow"][0]["reported"]["event_time"]
         event_time = datetime.datetime.strptime(event_time_str, "%Y%m%dT%H%M%SZ").replace(tzinfo=datetime.timezone.utc)
-        unix_timestamp = int(event_time.timestamp())
         
-        # 在修改后的数据中添加时间戳
-        modified_data_list[0]["time"] = unix_timestamp
-        
-        # 将修改后的数据以 UTF-8 编码的形式进行编码，确保不转义 Unicode 字符
-        modified_data_json = json.dumps(modified_data_list, ensure_ascii=False)
-        return modified_data_json
+        # 能转换为浮点数的值保存为浮点数，否则保留原始值
+        return [Reading.from_pairs(property_status_info.items(), int(event_time.timestamp()))]
     except KeyError as e:
         print(f"KeyError: {e} not found in response.")
-        return json.dumps([])  # 或者返回一个默认值/错误信息
+        return []
     except Exception as e:
         print(f"An error occurred: {e}")
-        return json.dumps([])  # 或者返回一个默认值/错误信息
\ No newline at end of file
+        return []
+
+def huawei_beautify_response(response):
+    # 将修改后的数据编码为 JSON 字符串，不转义 Unicode 字符
+    return fastjson.dumps(huawei_normalize_response(response)).decode('utf-8')
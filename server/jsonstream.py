@@ -0,0 +1,316 @@
+import re
+
+import numpy as np
+
+import fastjson
+
+# 容器中需要关注的字符：字符串开始的引号、括号和字符串之外的转义符
+_VALUE_TOKEN = re.compile(rb'["\[\]{}\\]')
+# 字符串中需要关注的字符：结束引号和转义符
+_STRING_END = re.compile(rb'["\\]')
+# 数字、true、false、null 的结束位置
+_SCALAR_END = re.compile(rb'[,\]}\s]')
+_WHITESPACE = b' \t\r\n'
+
+# 每个字节对嵌套深度的影响
+_BRACKET_STEP = np.zeros(256, dtype=np.int8)
+_BRACKET_STEP[[ord('{'), ord('[')]] = 1
+_BRACKET_STEP[[ord('}'), ord(']')]] = -1
+_STRUCTURAL = np.zeros(256, dtype=bool)
+_STRUCTURAL[[ord(c) for c in '"{}[],']] = True
+
+
+class _Reader:
+    """
+    按块读取 JSON 字节流，每次取出一个完整值的原始字节
+
+    缓冲区只在两个值之间丢弃已读部分，因此内存占用取决于单个值的大小，与文件大小无关。
+    """
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buf = bytearray()
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            raise ValueError('JSON 数据意外结束')
+        self.buf += chunk
+
+    def _compact(self):
+        if self.pos >= self.chunk_size:
+            del self.buf[:self.pos]
+            self.pos = 0
+
+    def peek(self):
+        """跳过空白并返回下一个字符，不消耗它"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'位置 {self.pos} 处应为 {char.decode()}')
+        self.pos += 1
+
+    def next_item(self, closing, first):
+        """
+        移动到容器中的下一个元素
+
+        Returns:
+            还有下一个元素时返回 True，遇到容器结束符时消耗它并返回 False
+        """
+        self._compact()
+        char = self.peek()
+        if char == closing:
+            self.pos += 1
+            return False
+        if not first:
+            self.expect(b',')
+        return True
+
+    def _skip_string(self, i):
+        # i 为开始引号之后的位置，返回结束引号之后的位置
+        while True:
+            match = _STRING_END.search(self.buf, i)
+            if match is None:
+                i = len(self.buf)
+                self._fill()
+                continue
+            if self.buf[match.start()] == 0x22:
+                return match.start() + 1
+            i = match.start() + 2
+            while i > len(self.buf):
+                self._fill()
+
+    def read_items(self, keep=True):
+        """
+        成批读取数组中的元素，调用前应已消耗数组开始的 `[`，结束时消耗 `]`
+
+        缓冲区中的数据用 numpy 一次性扫描：引号计数的奇偶确定哪些字符在字符串之外，
+        括号累计得到每个位置的嵌套深度，深度为 1 的逗号即元素分隔符。
+        含有 `\\"` 或 `\\\\` 转义的数据无法用奇偶判断，退回逐个元素读取。
+
+        Args:
+            keep: 为 False 时只跳过数组
+
+        Yields:
+            以逗号分隔的若干完整元素的原始字节，`keep` 为 False 时为 None
+        """
+        while True:
+            self._compact()
+            if self.pos == len(self.buf):
+                self._fill()
+            segment = bytes(self.buf[self.pos:])
+            if b'\\"' in segment or b'\\\\' in segment or len(segment) > 4 * self.chunk_size:
+                # 转义字符或超大元素，逐个元素读取
+                if self.peek() == b']':
+                    self.pos += 1
+                    return
+                raw = self.read_value(keep)
+                if self.peek() == b',':
+                    self.pos += 1
+                yield raw
+                continue
+            data = np.frombuffer(segment, dtype=np.uint8)
+            # 只需要处理引号、括号和逗号所在的位置
+            positions = np.flatnonzero(_STRUCTURAL[data])
+            chars = data[positions]
+            outside = (np.cumsum(chars == 0x22) & 1) == 0
+            depth = 1 + np.cumsum(np.where(outside, _BRACKET_STEP[chars], 0))
+            closing = np.flatnonzero(depth == 0)
+            if len(closing):
+                end = int(positions[closing[0]])
+                raw = segment[:end].strip()
+                self.pos += end + 1
+                if raw:
+                    yield raw if keep else None
+                return
+            commas = np.flatnonzero((chars == 0x2c) & outside & (depth == 1))
+            if not len(commas):
+                self._fill()
+                continue
+            end = int(positions[commas[-1]])
+            self.pos += end + 1
+            yield segment[:end] if keep else None
+
+    def read_value(self, keep=True):
+        """
+        读取下一个完整的值
+
+        Args:
+            keep: 为 False 时只跳过该值，读取过程中即可丢弃已扫描的数据
+
+        Returns:
+            值的原始字节，`keep` 为 False 时返回 None
+        """
+        char = self.peek()
+        start = self.pos
+        if char == b'"':
+            end = self._skip_string(start + 1)
+        elif char in (b'{', b'['):
+            depth = 0
+            i = start
+            while True:
+                # 逐个查找结构字符，每个字节只扫描一次，数据在块边界处截断时也不会回溯
+                match = _VALUE_TOKEN.search(self.buf, i)
+                if match is None:
+                    if keep:
+                        i = len(self.buf)
+                    else:
+                        del self.buf[:]
+                        i = start = 0
+                    self._fill()
+                    continue
+                i = match.start()
+                c = self.buf[i]
+                if c == 0x22:
+                    if not keep:
+                        del self.buf[:i]
+                        i = start = 0
+                    i = self._skip_string(i + 1)
+                    continue
+                i += 1
+                if c in b'{[':
+                    depth += 1
+                elif c in b']}':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                else:
+                    raise ValueError(f'位置 {i - 1} 处出现字符串之外的转义符')
+            end = i
+        else:
+            i = start
+            while True:
+                match = _SCALAR_END.search(self.buf, i)
+                if match is not None:
+                    break
+                i = len(self.buf)
+                self._fill()
+            end = match.start()
+        self.pos = end
+        return bytes(self.buf[start:end]) if keep else None
+
+
+def _timestamp(value):
+    try:
+        return float(value['time'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def in_time_range(reading, start=None, end=None):
+    """读数的 `time` 是否在 [start, end] 之间，没有时间戳的读数视为不在范围内"""
+    timestamp = _timestamp(reading)
+    if timestamp is None:
+        return False
+    return (start is None or timestamp >= start) and (end is None or timestamp <= end)
+
+
+def filter_data(data, ids=None, start=None, end=None):
+    """
+    在内存中过滤 `{设备ID: 读数}` 或 `{设备ID: [读数, ...]}` 形式的数据，规则与 `stream_filtered` 相同
+    """
+    ids = set(ids) if ids else None
+    time_filter = start is not None or end is not None
+    result = {}
+    for key, value in data.items():
+        if ids is not None and key not in ids:
+            continue
+        if not time_filter:
+            result[key] = value
+        elif isinstance(value, list):
+            matched = [item for item in value if in_time_range(item, start, end)]
+            if matched:
+                result[key] = matched
+        elif in_time_range(value, start, end):
+            result[key] = value
+    return result
+
+
+def stream_filtered(path, ids=None, start=None, end=None, chunk_size=64 * 1024):
+    """
+    增量读取顶层为对象的 JSON 文件，按设备ID和时间范围过滤后逐段产出响应体
+
+    只按设备ID过滤时不解析任何值，直接复制原始字节；按时间范围过滤时逐条解析读数，
+    值为列表（历史读数）时按元素过滤，没有匹配读数的设备不出现在结果中。
+    列表逐个元素读取，跳过的设备边扫描边丢弃，内存占用只取决于单条读数的大小。
+
+    Args:
+        path: JSON 文件路径
+        ids: 可选，需要保留的设备ID
+        start: 可选，时间范围起点（含），与读数的 `time` 单位相同
+        end: 可选，时间范围终点（含）
+        chunk_size: 每次读取的字节数，产出的片段也按此大小合并
+
+    Yields:
+        响应体的字节片段
+
+    Raises:
+        ValueError: 文件内容不是顶层为对象的合法 JSON
+    """
+    ids = set(ids) if ids else None
+    time_filter = start is not None or end is not None
+    parts = []
+    size = 0
+    with open(path, 'rb') as file:
+        reader = _Reader(file, chunk_size)
+        reader.expect(b'{')
+        parts.append(b'{')
+        separator = b''
+        first = True
+        while reader.next_item(b'}', first):
+            first = False
+            encoded_key = reader.read_value()
+            reader.expect(b':')
+            if ids is not None and fastjson.loads(encoded_key) not in ids:
+                if reader.peek() == b'[':
+                    reader.expect(b'[')
+                    for _ in reader.read_items(keep=False):
+                        pass
+                else:
+                    reader.read_value(keep=False)
+                continue
+            if reader.peek() == b'[':
+                # 历史读数成批读取，不需要把整个列表放入内存
+                reader.expect(b'[')
+                prefix = separator + encoded_key + b':['
+                for raw in reader.read_items():
+                    if time_filter:
+                        items = fastjson.loads(b'[' + raw + b']')
+                        matched = [item for item in items if in_time_range(item, start, end)]
+                        if not matched:
+                            continue
+                        raw = fastjson.dumps(matched)[1:-1]
+                    parts.append(prefix + raw)
+                    size += len(raw)
+                    prefix = b','
+                    if size >= chunk_size:
+                        yield b''.join(parts)
+                        parts.clear()
+                        size = 0
+                if prefix == b',':
+                    parts.append(b']')
+                elif not time_filter:
+                    parts.append(prefix + b']')
+                else:
+                    continue
+            else:
+                raw = reader.read_value()
+                if time_filter and not in_time_range(fastjson.loads(raw), start, end):
+                    continue
+                parts.append(separator + encoded_key + b':' + raw)
+                size += len(raw)
+            separator = b','
+            if size >= chunk_size:
+                yield b''.join(parts)
+                parts.clear()
+                size = 0
+        parts.append(b'}')
+        yield b''.join(parts)
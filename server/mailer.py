@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import smtplib
+import time
+import uuid
+from collections import OrderedDict
+from email.header import Header
+from email.mime.text import MIMEText
+
+from alerts import ALERT_LEVEL_NAMES
+
+
+class MailJob:
+    """一次邮件发送任务，可包含多封在同一个 SMTP 会话中发送的邮件"""
+    __slots__ = ('id', 'messages', 'status', 'error', 'created_at', 'sent_at')
+
+    def __init__(self, messages):
+        self.id = uuid.uuid4().hex
+        # (收件人列表, 主题, 正文) 的列表
+        self.messages = messages
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.sent_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'sent_at': self.sent_at
+        }
+
+
+class MailWorker:
+    """
+    后台邮件发送任务
+
+    邮件先进入有界队列，由单个后台任务依次发送。SMTP 连接登录后会被复用，
+    连接断开时自动重连，队列空闲超过 `idle_timeout` 秒后主动断开。
+    SMTP 操作在线程中执行，不会阻塞事件循环。
+    """
+
+    # 保留最近多少个任务的状态供查询
+    max_tracked_jobs = 1000
+
+    def __init__(self, host, port=25, sender=None, password=None, queue_size=1000, idle_timeout=60.0, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._smtp = None
+        # 服务器或账号变化后，下一个任务发送前断开旧连接
+        self._reconnect = False
+        self._task = None
+        # 可选的 MetricsRegistry，记录每个任务的发送耗时和结果
+        self.metrics = None
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+
+    @classmethod
+    def from_config(cls, mail_config):
+        """根据 `mail` 配置项创建发送任务"""
+        return cls(**cls.config_options(mail_config))
+
+    @classmethod
+    def config_options(cls, mail_config):
+        """解析 `mail` 配置项中发送任务的参数"""
+        return dict(
+            host=mail_config.get('host'),
+            port=int(mail_config.get('port') or 25),
+            sender=mail_config.get('sender'),
+            password=mail_config.get('password'),
+            queue_size=int(mail_config.get('queue_size', 1000)),
+            idle_timeout=float(mail_config.get('idle_timeout', 60))
+        )
+
+    def reconfigure(self, options):
+        """
+        应用 config_options 解析出的新参数，队列中的邮件保留并使用新的服务器发送
+
+        队列长度需要重启服务才能生效。
+        """
+        connection = (options['host'], options['port'], options['sender'], options['password'])
+        if connection != (self.host, self.port, self.sender, self.password):
+            self.host, self.port, self.sender, self.password = connection
+            self._reconnect = True
+        self.idle_timeout = options['idle_timeout']
+
+    def submit(self, subject, receivers, body):
+        """
+        将邮件加入发送队列
+
+        Returns:
+            MailJob 对象
+
+        Raises:
+            asyncio.QueueFull: 队列已满
+        """
+        return self.submit_batch([(list(receivers), subject, body)])
+
+    def submit_batch(self, messages):
+        """
+        将多封邮件作为一个任务加入发送队列，这些邮件会在同一个 SMTP 会话中发送
+
+        Args:
+            messages: (收件人列表, 主题, 正文) 的列表
+
+        Returns:
+            MailJob 对象
+
+        Raises:
+            asyncio.QueueFull: 队列已满
+        """
+        job = MailJob(messages)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_tracked_jobs:
+            self._jobs.popitem(last=False)
+        return job
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                job = await asyncio.wait_for(self._queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                if self._smtp is not None:
+                    logging.debug('SMTP 连接空闲，已断开')
+                    await asyncio.to_thread(self._disconnect)
+                continue
+            if self._reconnect:
+                self._reconnect = False
+                await asyncio.to_thread(self._disconnect)
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._deliver, job)
+            except Exception as e:
+                # 单个任务出错不能让后台任务退出，否则之后的邮件会一直停留在 queued
+                self._fail(job, e)
+            finally:
+                self._queue.task_done()
+            if self.metrics is not None:
+                self.metrics.observe_upstream('smtp', job.status, time.perf_counter() - started)
+
+    def _connect(self):
+        if self.port == 465:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        if self.password:
+            smtp.login(self.sender, self.password)
+        logging.debug(f'SMTP 登录成功: {self.host}:{self.port}')
+        self.connections += 1
+        self._smtp = smtp
+
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def build_message(self, subject, receivers, body):
+        message = MIMEText(body, 'plain', 'utf-8')
+        message['From'] = Header(self.sender, 'utf-8')
+        message['To'] = Header(', '.join(receivers), 'utf-8')
+        message['Subject'] = Header(subject, 'utf-8')
+        return message.as_string()
+
+    def send_messages(self, messages):
+        """
+        在同一个 SMTP 会话中发送多封邮件，连接失效时重连一次
+
+        Args:
+            messages: (收件人列表, 邮件内容) 的列表
+        """
+        for receivers, message in messages:
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._connect()
+                try:
+                    self._smtp.sendmail(self.sender, receivers, message)
+                    break
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+                    # 复用的连接可能已被服务器关闭
+                    self._disconnect()
+                    if attempt:
+                        raise
+
+    def _deliver(self, job):
+        for receivers, subject, _ in job.messages:
+            logging.info(f'Sending email to {", ".join(receivers)} with subject: {subject}')
+        try:
+            self.send_messages([
+                (receivers, self.build_message(subject, receivers, body))
+                for receivers, subject, body in job.messages
+            ])
+            job.status = 'sent'
+            job.sent_at = time.time()
+            self.sent += len(job.messages)
+        except (smtplib.SMTPException, OSError) as e:
+            self._fail(job, e)
+        except Exception as e:
+            # 如收件人地址无法编码，会话可能停在一封邮件的中间，断开后由下一个任务重新连接
+            self._disconnect()
+            self._fail(job, e)
+
+    def _fail(self, job, error):
+        job.status = 'failed'
+        job.error = f'Error: unable to send email, {str(error)}'
+        self.failed += 1
+        logging.error(job.error)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'connections': self.connections
+        }
+
+    async def aclose(self, timeout=10.0):
+        """等待队列中的邮件发送完毕后断开连接，最多等待 `timeout` 秒"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'关闭时仍有 {self._queue.qsize()} 封邮件未发送')
+        self._task.cancel()
+        self._task = None
+        await asyncio.to_thread(self._disconnect)
+
+
+class _TemplateFields(dict):
+    # 模板中未知的占位符保持原样
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def render_template(template, fields):
+    try:
+        return template.format_map(_TemplateFields(fields))
+    except (ValueError, IndexError, AttributeError):
+        return template
+
+
+class AlertDigest:
+    """
+    警报邮件摘要
+
+    第一条警报到达后开始一个 `window` 秒的汇总窗口，窗口内的警报合并为每个收件人一封邮件，
+    并在同一个 SMTP 会话中发送给全部收件人。同一设备同一等级的警报在窗口内只保留最新一条，
+    并且在 `cooldown` 秒内不会重复通知。邮件标题和正文使用 `mail` 配置项中 `format` 的
+    `title` 与 `content` 模板，正文模板对每条警报分别渲染。
+    """
+
+    default_title = '设备警报：{count} 个设备达到{level_name}'
+    default_content = '{time} 设备 {id}：{previous_level_name} -> {level_name}（读数 {value}）'
+
+    def __init__(self, worker, receivers, min_level, title=None, content=None, window=300.0, cooldown=3600.0):
+        self.worker = worker
+        self.receivers = receivers
+        self.min_level = min_level
+        self.title = title or self.default_title
+        self.content = content or self.default_content
+        self.window = window
+        self.cooldown = cooldown
+        self._pending = OrderedDict()
+        self._last_notified = {}
+        self._ready = asyncio.Event()
+        self._task = None
+        self.received = 0
+        self.deduplicated = 0
+        self.digests = 0
+
+    @classmethod
+    def from_config(cls, worker, mail_config):
+        """根据 `mail` 配置项创建警报摘要，未启用警报或没有收件人时返回 None"""
+        options = cls.config_options(mail_config)
+        return cls(worker, **options) if options else None
+
+    @classmethod
+    def config_options(cls, mail_config):
+        """解析 `mail` 配置项中警报摘要的参数，未启用警报或没有收件人时返回 None"""
+        min_level = int(mail_config.get('alert_level', 0))
+        receivers = [r.get('email') for r in mail_config.get('receivers', []) if r.get('email')]
+        if min_level <= 0 or not receivers:
+            return None
+        body_format = mail_config.get('format') or {}
+        return dict(
+            receivers=receivers,
+            min_level=min_level,
+            title=body_format.get('title'),
+            content=body_format.get('content'),
+            window=float(mail_config.get('digest_window', 300)),
+            cooldown=float(mail_config.get('alert_cooldown', 3600))
+        )
+
+    def reconfigure(self, options):
+        """应用 config_options 解析出的新参数，尚未发送的警报和冷却时间保留"""
+        self.receivers = options['receivers']
+        self.min_level = options['min_level']
+        self.title = options['title'] or self.default_title
+        self.content = options['content'] or self.default_content
+        self.window = options['window']
+        self.cooldown = options['cooldown']
+
+    def add(self, events, readings):
+        """
+        加入一轮阈值判定产生的警报事件
+
+        Args:
+            events: AlertEvent 列表
+            readings: `{设备ID: 规范化读数}`，读数中的属性可以在正文模板中引用
+        """
+        now = time.time()
+        for event in events:
+            if event.level < self.min_level:
+                continue
+            self.received += 1
+            key = (event.device_id, event.level)
+            last = self._last_notified.get(key)
+            if key in self._pending or (last is not None and now - last < self.cooldown):
+                self.deduplicated += 1
+            fields = dict(readings.get(event.device_id, {}))
+            fields.update(event.to_dict())
+            fields['previous_level_name'] = ALERT_LEVEL_NAMES[event.previous_level]
+            fields['time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            if last is None or now - last >= self.cooldown:
+                self._pending[key] = fields
+        if self._pending:
+            self._ready.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            await asyncio.sleep(self.window)
+            self._ready.clear()
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        alerts = list(self._pending.values())
+        now = time.time()
+        for key in self._pending:
+            self._last_notified[key] = now
+        self._pending.clear()
+
+        highest = max(alerts, key=lambda fields: fields['level'])
+        summary = {
+            'count': len(alerts),
+            'level': highest['level'],
+            'level_name': highest['level_name'],
+            'time': highest['time'],
+            'devices': ', '.join(fields['id'] for fields in alerts)
+        }
+        subject = render_template(self.title, summary)
+        body = '\n'.join(render_template(self.content, fields) for fields in alerts)
+        try:
+            self.worker.submit_batch([([receiver], subject, body) for receiver in self.receivers])
+            self.digests += 1
+        except asyncio.QueueFull:
+            logging.error(f'邮件发送队列已满，丢弃 {len(alerts)} 条警报通知')
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'deduplicated': self.deduplicated,
+            'pending': len(self._pending),
+            'digests': self.digests
+        }
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # 关闭前发出尚未发送的警报
+        self.flush()
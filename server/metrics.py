@@ -0,0 +1,275 @@
+import asyncio
+import time
+from bisect import bisect_left
+
+# 请求和上游调用耗时的直方图分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 事件循环延迟的直方图分桶（秒）
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# 按组件名导出的 stats() 数值
+COMPONENTS = ('upstream', 'snapshot_cache', 'proxy_cache', 'circuit_breakers', 'request_log', 'reading_store', 'broadcaster',
+              'mail_worker', 'alert_digest', 'poller', 'config_watcher')
+
+# stats() 中只增不减的累计值，导出为带 `_total` 后缀的 counter，其余数值导出为 gauge
+COUNTER_KEYS = frozenset((
+    'hits', 'misses', 'reloads', 'mapped', 'errors', 'coalesced', 'evictions', 'stale_served', 'batches', 'dropped',
+    'written', 'rotations', 'published', 'delivered', 'resyncs', 'sent', 'failed', 'connections', 'received',
+    'deduplicated', 'digests', 'polls', 'stale', 'changes', 'hedgeable', 'hedged', 'hedge_wins', 'pruned'
+))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """
+    固定分桶的直方图
+
+    每个桶只记录落入该桶的次数，导出时再累加为 Prometheus 要求的累计计数，记录一次只需一次二分查找和三次加法。
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """
+    Prometheus 格式的服务指标
+
+    所有计数只在事件循环线程中修改，不需要加锁：每次记录只是一次字典查找、一次二分查找和几次加法，
+    标签组合对应的直方图在第一次出现时创建，请求次数即直方图的计数。
+    导出时才把计数格式化为文本，并读取各组件 stats() 中的数值。
+    """
+
+    def __init__(self, lag_interval=0.5):
+        self.lag_interval = lag_interval
+        # (方法, 路由, 状态码) -> 耗时直方图
+        self.requests = {}
+        self.in_flight = 0
+        # (上游, 结果) -> 调用次数
+        self.upstream_calls = {}
+        # 上游 -> 耗时直方图
+        self.upstream_duration = {}
+        # 上游 -> 限流排队时间直方图
+        self.upstream_queue = {}
+        # 上游 -> 因排队过久被拒绝的请求数
+        self.upstream_rejected = {}
+        # (上游, 先返回的请求) -> 对冲次数
+        self.upstream_hedges = {}
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.loop_lag_max = 0.0
+        self._task = None
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建指标"""
+        return cls(lag_interval=float(api_config.get('metrics_lag_interval', 0.5)))
+
+    def observe_request(self, method, route, status, duration):
+        """记录一次处理完成的请求，`route` 为路由模板而不是实际路径，避免标签组合无限增长"""
+        key = (method, route, status)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram()
+        # 每个请求都会调用，直接展开 Histogram.observe 省去一次方法调用
+        histogram.counts[bisect_left(histogram.buckets, duration)] += 1
+        histogram.sum += duration
+        histogram.count += 1
+
+    def observe_upstream(self, upstream, outcome, duration):
+        """
+        记录一次上游调用
+
+        Args:
+            upstream: 上游名称，如 `aliyun`、`huawei`、`iam`、`smtp`
+            outcome: 调用结果，如 `2xx`、`5xx`、`timeout`、`error`、`sent`、`failed`
+            duration: 耗时（秒）
+        """
+        key = (upstream, outcome)
+        self.upstream_calls[key] = self.upstream_calls.get(key, 0) + 1
+        histogram = self.upstream_duration.get(upstream)
+        if histogram is None:
+            histogram = self.upstream_duration[upstream] = Histogram()
+        histogram.observe(duration)
+
+    def observe_queue(self, upstream, delay, rejected=False):
+        """记录一次请求在上游限流队列中的等待时间，`rejected` 为 True 时记录被拒绝的请求"""
+        if rejected:
+            self.upstream_rejected[upstream] = self.upstream_rejected.get(upstream, 0) + 1
+            return
+        histogram = self.upstream_queue.get(upstream)
+        if histogram is None:
+            histogram = self.upstream_queue[upstream] = Histogram()
+        histogram.observe(delay)
+
+    def observe_hedge(self, upstream, won):
+        """记录一次对冲请求，`won` 为 True 表示对冲请求先于原请求返回"""
+        key = (upstream, 'hedge' if won else 'primary')
+        self.upstream_hedges[key] = self.upstream_hedges.get(key, 0) + 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._monitor_loop_lag())
+
+    async def _monitor_loop_lag(self):
+        # 定时睡眠，实际醒来时间比预期晚的部分即为事件循环被占用的时间
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(time.perf_counter() - started - self.lag_interval, 0.0)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    def render(self, state=None):
+        """
+        导出 Prometheus 文本格式的全部指标
+
+        Args:
+            state: 可选，`app.state`，用于读取各组件 stats() 中的数值
+        """
+        lines = []
+
+        def family(name, kind, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+
+        requests = [
+            ({'method': method, 'route': route, 'status': status}, histogram)
+            for (method, route, status), histogram in list(self.requests.items())
+        ]
+        family('fastapp_requests_total', 'counter', '按路由和状态码统计的请求次数', (
+            ('fastapp_requests_total', labels, histogram.count) for labels, histogram in requests
+        ))
+        family('fastapp_request_duration_seconds', 'histogram', '按路由和状态码统计的请求处理耗时', (
+            sample for labels, histogram in requests
+            for sample in histogram.samples('fastapp_request_duration_seconds', labels)
+        ))
+        family('fastapp_requests_in_flight', 'gauge', '正在处理的请求数',
+               [('fastapp_requests_in_flight', {}, self.in_flight)])
+        family('fastapp_upstream_calls_total', 'counter', '按上游和结果统计的调用次数', (
+            ('fastapp_upstream_calls_total', {'upstream': upstream, 'outcome': outcome}, count)
+            for (upstream, outcome), count in list(self.upstream_calls.items())
+        ))
+        family('fastapp_upstream_duration_seconds', 'histogram', '按上游统计的调用耗时', (
+            sample for upstream, histogram in list(self.upstream_duration.items())
+            for sample in histogram.samples('fastapp_upstream_duration_seconds', {'upstream': upstream})
+        ))
+        family('fastapp_upstream_queue_seconds', 'histogram', '按上游统计的限流排队时间', (
+            sample for upstream, histogram in list(self.upstream_queue.items())
+            for sample in histogram.samples('fastapp_upstream_queue_seconds', {'upstream': upstream})
+        ))
+        family('fastapp_upstream_rejected_total', 'counter', '按上游统计的因排队过久被拒绝的请求数', (
+            ('fastapp_upstream_rejected_total', {'upstream': upstream}, count)
+            for upstream, count in list(self.upstream_rejected.items())
+        ))
+        family('fastapp_upstream_hedges_total', 'counter', '按上游和先返回的请求统计的对冲次数', (
+            ('fastapp_upstream_hedges_total', {'upstream': upstream, 'winner': winner}, count)
+            for (upstream, winner), count in list(self.upstream_hedges.items())
+        ))
+        family('fastapp_event_loop_lag_seconds', 'histogram', '事件循环调度延迟',
+               self.loop_lag.samples('fastapp_event_loop_lag_seconds', {}))
+        family('fastapp_event_loop_lag_max_seconds', 'gauge', '启动以来最大的事件循环调度延迟',
+               [('fastapp_event_loop_lag_max_seconds', {}, self.loop_lag_max)])
+
+        for component in COMPONENTS:
+            instance = getattr(state, component, None) if state is not None else None
+            if instance is None:
+                continue
+            stats = instance.stats()
+            if component == 'snapshot_cache':
+                lookups = stats['hits'] + stats['misses']
+                stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            for key, value in stats.items():
+                # 只导出数值，嵌套的明细仍可通过对应的状态接口查看
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key in COUNTER_KEYS:
+                    name = f'fastapp_{component}_{key}_total'
+                    family(name, 'counter', f'{component}.stats() 中的 {key}', [(name, {}, value)])
+                else:
+                    name = f'fastapp_{component}_{key}'
+                    family(name, 'gauge', f'{component}.stats() 中的 {key}', [(name, {}, value)])
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的路由、状态码和耗时的 ASGI 中间件
+
+    使用纯 ASGI 实现而不是 BaseHTTPMiddleware，不会为每个请求额外创建任务和响应流。
+    指标对象从 `app.state.metrics` 读取，未设置时不记录。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        metrics = getattr(scope['app'].state, 'metrics', None)
+        if metrics is None:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            # 路由匹配后 scope 中才有 route，未匹配的请求统一记录，避免任意路径产生新的标签
+            route = scope.get('route')
+            metrics.observe_request(scope['method'], route.path if route is not None else 'unmatched',
+                                    status, time.perf_counter() - started)
@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+
+from aliyun import AliyunSigner
+from proxy import fetch_device
+
+
+class DevicePoller:
+    """
+    按 `request_cycle` 配置定时请求全部设备的后台任务
+
+    每个设备按各自的周期调度，周期以计划时间为基准累加，不会因请求耗时而漂移；
+    每次调度叠加随机抖动，避免所有设备同时请求上游。请求失败的设备按指数退避延后重试；
+    上游不可用时代理返回的旧结果同样按失败处理，保留上次的读数。
+    结果汇总后定期发布为 `final.json` 和 `output.json` 的内存快照，并交给阈值判定；每条读数同时写入时序存储。
+    读数或警报等级发生变化的设备通过推送发送给订阅者。
+    各设备的警报等级在首次发布和发生变化时发布为 `alert_levels.json` 快照，多进程模式下供其他进程读取。
+    设置了 `aliyun_signer` 或 `huawei_credentials` 时轮询使用这些凭据，否则使用 `api` 配置项中的凭据。
+    """
+
+    def __init__(self, state, devices, interval=60.0, intervals=None, jitter=0.1, concurrency=16,
+                 max_backoff=600.0, publish_interval=1.0, aliyun_signer=None, huawei_credentials=None):
+        self.state = state
+        self.devices = {device.id: device for device in devices}
+        self.interval = interval
+        self.intervals = intervals or {}
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.publish_interval = publish_interval
+        self.aliyun_signer = aliyun_signer
+        self.huawei_credentials = huawei_credentials
+        self.readings = {}
+        # 自上次发布以来读数发生变化的设备
+        self._changed = set()
+        self._failures = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._dirty = asyncio.Event()
+        self._tasks = []
+        self._inflight = set()
+        self.polls = 0
+        self.errors = 0
+        self.stale = 0
+        self.max_lag = 0.0
+
+    @classmethod
+    def from_config(cls, state, config, devices=None):
+        """
+        根据 `request_cycle` 配置项创建轮询器，未启用时返回 None
+
+        `devices` 默认为 `state.device_list` 中的设备。`value` 中形如 `{"id": "设备ID", "interval": 30}` 的条目用于单独指定设备的请求周期。
+        配置项中的 `access-key-secret` 和完整填写的 `huawei_iam_*` 凭据用于轮询请求，未填写时使用 `api` 配置项中的凭据。
+        """
+        cycle_config = next((item for item in config if item.get("setting") == "request_cycle"), {})
+        if not cycle_config.get('enabled', False):
+            return None
+        intervals = {}
+        for item in cycle_config.get('value', []):
+            if isinstance(item, dict) and 'id' in item and 'interval' in item:
+                intervals[item['id']] = float(item['interval'])
+        secret = cycle_config.get('access-key-secret')
+        huawei_credentials = tuple(cycle_config.get(f'huawei_iam_{key}') for key in ('username', 'password', 'area', 'domain'))
+        return cls(
+            state,
+            state.device_list.devices if devices is None else devices,
+            interval=float(cycle_config.get('interval', 60)),
+            intervals=intervals,
+            jitter=float(cycle_config.get('jitter', 0.1)),
+            concurrency=int(cycle_config.get('concurrency', 16)),
+            max_backoff=float(cycle_config.get('max_backoff', 600)),
+            aliyun_signer=AliyunSigner(secret) if secret else None,
+            huawei_credentials=huawei_credentials if all(huawei_credentials) else None
+        )
+
+    def restore_readings(self, readings):
+        """沿用重新加载配置前的读数，只保留仍在设备列表中的设备，启动后立即发布一次"""
+        self.readings = {device_id: reading for device_id, reading in readings.items() if device_id in self.devices}
+        self._dirty.set()
+
+    def device_interval(self, device_id):
+        return self.intervals.get(device_id, self.interval)
+
+    def _schedule(self, device_id, anchor):
+        interval = self.device_interval(device_id)
+        due = anchor + random.uniform(-self.jitter, self.jitter) * interval
+        heapq.heappush(self._heap, (due, anchor, device_id))
+        self._wakeup.set()
+
+    def start(self):
+        now = time.monotonic()
+        for device_id in self.devices:
+            # 首轮请求分散在一个周期内
+            self._schedule(device_id, now + random.uniform(0, self.device_interval(device_id)))
+        self._tasks = [asyncio.ensure_future(self._run()), asyncio.ensure_future(self._publish_loop())]
+        logging.info(f'设备轮询已启动，共 {len(self.devices)} 个设备')
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due, anchor, device_id = heapq.heappop(self._heap)
+            task = asyncio.ensure_future(self._poll(device_id, due, anchor))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _poll(self, device_id, due, anchor):
+        device = self.devices[device_id]
+        interval = self.device_interval(device_id)
+        try:
+            async with self._semaphore:
+                self.max_lag = max(self.max_lag, time.monotonic() - due)
+                data, age = await fetch_device(self.state, device, self.aliyun_signer, self.huawei_credentials)
+            if age is not None:
+                # 旧结果不是新的读数，不能覆盖读数、写入时序存储或参与警报判定
+                self.stale += 1
+                raise RuntimeError(f'上游不可用，只有 {age:.0f} 秒前的旧结果')
+            self.polls += 1
+            self._failures.pop(device_id, None)
+            reading = data[0] if data else {}
+            if self.readings.get(device_id) != reading:
+                self._changed.add(device_id)
+            self.readings[device_id] = reading
+            if data and self.state.reading_store:
+                self.state.reading_store.add(device_id, data[0])
+            self._dirty.set()
+            next_anchor = anchor + interval
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            failures = self._failures.get(device_id, 0) + 1
+            self._failures[device_id] = failures
+            # 先限制指数，长时间失败时 2 ** failures 不会溢出为 OverflowError
+            backoff = min(interval * 2 ** min(failures, 16), self.max_backoff)
+            logging.warning(f'设备 {device_id} 请求失败（连续 {failures} 次），{backoff:.0f} 秒后重试: {getattr(e, "detail", e)}')
+            next_anchor = time.monotonic() + backoff
+        # 落后超过一个周期时跳过错过的轮次，而不是连续补发
+        now = time.monotonic()
+        if next_anchor < now:
+            next_anchor += ((now - next_anchor) // interval + 1) * interval
+        self._schedule(device_id, next_anchor)
+
+    async def _publish_loop(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            readings = dict(self.readings)
+            self.state.snapshot_cache.publish('final.json', readings)
+            self.state.snapshot_cache.publish('output.json', readings)
+            events = self.state.alert_evaluator.evaluate_readings(readings)
+            if events or self.state.snapshot_cache.get_published('alert_levels.json') is None:
+                self.state.snapshot_cache.publish('alert_levels.json', self.state.alert_evaluator.current_levels())
+            if events and self.state.alert_digest:
+                self.state.alert_digest.add(events, readings)
+            changed, self._changed = self._changed, set()
+            for device_id in changed:
+                self.state.broadcaster.publish('reading', device_id, {'id': device_id, 'data': readings[device_id]})
+            for event in events:
+                self.state.broadcaster.publish('alert', event.device_id, event.to_dict())
+            await asyncio.sleep(self.publish_interval)
+
+    def stats(self):
+        return {
+            'devices': len(self.devices),
+            'polls': self.polls,
+            'errors': self.errors,
+            'stale': self.stale,
+            'failing': dict(self._failures),
+            'in_flight': len(self._inflight),
+            'max_lag': self.max_lag
+        }
+
+    async def aclose(self):
+        for task in self._tasks + list(self._inflight):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._inflight, return_exceptions=True)
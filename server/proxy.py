@@ -0,0 +1,239 @@
+import math
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+from fastapi import HTTPException
+
+from aliyun import aliyun_normalize_response
+from devices import DeviceType
+from huawei import huawei_get_data, huawei_normalize_response
+from proxy_cache import ProxyResponseCache
+from ratelimit import RateLimitExceeded
+
+# 可以对冲的阿里云接口，只读且幂等
+IDEMPOTENT_ALIYUN_ACTIONS = frozenset({'QueryDevicePropertyStatus'})
+
+
+async def fetch_aliyun(state, url, signer=None):
+    """
+    请求阿里云物联网平台 URL
+
+    相同 URL 的并发请求只会请求一次上游。缓存键使用加入签名前的 URL，
+    否则每次请求的 Timestamp 和 SignatureNonce 都不同，缓存永远不会命中；
+    键中包含签名密钥的摘要，使用不同密钥的请求不会共享结果。
+    请求上游前按 URL 中的 AccessKeyId 限流，同一 AccessKeyId 下按设备公平排队；
+    排队结束后再签名，签名中的时间戳不会因排队而过期。
+    只有查询设备属性（QueryDevicePropertyStatus）这类幂等读取会被对冲，对冲请求同样消耗限流器的令牌。
+    上游主机熔断或请求失败时，返回该 URL 最近一次成功的结果。
+
+    Args:
+        state: app.state
+        url: 未签名的请求 URL
+        signer: 可选，签名所用的 AliyunSigner，默认使用 `api` 配置项中的 AccessKeySecret
+
+    Returns:
+        (上游状态码, 规范化后的数据列表, 旧结果的时长)，结果不是旧结果时时长为 None
+    """
+    signer = signer or state.aliyun_signer
+    key = ('aliyun', signer.fingerprint, ProxyResponseCache.normalize_url(url))
+
+    async def fetch():
+        parts = urlsplit(url)
+        breaker = check_circuit(state, 'aliyun', parts.netloc)
+        params = parse_qs(parts.query)
+        device = tuple(params.get(name, [''])[0] for name in ('ProductKey', 'DeviceName', 'IotId'))
+        access_key_id = params.get('AccessKeyId', [''])[0]
+        await rate_limit(state, 'aliyun', access_key_id, device)
+        authenticated_url = signer.add_authentication(url)
+        started = time.perf_counter()
+        try:
+            # 对冲请求需要新的 SignatureNonce，否则会被阿里云当作重放请求拒绝
+            response = await state.upstream.get(
+                authenticated_url, upstream='aliyun',
+                hedge=params.get('Action', [''])[0] in IDEMPOTENT_ALIYUN_ACTIONS,
+                resign=lambda: signer.add_authentication(url),
+                admit=lambda: state.rate_limits.try_acquire('aliyun', access_key_id)
+            )
+        except httpx.TimeoutException:
+            breaker.record_failure()
+            log_request(state, 'aliyun', url, started, 504, authenticated_url=authenticated_url)
+            raise HTTPException(status_code=504, detail="请求超时")
+        except httpx.HTTPError:
+            breaker.record_failure()
+            log_request(state, 'aliyun', url, started, 500, authenticated_url=authenticated_url)
+            raise HTTPException(status_code=500, detail="请求失败")
+        log_request(state, 'aliyun', url, started, response.status_code, authenticated_url=authenticated_url)
+        if upstream_unavailable(response.status_code):
+            breaker.record_failure()
+            return response.status_code, aliyun_normalize_response(response)
+        breaker.record_success()
+        data = aliyun_normalize_response(response)
+        if response.status_code == 200:
+            state.circuit_breakers.remember(key, data)
+        return response.status_code, data
+
+    try:
+        status_code, data = await state.proxy_cache.get_or_fetch(key, fetch, cacheable=lambda result: result[0] == 200)
+    except HTTPException as e:
+        stale = state.circuit_breakers.stale(key) if upstream_unavailable(e.status_code) else None
+        if stale is None:
+            raise
+        return 200, stale.value, stale.age
+    if upstream_unavailable(status_code):
+        stale = state.circuit_breakers.stale(key)
+        if stale is not None:
+            return 200, stale.value, stale.age
+    return status_code, data, None
+
+
+async def fetch_huawei(state, url, credentials=None, hedge=False):
+    """
+    请求华为云物联网平台 URL，相同凭据对相同 URL 的并发请求只会请求一次上游；
+    请求上游前按 IAM 用户和主机限流，同一主机下按 URL 路径（包含设备ID）公平排队。
+    代理的 URL 可能是任意接口，只有调用方确认幂等的请求才会被对冲。
+    上游主机熔断或请求失败时，返回该 URL 最近一次成功的结果。
+
+    Args:
+        state: app.state
+        url: 请求 URL
+        credentials: 可选，(用户名, 密码, 区域, 域名)，默认使用 `api` 配置项中的 IAM 凭据
+        hedge: 请求是否幂等、可以对冲，对冲请求同样消耗限流器的令牌
+
+    Returns:
+        (上游返回的 JSON 数据, 旧结果的时长)，结果不是旧结果时时长为 None
+    """
+    key = (
+        'huawei',
+        ProxyResponseCache.fingerprint(*(credentials or state.huawei_token_manager.default_credentials)),
+        ProxyResponseCache.normalize_url(url)
+    )
+
+    async def fetch():
+        parts = urlsplit(key[2])
+        breaker = check_circuit(state, 'huawei', parts.netloc)
+        if credentials is None:
+            token = await state.huawei_token_manager.get_default_token()
+            username = state.huawei_token_manager.username
+        else:
+            token = await state.huawei_token_manager.get_iam_token(*credentials)
+            username = credentials[0]
+        credential = f'{username}@{parts.netloc}'
+        await rate_limit(state, 'huawei', credential, parts.path)
+        started = time.perf_counter()
+        try:
+            response_data = await huawei_get_data(
+                state.upstream, token, url, hedge=hedge,
+                admit=lambda: state.rate_limits.try_acquire('huawei', credential)
+            )
+        except Exception as e:
+            status_code = huawei_http_exception(e).status_code
+            if upstream_unavailable(status_code):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            log_request(state, 'huawei', url, started, status_code)
+            raise
+        breaker.record_success()
+        state.circuit_breakers.remember(key, response_data)
+        log_request(state, 'huawei', url, started, 200)
+        return response_data
+
+    try:
+        return await state.proxy_cache.get_or_fetch(key, fetch), None
+    except Exception as e:
+        stale = state.circuit_breakers.stale(key) if upstream_unavailable(huawei_http_exception(e).status_code) else None
+        if stale is None:
+            raise
+        return stale.value, stale.age
+
+
+async def fetch_device(state, device, aliyun_signer=None, huawei_credentials=None):
+    """
+    请求单个设备的数据并规范化
+
+    Args:
+        state: app.state
+        device: Device 对象
+        aliyun_signer: 可选，阿里云设备签名所用的 AliyunSigner，见 `fetch_aliyun`
+        huawei_credentials: 可选，华为云设备的 IAM 凭据，见 `fetch_huawei`
+
+    Returns:
+        (包含一条 Reading 的列表, 旧结果的时长)，上游数据结构不符合预期时列表为空，结果不是旧结果时时长为 None
+
+    Raises:
+        HTTPException: 上游请求失败或返回错误状态码
+    """
+    if device.type == DeviceType.ALIYUN:
+        status_code, data, age = await fetch_aliyun(state, device.url, aliyun_signer)
+        if status_code != 200:
+            raise HTTPException(status_code=status_code, detail="请求失败")
+        return data, age
+    try:
+        # 设备的 URL 为查询设备影子的 GET 请求，可以对冲
+        response_data, age = await fetch_huawei(state, device.url, huawei_credentials, hedge=True)
+    except Exception as e:
+        raise huawei_http_exception(e)
+    return huawei_normalize_response(response_data), age
+
+
+def upstream_unavailable(status_code):
+    """状态码是否表示上游暂时不可用（限流、超时或服务端错误），这类失败计入熔断并可返回旧结果"""
+    return status_code == 429 or status_code >= 500
+
+
+def check_circuit(state, upstream, host):
+    """
+    返回上游主机的熔断器
+
+    Raises:
+        HTTPException: 熔断器打开，状态码 503
+    """
+    breaker = state.circuit_breakers.get(upstream, host)
+    if not breaker.allow():
+        raise HTTPException(
+            status_code=503,
+            detail=f"上游 {host} 暂不可用",
+            headers={"Retry-After": str(max(1, math.ceil(breaker.retry_after())))}
+        )
+    return breaker
+
+
+async def rate_limit(state, upstream, credential, flow):
+    """
+    等待上游限流器的令牌，同一凭据下按 `flow` 公平排队
+
+    Raises:
+        HTTPException: 预计排队时间过长，状态码 429
+    """
+    try:
+        await state.rate_limits.acquire(upstream, credential, flow)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"上游请求过于频繁，{e}",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
+
+def huawei_http_exception(e):
+    """将华为云请求的异常转换为 HTTPException，上游返回错误时保留原始状态码"""
+    if isinstance(e, HTTPException):
+        return e
+    error_message = str(e)
+    if "Failed to get data" in error_message:
+        # 提取原始状态码
+        status_code = int(error_message.split(":")[1].strip().split()[0])
+        return HTTPException(status_code=status_code, detail=f"请求失败: {error_message}")
+    return HTTPException(status_code=500, detail=f"请求失败: {error_message}")
+
+
+def log_request(state, provider, url, started, status, **fields):
+    """记录一次上游请求，写入由后台任务批量完成"""
+    state.request_log.log(
+        provider=provider,
+        url=url,
+        status=status,
+        latency_ms=round((time.perf_counter() - started) * 1000, 3),
+        **fields
+    )
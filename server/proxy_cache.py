@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class ProxyResponseCache:
+    """
+    代理请求的短时响应缓存
+
+    以规范化后的 URL 为键，缓存上游响应 `ttl` 秒；同一个键正在请求上游时，
+    后续请求会等待同一个结果，而不会重复请求上游。缓存条目数超过 `max_entries` 时按 LRU 淘汰。
+    """
+
+    def __init__(self, ttl=2.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建缓存"""
+        return cls(**cls.config_options(api_config))
+
+    @classmethod
+    def config_options(cls, api_config):
+        """解析 `api` 配置项中缓存的参数"""
+        return dict(
+            ttl=float(api_config.get('proxy_cache_ttl', 2)),
+            max_entries=int(api_config.get('proxy_cache_size', 1024))
+        )
+
+    def reconfigure(self, options):
+        """应用 config_options 解析出的新参数，保留未超出新容量的缓存条目"""
+        self.ttl = options['ttl']
+        self.max_entries = options['max_entries']
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def normalize_url(url):
+        """规范化 URL：协议和主机名小写、查询参数排序、去掉片段"""
+        parts = urlsplit(url.strip())
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+    @staticmethod
+    def fingerprint(*credentials):
+        """凭据的摘要，加入缓存键后不同凭据的请求不会共享结果，键中也不保存凭据本身"""
+        return hashlib.sha256('\0'.join(map(str, credentials)).encode('utf-8')).hexdigest()[:16]
+
+    async def get_or_fetch(self, key, fetch, cacheable=None):
+        """
+        返回键对应的缓存结果，不存在或已过期时调用 `fetch` 获取
+
+        Args:
+            key: 缓存键
+            fetch: 无参数的协程函数，返回需要缓存的结果
+            cacheable: 可选，判断结果是否可以缓存的函数
+
+        Raises:
+            fetch 抛出的异常会传递给所有等待同一结果的请求，且不会被缓存
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, fetch, cacheable))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, fetch, cacheable):
+        value = await fetch()
+        if self.ttl > 0 and (cacheable is None or cacheable(value)):
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        """返回缓存命中统计"""
+        requests = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'hit_rate': (self.hits + self.coalesced) / requests if requests else 0.0
+        }
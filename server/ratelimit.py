@@ -0,0 +1,240 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class RateLimitExceeded(Exception):
+    """预计排队时间超过上限，请求被拒绝"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'预计需要排队 {retry_after:.1f} 秒')
+        self.retry_after = retry_after
+
+
+class FairRateLimiter:
+    """
+    令牌桶限流器，令牌不足时请求进入按流轮转的公平队列
+
+    令牌以 `rate` 个每秒的速度补充，最多积累 `burst` 个，突发请求被平滑为允许的速率。
+    排队的请求按 `flow`（如设备或 URL）分组，每次发放令牌时轮流服务各组，
+    某个设备的大量请求不会让其他设备的请求一直等待。预计等待超过 `max_wait` 秒的请求直接拒绝。
+    """
+
+    def __init__(self, rate, burst=None, max_wait=10.0):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # 流 -> 等待中的 Future 队列，按轮转顺序排列
+        self._flows = OrderedDict()
+        self._waiting = 0
+        self._dispatcher = None
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, flow=None):
+        """
+        获取一个令牌，必要时排队等待
+
+        Args:
+            flow: 公平队列中的分组
+
+        Returns:
+            排队等待的秒数
+
+        Raises:
+            RateLimitExceeded: 预计等待时间超过 `max_wait`
+        """
+        self._refill()
+        if not self._waiting and self._tokens >= 1:
+            self._tokens -= 1
+            self.granted += 1
+            return 0.0
+        expected = (self._waiting + 1 - self._tokens) / self.rate
+        if expected > self.max_wait:
+            self.rejected += 1
+            raise RateLimitExceeded(expected)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._flows.get(flow)
+        if queue is None:
+            queue = self._flows[flow] = deque()
+        queue.append(future)
+        self._waiting += 1
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经分到令牌的请求被取消时归还令牌
+            if future.done() and not future.cancelled():
+                self._tokens = min(self.burst, self._tokens + 1)
+            raise
+        wait = time.monotonic() - started
+        self.granted += 1
+        self.total_wait += wait
+        self.max_observed_wait = max(self.max_observed_wait, wait)
+        return wait
+
+    def try_acquire(self):
+        """
+        不排队地获取一个令牌，用于可有可无的请求（如对冲请求）
+
+        Returns:
+            有令牌可用且没有请求在排队时消耗一个令牌并返回 True，否则返回 False
+        """
+        self._refill()
+        if self._waiting or self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self.granted += 1
+        return True
+
+    async def _dispatch(self):
+        while self._flows:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            flow, queue = next(iter(self._flows.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._flows.move_to_end(flow)
+            else:
+                del self._flows[flow]
+            if future.cancelled():
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': round(self._tokens, 3),
+            'waiting': self._waiting,
+            'granted': self.granted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'avg_wait': self.total_wait / self.queued if self.queued else 0.0,
+            'max_wait': self.max_observed_wait
+        }
+
+    async def aclose(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for queue in self._flows.values():
+            for future in queue:
+                future.cancel()
+        self._flows.clear()
+        self._waiting = 0
+
+
+class UpstreamRateLimits:
+    """
+    各上游平台按凭据区分的限流器
+
+    上游的 QPS 配额按账号计算，每个 (上游, 凭据) 组合使用独立的令牌桶，速率取该上游的配置。
+    没有配置速率的上游不限流。
+    """
+
+    def __init__(self, limits=None, max_wait=10.0):
+        # 上游 -> {"rate": 每秒请求数, "burst": 突发请求数}
+        self.limits = limits or {}
+        self.max_wait = max_wait
+        self.metrics = None
+        self._limiters = {}
+
+    @classmethod
+    def from_config(cls, api_config):
+        """
+        根据 `api` 配置项创建限流器
+
+        `rate_limits` 形如 `{"aliyun": {"rate": 50, "burst": 100}, "huawei": {"rate": 20}}`，
+        `rate_limit_max_wait` 为请求最多排队的秒数。
+        """
+        return cls(**cls.config_options(api_config))
+
+    @classmethod
+    def config_options(cls, api_config):
+        """解析 `api` 配置项中限流的参数"""
+        return dict(
+            limits=api_config.get('rate_limits') or {},
+            max_wait=float(api_config.get('rate_limit_max_wait', 10))
+        )
+
+    def reconfigure(self, options):
+        """
+        应用 config_options 解析出的新参数
+
+        速率变化的上游丢弃原有的限流器，已在排队的请求仍由原限流器放行，之后的请求使用新的速率。
+        """
+        limits = options['limits']
+        changed = {upstream for upstream in self.limits.keys() | limits.keys() if self.limits.get(upstream) != limits.get(upstream)}
+        self.limits = limits
+        self.max_wait = options['max_wait']
+        for key, limiter in list(self._limiters.items()):
+            if key[0] in changed:
+                del self._limiters[key]
+            else:
+                limiter.max_wait = self.max_wait
+
+    def limiter(self, upstream, credential):
+        """返回 (上游, 凭据) 对应的限流器，该上游未配置速率时返回 None"""
+        key = (upstream, credential)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limit = self.limits.get(upstream)
+            if not limit or not limit.get('rate'):
+                return None
+            limiter = FairRateLimiter(float(limit['rate']), float(limit.get('burst') or 0) or None, self.max_wait)
+            self._limiters[key] = limiter
+        return limiter
+
+    async def acquire(self, upstream, credential, flow=None):
+        """
+        在请求上游前获取令牌
+
+        Returns:
+            排队等待的秒数
+
+        Raises:
+            RateLimitExceeded: 预计等待时间超过 `max_wait`
+        """
+        limiter = self.limiter(upstream, credential)
+        if limiter is None:
+            return 0.0
+        try:
+            wait = await limiter.acquire(flow)
+        except RateLimitExceeded:
+            if self.metrics is not None:
+                self.metrics.observe_queue(upstream, 0.0, rejected=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.observe_queue(upstream, wait)
+        return wait
+
+    def try_acquire(self, upstream, credential):
+        """不排队地获取一个令牌，该上游未配置速率时总是返回 True，见 `FairRateLimiter.try_acquire`"""
+        limiter = self.limiter(upstream, credential)
+        return limiter is None or limiter.try_acquire()
+
+    def stats(self):
+        return {f'{upstream}:{credential}': limiter.stats() for (upstream, credential), limiter in list(self._limiters.items())}
+
+    async def aclose(self):
+        for limiter in list(self._limiters.values()):
+            await limiter.aclose()
@@ -0,0 +1,67 @@
+import math
+from collections.abc import Mapping
+
+
+class Reading(Mapping):
+    """
+    一个设备的一条规范化读数
+
+    属性名映射到属性值，能转换为数字的值统一保存为 float，其余保持原样；`time` 为读数时间戳。
+    构造时顺便计算数值属性的最大值 `peak`，阈值判定不需要再遍历属性。
+    可以像 `{属性名: 值, ..., "time": 时间戳}` 字典一样读取，由 fastjson 直接序列化为该形式。
+    """
+    __slots__ = ('values', 'time', 'peak')
+
+    def __init__(self, values, time, peak):
+        self.values = values
+        self.time = time
+        self.peak = peak
+
+    @classmethod
+    def from_pairs(cls, pairs, time):
+        """
+        由 (属性名, 原始值) 序列创建读数
+
+        Args:
+            pairs: (属性名, 原始值) 的可迭代对象，原始值能转换为 float 时保存为 float
+            time: 读数时间戳，名为 `time` 的属性会被它覆盖
+        """
+        values = {}
+        peak = -math.inf
+        for name, value in pairs:
+            if name == 'time':
+                # 时间戳不是测量值，不参与峰值
+                continue
+            if type(value) is not float:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    values[name] = value
+                    continue
+            values[name] = value
+            if value > peak:
+                peak = value
+        return cls(values, time, peak if peak != -math.inf else math.nan)
+
+    def __getitem__(self, key):
+        if key == 'time':
+            return self.time
+        return self.values[key]
+
+    def __iter__(self):
+        yield from self.values
+        yield 'time'
+
+    def __len__(self):
+        return len(self.values) + 1
+
+    def __contains__(self, key):
+        return key == 'time' or key in self.values
+
+    def __repr__(self):
+        return f'Reading({self.to_dict()!r})'
+
+    def to_dict(self):
+        data = dict(self.values)
+        data['time'] = self.time
+        return data
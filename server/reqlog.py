@@ -0,0 +1,168 @@
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+import fastjson
+
+
+class RequestLogWriter:
+    """
+    代理请求日志
+
+    请求处理过程中只把记录追加到内存队列，由后台任务按条数或时间批量写入 JSON Lines 文件，
+    写文件在线程中执行，不阻塞事件循环。文件超过 `max_bytes` 或写入时间超过 `rotate_interval` 秒后轮转，
+    轮转出的文件可选使用 gzip 压缩，最多保留 `backup_count` 个。
+
+    多进程模式下各工作进程以追加方式写同一个文件，只有 `rotate` 为 True 的进程（主进程）负责轮转，
+    其他进程发现文件被轮转后重新打开。
+    """
+
+    def __init__(self, path='log_req.txt', batch_size=256, flush_interval=1.0, max_pending=100000,
+                 max_bytes=10 * 1024 * 1024, rotate_interval=86400.0, backup_count=7, compress=True, rotate=True):
+        self.path = os.path.expanduser(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.rotate = rotate
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._task = None
+        self._writing = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建请求日志"""
+        return cls(
+            path=api_config.get('request_log_path', 'log_req.txt'),
+            batch_size=int(api_config.get('request_log_batch_size', 256)),
+            flush_interval=float(api_config.get('request_log_flush_interval', 1)),
+            max_bytes=int(api_config.get('request_log_max_bytes', 10 * 1024 * 1024)),
+            rotate_interval=float(api_config.get('request_log_rotate_interval', 86400)),
+            backup_count=int(api_config.get('request_log_backup_count', 7)),
+            compress=bool(api_config.get('request_log_compress', True))
+        )
+
+    def log(self, **fields):
+        """追加一条日志记录，不会阻塞；队列已满时丢弃记录"""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        fields['ts'] = time.time()
+        self._pending.append(fields)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        records = list(self._pending)
+        self._pending.clear()
+        # 关闭时取消后台任务不应中断正在进行的写入
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, records))
+        try:
+            await asyncio.shield(self._writing)
+        except OSError as e:
+            self.dropped += len(records)
+            logging.error(f'请求日志写入失败: {e}')
+
+    def _write(self, records):
+        data = b''.join(fastjson.dumps(record) + b'\n' for record in records)
+        with self._write_lock:
+            self._maybe_rotate(len(data))
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self.written += len(records)
+            self.batches += 1
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _maybe_rotate(self, incoming):
+        if self._file is None:
+            self._open()
+        if not self.rotate:
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                self._file.close()
+                self._open()
+            return
+        # 其他进程也在追加写入，以文件的实际大小为准
+        self._size = os.fstat(self._file.fileno()).st_size
+        expired = time.time() - self._opened_at >= self.rotate_interval
+        if self._size == 0 or (self._size + incoming <= self.max_bytes and not expired):
+            return
+        self._file.close()
+        rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            suffix += 1
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+        self.rotations += 1
+        # 同一秒内轮转的文件带有序号后缀，按文件名排序不能反映先后，按修改时间排序
+        backups = sorted(glob.glob(glob.escape(self.path) + '.*'), key=os.path.getmtime)
+        for old in backups[:max(0, len(backups) - self.backup_count)]:
+            os.remove(old)
+        self._open()
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'rotations': self.rotations
+        }
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+        await self._flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,250 @@
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+import sys
+import time
+
+# inotify 事件掩码，见 <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+
+# 差异中需要隐藏取值的配置键
+_SECRET_MARKERS = ('secret', 'password')
+
+
+class FrozenDict(dict):
+    """不可修改的字典，仍是 dict 的子类，可以直接序列化为 JSON 并传给只读取配置的代码"""
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('配置对象不可修改')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value):
+    """把 JSON 解析结果递归转换为不可修改的 FrozenDict 和 tuple"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def _mask(key, value):
+    return '******' if any(marker in key.lower() for marker in _SECRET_MARKERS) else value
+
+
+class Settings:
+    """
+    settings.json 解析后的不可修改配置
+
+    重新加载时创建新的对象整体替换，已经取得旧对象的请求继续使用旧配置。
+    """
+    __slots__ = ('path', 'config', 'sections', 'version', 'loaded_at')
+
+    def __init__(self, path, config, version=1):
+        self.path = path
+        self.config = freeze(config)
+        self.sections = FrozenDict(
+            (item['setting'], item) for item in self.config if isinstance(item, dict) and 'setting' in item
+        )
+        self.version = version
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls, path, version=1):
+        """
+        读取并校验配置文件
+
+        Raises:
+            OSError: 文件无法读取
+            ValueError: 文件不是合法的 JSON，或缺少必需的配置项
+        """
+        with open(path, 'r', encoding='utf-8') as file:
+            config = json.load(file)
+        if not isinstance(config, list):
+            raise ValueError('配置文件应为配置项列表')
+        settings = cls(path, config, version)
+        for name in ('api', 'mail'):
+            if name not in settings.sections:
+                raise ValueError(f'配置文件缺少 {name} 配置项')
+        if not settings.api.get('access-key-secret'):
+            raise ValueError("阿里云平台的AccessKeySecret未在配置文件中指定")
+        return settings
+
+    @property
+    def api(self):
+        return self.sections['api']
+
+    @property
+    def mail(self):
+        return self.sections['mail']
+
+    def section(self, name):
+        """返回名为 `name` 的配置项，不存在时返回空字典"""
+        return self.sections.get(name, FrozenDict())
+
+    def diff(self, other):
+        """
+        比较两份配置
+
+        Args:
+            other: 新的配置
+
+        Returns:
+            `{配置项: {键: {"old": 旧值, "new": 新值}}}`，密码和密钥的取值以 `******` 代替；
+            `device_list` 按设备ID列出新增、删除和修改的设备
+        """
+        changes = {}
+        for name in sorted(self.sections.keys() | other.sections.keys()):
+            old, new = self.section(name), other.section(name)
+            if old == new:
+                continue
+            if name == 'device_list':
+                changes[name] = _diff_devices(old.get('value', ()), new.get('value', ()))
+                continue
+            changes[name] = {
+                key: {'old': _mask(key, old.get(key)), 'new': _mask(key, new.get(key))}
+                for key in sorted(old.keys() | new.keys()) if old.get(key) != new.get(key)
+            }
+        return changes
+
+
+def _diff_devices(old, new):
+    old = {item.get('id'): item for item in old}
+    new = {item.get('id'): item for item in new}
+    return {
+        'added': sorted(str(device_id) for device_id in new.keys() - old.keys()),
+        'removed': sorted(str(device_id) for device_id in old.keys() - new.keys()),
+        'changed': sorted(str(device_id) for device_id in old.keys() & new.keys() if old[device_id] != new[device_id])
+    }
+
+
+class _Inotify:
+    """通过 libc 使用 inotify 监视目录，不可用时构造失败"""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        # 监视所在目录而不是文件本身，编辑器先写临时文件再改名替换时仍能收到事件
+        mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, 'inotify_add_watch 失败')
+        self.fd = fd
+
+    def read_names(self):
+        """读出已到达的全部事件，返回事件涉及的文件名"""
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = struct.unpack_from('iIII', data, offset)
+                offset += 16
+                names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher:
+    """
+    监视配置文件，文件内容变化时调用 `on_change`
+
+    Linux 上使用 inotify，其他平台或 inotify 不可用时每 `poll_interval` 秒检查一次文件的修改时间、大小和 inode。
+    收到事件后等待 `debounce` 秒再检查，编辑器分多次写入时只触发一次。
+    """
+
+    def __init__(self, path, on_change, poll_interval=2.0, debounce=0.2):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.mode = None
+        self._inotify = None
+        self._event = asyncio.Event()
+        self._signature = self._stat()
+        self._task = None
+        self.changes = 0
+        self.errors = 0
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def start(self):
+        if self._task is not None:
+            return
+        if sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify(os.path.dirname(self.path))
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_inotify)
+                self.mode = 'inotify'
+            except (OSError, AttributeError, NotImplementedError) as e:
+                logging.info(f'inotify 不可用，改为定时检查配置文件: {e}')
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+        if self._inotify is None:
+            self.mode = 'poll'
+        self._task = asyncio.ensure_future(self._run())
+        logging.info(f'正在监视配置文件 {self.path}（{self.mode}）')
+
+    def _on_inotify(self):
+        if os.path.basename(self.path) in self._inotify.read_names():
+            self._event.set()
+
+    async def _run(self):
+        while True:
+            if self._inotify is not None:
+                await self._event.wait()
+                self._event.clear()
+                await asyncio.sleep(self.debounce)
+            else:
+                await asyncio.sleep(self.poll_interval)
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            self.changes += 1
+            try:
+                await self.on_change()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f'重新加载配置文件失败，继续使用当前配置: {e}')
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'changes': self.changes,
+            'errors': self.errors
+        }
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,348 @@
+import asyncio
+import os
+import gzip
+import hashlib
+import time
+import uuid
+import logging
+import threading
+from collections.abc import Mapping
+
+import fastjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 服务内部发布的快照没有文件签名，ETag 由本次启动的随机前缀和版本号组成
+_EPOCH = uuid.uuid4().hex[:12]
+
+# 支持的响应体压缩方式，按优先顺序排列
+COMPRESSORS = {}
+if brotli:
+    COMPRESSORS['br'] = lambda body: brotli.compress(body, quality=6)
+COMPRESSORS['gzip'] = lambda body: gzip.compress(body, compresslevel=6, mtime=0)
+
+
+# 尚未从响应体解析的快照数据
+_UNDECODED = object()
+
+
+def _encode(value):
+    return fastjson.dumps(value)
+
+
+def file_signature(path):
+    """文件的 (mtime, 大小, inode)，任一变化都视为文件内容变化"""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def signature_etag(signature):
+    """由文件签名生成的 ETag，只取决于文件本身，重启或多个进程之间保持一致"""
+    return '"{:x}-{:x}-{:x}"'.format(*signature)
+
+
+class Snapshot:
+    """某个数据文件在某一时刻的解析结果"""
+    __slots__ = ('path', '_data', 'body', 'signature', 'version', 'loaded_at', 'index', 'etag', 'encodings')
+
+    def __init__(self, path, data, body, signature, version, index=None, etag=None):
+        self.path = path
+        self._data = data
+        self.body = body
+        self.signature = signature
+        self.version = version
+        self.loaded_at = time.time()
+        self.index = index
+        if etag is not None:
+            self.etag = etag
+        elif signature is not None:
+            self.etag = signature_etag(signature)
+        else:
+            self.etag = f'"{_EPOCH}-{version}"'
+        self.encodings = {}
+
+    @property
+    def data(self):
+        """解析后的数据；来自共享存储的快照在第一次访问时才解析响应体"""
+        if self._data is _UNDECODED:
+            self._data = fastjson.loads(self.body)
+        return self._data
+
+    def encoded(self, encoding):
+        """
+        返回按 `encoding` 压缩后的响应体，每个快照只压缩一次
+
+        Args:
+            encoding: COMPRESSORS 中的压缩方式
+        """
+        body = self.encodings.get(encoding)
+        if body is None:
+            body = COMPRESSORS[encoding](self.body)
+            self.encodings[encoding] = body
+        return body
+
+
+class SnapshotCache:
+    """
+    数据文件快照缓存
+
+    每个文件只解析一次，解析结果与预先序列化好的响应体一起保存在内存中。
+    仅当文件的 mtime、大小或 inode 发生变化时才会重新加载，新快照构建完成后整体替换旧快照，
+    读取方不会看到写了一半的数据。
+
+    多进程模式下提供 `shared`（workers.SharedSnapshots）：主进程发布的快照同时写入共享存储，
+    其他进程直接映射共享存储中的响应体，只在需要时解析。数据文件同样只由第一个发现文件变化的进程解析，
+    响应体按文件签名写入共享存储，其他进程映射同一版本的响应体。
+    """
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._snapshots = {}
+        # 由服务内部直接发布的快照，优先于同名文件
+        self._published = {}
+        # 从共享存储映射的快照：路径 -> (序号, Snapshot)，已撤销的快照为 None
+        self._shared_snapshots = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.mapped = 0
+        self.errors = 0
+
+    def get(self, path, indexer=None):
+        """
+        获取文件的当前快照
+
+        Args:
+            path: 数据文件路径
+            indexer: 可选，重新加载时用于为解析结果构建索引的函数
+
+        Returns:
+            Snapshot 对象
+
+        Raises:
+            OSError: 文件不存在或无法读取
+            ValueError: 文件内容不是合法的 JSON 且没有可用的旧快照
+        """
+        path = os.path.expanduser(path)
+        snapshot, signature = self._lookup(path)
+        if snapshot is None:
+            return self._get_reloaded(path, signature, indexer)
+        return self._hit(snapshot, indexer)
+
+    async def aget(self, path, indexer=None):
+        """
+        与 `get` 相同，供请求处理函数在事件循环中调用
+
+        需要重新加载时，文件解析以及多进程模式下等待其他进程加载完成的文件锁都在线程中执行，不阻塞事件循环；
+        快照仍然有效时直接返回。
+        """
+        path = os.path.expanduser(path)
+        snapshot, signature = self._lookup(path)
+        if snapshot is None:
+            return await asyncio.to_thread(self._get_reloaded, path, signature, indexer)
+        return self._hit(snapshot, indexer)
+
+    def _lookup(self, path):
+        """返回 (无需重新加载即可使用的快照, 文件签名)，快照需要重新加载时为 None"""
+        snapshot = self.get_published(path)
+        if snapshot is not None:
+            return snapshot, None
+        signature = file_signature(path)
+        snapshot = self._snapshots.get(path)
+        if snapshot is None or snapshot.signature != signature:
+            return None, signature
+        return snapshot, signature
+
+    def _get_reloaded(self, path, signature, indexer):
+        with self._lock:
+            # 其他线程可能已经完成了重新加载
+            snapshot = self._snapshots.get(path)
+            if snapshot is None or snapshot.signature != signature:
+                self.misses += 1
+                return self._reload(path, signature, snapshot, indexer)
+        return self._hit(snapshot, indexer)
+
+    def _hit(self, snapshot, indexer):
+        self.hits += 1
+        if indexer is not None and snapshot.index is None:
+            snapshot.index = indexer(snapshot.data)
+        return snapshot
+
+    @staticmethod
+    def _shared_name(path):
+        return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+    def get_published(self, path):
+        """返回 `path` 已发布的快照（包括其他进程发布到共享存储的快照），没有时返回 None"""
+        path = os.path.expanduser(path)
+        snapshot = self._published.get(path)
+        if snapshot is not None or self.shared is None:
+            return snapshot
+        name = self._shared_name(path)
+        sequence = self.shared.sequence(name)
+        if not sequence:
+            return None
+        cached = self._shared_snapshots.get(path)
+        if cached is not None and cached[0] == sequence:
+            return cached[1]
+        mapped = self.shared.read(name)
+        if mapped is None:
+            return cached[1] if cached is not None else None
+        sequence, etag, body = mapped
+        # 没有 ETag 的版本表示快照已被撤销
+        snapshot = Snapshot(path, _UNDECODED, body, None, sequence, etag=etag) if etag is not None else None
+        self._shared_snapshots[path] = (sequence, snapshot)
+        return snapshot
+
+    def publish(self, path, data, indexer=None):
+        """
+        直接发布内存中的数据作为快照，之后对 `path` 的读取不再访问文件
+
+        Args:
+            path: 快照对应的数据文件路径
+            data: 可 JSON 序列化的数据
+            indexer: 可选，用于为数据构建索引的函数
+
+        Returns:
+            新发布的 Snapshot 对象
+        """
+        path = os.path.expanduser(path)
+        body = _encode(data)
+        index = indexer(data) if indexer else None
+        with self._lock:
+            self._version += 1
+            snapshot = Snapshot(path, data, body, None, self._version, index)
+            self._published[path] = snapshot
+        if self.shared is not None:
+            self.shared.write(self._shared_name(path), body, snapshot.etag)
+        return snapshot
+
+    def unpublish(self, path):
+        """撤销 `path` 已发布的快照（包括共享存储中的快照），之后的读取重新使用磁盘上的文件"""
+        path = os.path.expanduser(path)
+        with self._lock:
+            self._published.pop(path, None)
+        if self.shared is not None:
+            self.shared.remove(self._shared_name(path))
+
+    @staticmethod
+    def _load(path, signature):
+        """解析文件，返回 (数据, 响应体, 签名)"""
+        data = fastjson.load_file(path)
+        # 读取期间文件又被修改时，不记录签名，下次请求会再次加载
+        if file_signature(path) != signature:
+            signature = None
+        return data, _encode(data), signature
+
+    def _load_shared(self, path, signature):
+        loaded = None
+
+        def load():
+            nonlocal loaded
+            loaded = self._load(path, signature)
+            # 签名不确定的结果只在本进程使用
+            return loaded[1] if loaded[2] is not None else None
+
+        mapped = self.shared.read_or_load(self._shared_name('file:' + path), signature_etag(signature), load)
+        if loaded is not None:
+            return loaded
+        if mapped is None:
+            return self._load(path, signature)
+        self.mapped += 1
+        return _UNDECODED, mapped[2], signature
+
+    def _reload(self, path, signature, previous, indexer):
+        try:
+            if self.shared is not None:
+                data, body, signature = self._load_shared(path, signature)
+            else:
+                data, body, signature = self._load(path, signature)
+        except ValueError as e:
+            # 文件可能正在被写入，继续使用旧快照
+            self.errors += 1
+            if previous is not None:
+                logging.warning(f'{path} 解析失败，继续使用版本 {previous.version} 的快照: {e}')
+                return previous
+            raise
+
+        self._version += 1
+        snapshot = Snapshot(path, data, body, signature, self._version)
+        if indexer is not None:
+            snapshot.index = indexer(snapshot.data)
+        self._snapshots[path] = snapshot
+        self.reloads += 1
+        logging.debug(f'已重新加载 {path}，版本 {snapshot.version}，大小 {len(body)} 字节')
+        return snapshot
+
+    def stats(self):
+        """返回缓存命中统计"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'mapped': self.mapped,
+            'errors': self.errors,
+            'files': {
+                path: {
+                    'version': s.version,
+                    'etag': s.etag,
+                    'bytes': len(s.body),
+                    'encoded_bytes': {encoding: len(body) for encoding, body in list(s.encodings.items())},
+                    'loaded_at': s.loaded_at
+                }
+                for path, s in list({
+                    **self._snapshots,
+                    **{path: s for path, (_, s) in list(self._shared_snapshots.items()) if s is not None},
+                    **self._published
+                }.items())
+            }
+        }
+
+
+class SingleValueIndex:
+    """
+    output.json 的 (id, key) 索引
+
+    每个值在构建索引时就被编码为 `"key":value` 形式的 JSON 片段，
+    查询时只需一次字典查找和字节拼接，不再需要序列化。
+    """
+    __slots__ = ('fragments', 'encoded_ids')
+
+    def __init__(self, data):
+        self.fragments = {}
+        self.encoded_ids = {}
+        if not isinstance(data, dict):
+            return
+        for id, values in data.items():
+            if not isinstance(values, Mapping):
+                continue
+            self.encoded_ids[id] = _encode(id)
+            for key, value in values.items():
+                self.fragments[(id, key)] = _encode(key) + b':' + _encode(value)
+
+    def single(self, id, key):
+        """返回 `{"key":value}` 响应体，不存在时返回 None"""
+        fragment = self.fragments.get((id, key))
+        if fragment is None:
+            return None
+        return b'{' + fragment + b'}'
+
+    def batch(self, ids, keys):
+        """
+        返回 `{"id":{"key":value,...},...}` 响应体
+
+        不存在的 (id, key) 组合会被跳过，全部不存在时返回 None。
+        """
+        parts = []
+        for id in dict.fromkeys(ids):
+            fragments = [self.fragments[(id, key)] for key in dict.fromkeys(keys) if (id, key) in self.fragments]
+            if fragments:
+                parts.append(self.encoded_ids[id] + b':{' + b','.join(fragments) + b'}')
+        if not parts:
+            return None
+        return b'{' + b','.join(parts) + b'}'
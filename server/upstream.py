@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class HostLatency:
+    """
+    单个上游主机最近若干次请求的耗时分布
+
+    只保留最近 `size` 个样本，每新增 `refresh` 个样本重新排序计算一次分位数，记录一次耗时只是一次追加。
+    样本少于 `min_samples` 个时分位数为 None。
+    """
+    __slots__ = ('samples', 'refresh', 'min_samples', 'p50', 'p95', 'p99', '_pending')
+
+    def __init__(self, size=256, refresh=16, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.refresh = refresh
+        self.min_samples = min_samples
+        self.p50 = self.p95 = self.p99 = None
+        self._pending = 0
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self._pending += 1
+        if len(self.samples) >= self.min_samples and (self._pending >= self.refresh or self.p95 is None):
+            ordered = sorted(self.samples)
+            last = len(ordered) - 1
+            self.p50 = ordered[int(last * 0.5)]
+            self.p95 = ordered[int(last * 0.95)]
+            self.p99 = ordered[int(last * 0.99)]
+            self._pending = 0
+
+
+class UpstreamClient:
+    """
+    代理接口共享的异步上游 HTTP 客户端
+
+    在服务启动时创建、关闭时释放，复用 keep-alive 连接，并限制每个上游主机的并发连接数。
+    设置 `metrics` 后按 `upstream` 参数记录每次调用的耗时和结果。
+
+    每个主机的读取超时由最近请求耗时的 p99 乘以 `timeout_multiplier` 得到，限制在 `min_timeout` 和 `timeout` 之间，
+    卡住的连接不会占用请求到固定超时才结束。启用 `hedge` 时，标记为可对冲的请求在超过该主机 p95 耗时仍未返回时
+    再发送一个相同的请求，采用先返回的结果并取消另一个；对冲请求数不超过请求总数的 `hedge_budget` 比例，
+    并且和原请求一样需要取得上游限流器的令牌。
+    """
+
+    def __init__(self, timeout=10.0, connect_timeout=5.0, max_connections=100,
+                 max_connections_per_host=20, keepalive_expiry=30.0, adaptive_timeout=True,
+                 timeout_multiplier=3.0, min_timeout=1.0, hedge=False, hedge_budget=0.05):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections_per_host = max_connections_per_host
+        self.adaptive_timeout = adaptive_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self._host_semaphores = {}
+        self._latencies = {}
+        self.metrics = None
+        self.hedgeable = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+
+    # 重新加载配置时可以直接生效的参数，连接池大小和 keep-alive 时长需要重启服务
+    reloadable = ('timeout', 'connect_timeout', 'adaptive_timeout', 'timeout_multiplier', 'min_timeout', 'hedge', 'hedge_budget')
+
+    @classmethod
+    def from_config(cls, api_config):
+        """根据 `api` 配置项创建客户端"""
+        return cls(**cls.config_options(api_config))
+
+    @classmethod
+    def config_options(cls, api_config):
+        """解析 `api` 配置项中客户端的参数"""
+        return dict(
+            timeout=float(api_config.get('upstream_timeout', 10)),
+            connect_timeout=float(api_config.get('upstream_connect_timeout', 5)),
+            max_connections=int(api_config.get('upstream_max_connections', 100)),
+            max_connections_per_host=int(api_config.get('upstream_max_connections_per_host', 20)),
+            keepalive_expiry=float(api_config.get('upstream_keepalive_expiry', 30)),
+            adaptive_timeout=bool(api_config.get('upstream_adaptive_timeout', True)),
+            timeout_multiplier=float(api_config.get('upstream_timeout_multiplier', 3)),
+            min_timeout=float(api_config.get('upstream_min_timeout', 1)),
+            hedge=bool(api_config.get('upstream_hedge', False)),
+            hedge_budget=float(api_config.get('upstream_hedge_budget', 0.05))
+        )
+
+    def reconfigure(self, options):
+        """应用 config_options 解析出的新参数，保留连接池和各主机的耗时统计"""
+        for name in self.reloadable:
+            setattr(self, name, options[name])
+
+    def _host_semaphore(self, host):
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def _latency(self, host):
+        latency = self._latencies.get(host)
+        if latency is None:
+            latency = self._latencies[host] = HostLatency()
+        return latency
+
+    def timeout_for(self, host):
+        """返回主机当前的读取超时（秒）"""
+        latency = self._latencies.get(host)
+        if not self.adaptive_timeout or latency is None or latency.p99 is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, latency.p99 * self.timeout_multiplier))
+
+    async def request(self, method, url, upstream='other', hedge=False, resign=None, admit=None, **kwargs):
+        """
+        发送请求
+
+        Args:
+            method: HTTP 方法
+            url: 请求 URL
+            upstream: 指标中的上游名称，如 `aliyun`、`huawei`、`iam`
+            hedge: 请求是否幂等、可以对冲
+            resign: 可选，返回对冲请求所用 URL 的函数，用于每次请求需要不同签名的上游
+            admit: 可选，发送对冲请求前调用，返回 False 时不发送，用于让对冲请求消耗限流器的令牌
+            **kwargs: 传递给 httpx 的其他参数
+        """
+        host = urlsplit(url).netloc
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = httpx.Timeout(self.timeout_for(host), connect=self.connect_timeout)
+        if not (hedge and self.hedge):
+            return await self._send(method, url, host, upstream, kwargs)
+        self.hedgeable += 1
+        delay = self._latency(host).p95
+        if delay is None:
+            return await self._send(method, url, host, upstream, kwargs)
+        return await self._send_hedged(method, url, host, upstream, kwargs, delay, resign, admit)
+
+    async def _send(self, method, url, host, upstream, kwargs):
+        async with self._host_semaphore(host):
+            logging.debug(f'{method} {url}')
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                outcome = f'{response.status_code // 100}xx'
+                self._latency(host).add(time.perf_counter() - started)
+                return response
+            except httpx.TimeoutException:
+                outcome = 'timeout'
+                # 超时的请求按已等待的时间计入，上游整体变慢时超时随之放宽
+                self._latency(host).add(time.perf_counter() - started)
+                raise
+            except asyncio.CancelledError:
+                outcome = 'cancelled'
+                raise
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe_upstream(upstream, outcome, time.perf_counter() - started)
+
+    async def _send_hedged(self, method, url, host, upstream, kwargs, delay, resign, admit):
+        primary = asyncio.ensure_future(self._send(method, url, host, upstream, kwargs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or self.hedged >= self.hedge_budget * self.hedgeable:
+                return await primary
+            if admit is not None and not admit():
+                # 限流器没有空闲的令牌，对冲请求会超出上游的 QPS 配额
+                return await primary
+            self.hedged += 1
+            hedge_url = resign() if resign else url
+            secondary = asyncio.ensure_future(self._send(method, hedge_url, host, upstream, kwargs))
+            tasks.append(secondary)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is secondary
+                        self.hedge_wins += won
+                        if self.metrics is not None:
+                            self.metrics.observe_hedge(upstream, won)
+                        return task.result()
+            # 两个请求都失败时返回原请求的异常
+            return primary.result()
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    # 取出未被采用的请求的异常，避免事件循环报告异常未被处理
+                    task.exception()
+                else:
+                    task.cancel()
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {
+            'hedgeable': self.hedgeable,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'hosts': {
+                host: {
+                    'samples': len(latency.samples),
+                    'p50': latency.p50,
+                    'p95': latency.p95,
+                    'p99': latency.p99,
+                    'timeout': self.timeout_for(host)
+                }
+                for host, latency in list(self._latencies.items())
+            }
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
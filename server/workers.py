@@ -0,0 +1,370 @@
+import asyncio
+import datetime
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+
+import fastjson
+from alerts import ALERT_LEVEL_NAMES
+from huawei import HuaweiIAMToken
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """跨进程的文件锁，持有锁的进程退出时由操作系统自动释放"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """
+        获取锁
+
+        Args:
+            blocking: 为 False 时锁被其他进程持有则立即返回
+
+        Returns:
+            是否获取到锁
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            while True:
+                try:
+                    if fcntl:
+                        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                    else:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        os.close(fd)
+                        return False
+                    # msvcrt 没有无限等待的加锁方式
+                    time.sleep(0.05)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+# 控制文件中每个快照占一个槽位：名称和当前序号
+_SLOT = struct.Struct('<64sQ')
+_SLOT_COUNT = 32
+_HEADER_SIZE = struct.Struct('<I')
+
+
+class SharedSnapshots:
+    """
+    多个工作进程共享的快照
+
+    主进程把快照的响应体写入共享目录中的文件，其他进程用 mmap 映射后直接作为响应体返回，不需要各自解析一份。
+    每个快照的当前序号保存在一个所有进程都映射的控制文件中，检查是否有新版本只是一次内存读取。
+    每个版本写入新的文件，旧版本保留到被更新的版本替换两次后才删除，正在读取的进程不会读到写了一半的数据。
+
+    数据文件的快照通过 `read_or_load` 共享：第一个发现文件变化的进程持有加载锁解析文件并写入，其他进程等待后直接映射。
+    """
+
+    # 保留的旧版本数量
+    keep_versions = 2
+
+    def __init__(self, directory):
+        self.directory = directory
+        size = _SLOT.size * _SLOT_COUNT
+        fd = os.open(os.path.join(directory, 'snapshots.ctl'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._control = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._lock = FileLock(os.path.join(directory, 'snapshots.lock'))
+        self._load_lock = FileLock(os.path.join(directory, 'loads.lock'))
+        self._slots = {}
+
+    def _find_slot(self, encoded):
+        for i in range(_SLOT_COUNT):
+            name, _ = _SLOT.unpack_from(self._control, i * _SLOT.size)
+            if name.rstrip(b'\0') == encoded:
+                return i
+        return None
+
+    def _slot(self, name, create=False):
+        slot = self._slots.get(name)
+        if slot is not None:
+            return slot
+        encoded = name.encode('utf-8')
+        if len(encoded) > 64:
+            raise ValueError(f'快照名称过长: {name}')
+        slot = self._find_slot(encoded)
+        if slot is None and create:
+            self._lock.acquire()
+            try:
+                slot = self._find_slot(encoded)
+                if slot is None:
+                    slot = self._find_slot(b'')
+                    if slot is None:
+                        raise ValueError('共享快照槽位已用完')
+                    _SLOT.pack_into(self._control, slot * _SLOT.size, encoded, 0)
+            finally:
+                self._lock.release()
+        if slot is not None:
+            self._slots[name] = slot
+        return slot
+
+    def _path(self, slot, sequence):
+        return os.path.join(self.directory, f'{slot}-{sequence}.snap')
+
+    def sequence(self, name):
+        """返回快照的当前序号，没有快照时返回 0"""
+        slot = self._slot(name)
+        if slot is None:
+            return 0
+        return _SLOT.unpack_from(self._control, slot * _SLOT.size)[1]
+
+    def write(self, name, body, etag):
+        """
+        写入快照的新版本，只应由主进程或持有加载锁的进程调用
+
+        Returns:
+            新版本的序号
+        """
+        slot = self._slot(name, create=True)
+        sequence = self.sequence(name) + 1
+        header = fastjson.dumps({'etag': etag})
+        path = self._path(slot, sequence)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(_HEADER_SIZE.pack(len(header)) + header)
+            file.write(body)
+        os.replace(path + '.tmp', path)
+        struct.pack_into('<Q', self._control, slot * _SLOT.size + 64, sequence)
+        for old in glob.glob(os.path.join(self.directory, f'{slot}-*.snap')):
+            try:
+                if int(os.path.basename(old)[len(f'{slot}-'):-len('.snap')]) < sequence - self.keep_versions:
+                    os.remove(old)
+            except (ValueError, OSError):
+                # Windows 下仍被其他进程映射的文件无法删除，下次再试
+                pass
+        return sequence
+
+    def remove(self, name):
+        """撤销快照，写入一个 ETag 为 None 的空版本，序号仍然递增，其他进程据此发现快照已撤销"""
+        if self.sequence(name):
+            self.write(name, b'', None)
+
+    def read(self, name):
+        """
+        映射快照的当前版本
+
+        Returns:
+            (序号, ETag, 响应体的 memoryview)，没有快照时返回 None；快照已撤销时 ETag 为 None
+        """
+        for _ in range(3):
+            sequence = self.sequence(name)
+            if not sequence:
+                return None
+            try:
+                with open(self._path(self._slots[name], sequence), 'rb') as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                # 读取期间又发布了多个新版本，重新读取序号
+                continue
+            header_size = _HEADER_SIZE.unpack_from(mapped)[0]
+            header = fastjson.loads(mapped[_HEADER_SIZE.size:_HEADER_SIZE.size + header_size])
+            return sequence, header['etag'], memoryview(mapped)[_HEADER_SIZE.size + header_size:]
+        return None
+
+    def read_or_load(self, name, etag, load):
+        """
+        映射 ETag 为 `etag` 的快照版本，共享存储中没有时加载并写入
+
+        同一时间只有一个进程执行加载，其他进程等待加载完成后映射加载结果，不再各自加载。
+
+        Args:
+            name: 快照名称
+            etag: 需要的版本的 ETag
+            load: 加载函数，返回响应体；返回 None 时不写入共享存储
+
+        Returns:
+            与 `read` 相同；本进程执行了加载但没有写入时返回 None
+        """
+        mapped = self.read(name)
+        if mapped is not None and mapped[1] == etag:
+            return mapped
+        self._load_lock.acquire()
+        try:
+            mapped = self.read(name)
+            if mapped is not None and mapped[1] == etag:
+                return mapped
+            body = load()
+            if body is None:
+                return None
+            self.write(name, body, etag)
+            return self.read(name)
+        finally:
+            self._load_lock.release()
+
+
+class SharedTokenStore:
+    """
+    多个工作进程共享的华为云 IAM Token
+
+    默认凭据的 Token 保存在共享目录中的文件里，请求新 Token 前先持有文件锁并检查其他进程是否已经获取，
+    N 个进程只会请求一次 IAM。文件中只保存凭据的摘要，不保存密码。
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'iam_token.json')
+        self._lock = FileLock(os.path.join(directory, 'iam_token.lock'))
+
+    @staticmethod
+    def _fingerprint(credentials):
+        return hashlib.sha256(fastjson.dumps(list(credentials))).hexdigest()
+
+    async def __aenter__(self):
+        await asyncio.to_thread(self._lock.acquire)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._lock.release()
+
+    def load(self, credentials):
+        """返回其他进程保存的 Token，没有或凭据不同时返回 None"""
+        try:
+            with open(self.path, 'rb') as file:
+                data = fastjson.loads(file.read())
+        except (OSError, ValueError):
+            return None
+        if data.get('credentials') != self._fingerprint(credentials):
+            return None
+        return HuaweiIAMToken(data['token'], datetime.datetime.fromisoformat(data['expires_at']))
+
+    def store(self, credentials, token):
+        data = fastjson.dumps({
+            'credentials': self._fingerprint(credentials),
+            'token': token.token,
+            'expires_at': token.expires_at.isoformat()
+        })
+        fd = os.open(self.path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class WorkerCoordinator:
+    """
+    多进程模式下工作进程之间的协调
+
+    持有共享目录中主进程锁的工作进程作为主进程，负责设备轮询、警报、IAM Token 续期、历史数据写入和日志轮转，
+    并把快照写入共享存储；其他进程从共享存储读取快照，并把快照的变化转换为推送消息。
+    主进程退出后锁被释放，其他进程在 `retry_interval` 秒内接替。
+    """
+
+    def __init__(self, state, directory, retry_interval=5.0, watch_interval=0.5):
+        self.state = state
+        self.directory = directory
+        self.retry_interval = retry_interval
+        self.watch_interval = watch_interval
+        self.is_leader = False
+        self._lock = FileLock(os.path.join(directory, 'leader.lock'))
+        self._task = None
+        self._versions = {}
+        self._readings = None
+        self._levels = None
+
+    def start(self, on_leader):
+        """
+        开始协调
+
+        Args:
+            on_leader: 本进程成为主进程时调用的函数
+        """
+        self._on_leader = on_leader
+        if self._lock.acquire(blocking=False):
+            self._become_leader()
+        else:
+            logging.info(f'工作进程 {os.getpid()} 以从进程方式运行')
+            self._task = asyncio.ensure_future(self._follow())
+
+    def _become_leader(self):
+        self.is_leader = True
+        logging.info(f'工作进程 {os.getpid()} 成为主进程')
+        self._on_leader()
+
+    async def _follow(self):
+        next_attempt = time.monotonic() + self.retry_interval
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                self._forward_updates()
+            except Exception as e:
+                logging.warning(f'读取共享快照失败: {e}')
+            if time.monotonic() >= next_attempt:
+                next_attempt = time.monotonic() + self.retry_interval
+                if await asyncio.to_thread(self._lock.acquire, False):
+                    self._become_leader()
+                    return
+
+    def _changed(self, name):
+        snapshot = self.state.snapshot_cache.get_published(name)
+        if snapshot is None or self._versions.get(name) == snapshot.version:
+            return None
+        self._versions[name] = snapshot.version
+        return snapshot
+
+    def _forward_updates(self):
+        # 把主进程发布的快照变化转换为本进程的推送消息
+        broadcaster = self.state.broadcaster
+        snapshot = self._changed('final.json')
+        if snapshot is not None:
+            readings = snapshot.data
+            if self._readings is not None and broadcaster.subscribers:
+                for device_id, reading in readings.items():
+                    if self._readings.get(device_id) != reading:
+                        broadcaster.publish('reading', device_id, {'id': device_id, 'data': reading})
+            self._readings = readings
+        snapshot = self._changed('alert_levels.json')
+        if snapshot is not None:
+            levels = snapshot.data
+            if self._levels is not None and broadcaster.subscribers:
+                for device_id, level in levels.items():
+                    previous = self._levels.get(device_id, 0)
+                    if previous != level:
+                        broadcaster.publish('alert', device_id, {
+                            'id': device_id,
+                            'level': level,
+                            'level_name': ALERT_LEVEL_NAMES[level],
+                            'previous_level': previous,
+                            'value': self.state.alert_evaluator.value_of(
+                                device_id, (self._readings or {}).get(device_id, {}))
+                        })
+            self._levels = levels
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._lock.release()
+        self.is_leader = False
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 服务器模块以脚本方式运行并按文件名互相导入，测试时同样把 server 目录加入搜索路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server'))
@@ -0,0 +1,78 @@
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from alerts import ThresholdEvaluator, reading_value
+from devices import load_device_list
+from reading import Reading
+
+
+def _devices(**items):
+    return load_device_list([{'setting': 'device_list', 'value': [
+        {'id': device_id, 'url': '', 'alert_yellow': 10, 'alert_orange': 20, 'alert_red': 30, **item}
+        for device_id, item in items.items()
+    ]}]).devices
+
+
+def test_reading_value_uses_alert_property():
+    reading = Reading.from_pairs([('strain', '12'), ('temp', '35'), ('status', 'ok')], 1)
+    assert reading_value(reading) == 35
+    assert reading_value(reading, 'strain') == 12
+    assert reading_value({'strain': 12.0, 'temp': 35.0, 'time': 1}, 'strain') == 12
+    # 属性不存在或不是数字时视为本轮没有读数
+    assert reading_value(reading, 'status') != reading_value(reading, 'status')
+    assert reading_value(reading, 'missing') != reading_value(reading, 'missing')
+
+
+def test_evaluator_compares_configured_property():
+    devices = _devices(a={'alert_property': 'strain'}, b={'alert_property': ''}, c={'alert_property': 'strain'})
+    assert [device.alert_property for device in devices] == ['strain', None, 'strain']
+    evaluator = ThresholdEvaluator(devices)
+
+    # temp 超过红色阈值，但 a 只比较 strain；b 未设置属性，取最大值；c 缺少 strain，等级保持不变
+    events = evaluator.evaluate_readings({
+        'a': Reading.from_pairs([('strain', 12), ('temp', 35)], 1),
+        'b': Reading.from_pairs([('strain', 12), ('temp', 35)], 1),
+        'c': Reading.from_pairs([('temp', 35)], 1),
+    })
+    assert {event.device_id: (event.level, event.value) for event in events} == {'a': (1, 12.0), 'b': (3, 35.0)}
+    assert evaluator.current_levels() == {'a': 1, 'b': 3, 'c': 0}
+    assert evaluator.value_of('a', {'strain': 25.0, 'temp': 1.0}) == 25
+    assert evaluator.value_of('unknown', {'strain': 25.0, 'temp': 1.0}) == 25
+
+
+def test_hysteresis_band_holds_level_until_released():
+    # 阈值 10/20/30，回差 5%：降级需要低于 9.5/19/28.5
+    evaluator = ThresholdEvaluator(_devices(a={}), hysteresis=0.05)
+    steps = [
+        (5, 0, False), (21, 2, True), (19.5, 2, False), (20.5, 2, False), (18.9, 1, True),
+        (9.7, 1, False), (9.4, 0, True), (31, 3, True), (29, 3, False), (28.6, 3, False),
+        (28.4, 2, True), (float('nan'), 2, False), (10, 1, True),
+    ]
+    for value, level, changed in steps:
+        events = evaluator.evaluate([value])
+        assert evaluator.current_levels() == {'a': level}, value
+        assert bool(events) == changed, value
+        if events:
+            assert events[0].level == level and events[0].value == value
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='性能测试，设置 BENCHMARK=1 运行')
+def test_evaluate_100k_devices_benchmark():
+    count = 100_000
+    devices = [SimpleNamespace(id=f'dev-{i}', yellow=10.0, orange=20.0, red=30.0) for i in range(count)]
+    evaluator = ThresholdEvaluator(devices)
+    rng = np.random.default_rng(0)
+    # 每轮读数在上一轮基础上小幅波动，少量设备的等级发生变化
+    values = rng.uniform(0, 40, count)
+    evaluator.evaluate(values)
+    rounds = [values + rng.normal(0, 0.1, count) for _ in range(20)]
+
+    started = time.perf_counter()
+    changed = sum(len(evaluator.evaluate(values)) for values in rounds)
+    elapsed = (time.perf_counter() - started) / len(rounds)
+    print(f'\n{count} 个设备每轮判定耗时 {elapsed * 1000:.1f} ms，共 {changed} 次等级变化')
+    assert elapsed < 0.5
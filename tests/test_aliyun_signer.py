@@ -0,0 +1,62 @@
+import datetime
+import random
+import urllib.parse
+from types import SimpleNamespace
+
+import aliyun
+from aliyun import AliyunSigner, aliyun_add_authentication
+
+TIMESTAMP = datetime.datetime(2024, 5, 6, 7, 8, 9, tzinfo=datetime.timezone.utc)
+NONCE = 123456
+
+# 覆盖需要转义的字符、非 ASCII 字符，以及排序在 SignatureNonce 和 Timestamp 前后的参数名
+KEY_PARTS = ['Action', 'ProductKey', 'DeviceName', 'Signature', 'SignatureNoncf', 'SignatureMethod', 'T',
+             'Timestamq', 'Timestampz', 'Version', 'a', 'z', 'iotId', 'key with space', '名称', 'x*y', 'a~b']
+VALUE_CHARS = 'abcXYZ019 -_.~*+/=&?%:;,@!\'()中文éß'
+
+
+class _FixedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return TIMESTAMP
+
+
+def _random_url(rng):
+    keys = rng.sample(KEY_PARTS, rng.randint(1, len(KEY_PARTS)))
+    params = []
+    for key in keys:
+        value = ''.join(rng.choice(VALUE_CHARS) for _ in range(rng.randint(1, 12)))
+        params.append((key, value))
+    query = urllib.parse.urlencode(params, quote_via=rng.choice([urllib.parse.quote, urllib.parse.quote_plus]))
+    return 'https://iot.cn-shanghai.aliyuncs.com/?' + query
+
+
+def test_signer_matches_reference(monkeypatch):
+    monkeypatch.setattr(aliyun, 'datetime', SimpleNamespace(datetime=_FixedDatetime, timezone=datetime.timezone))
+    monkeypatch.setattr(aliyun.random, 'randint', lambda a, b: NONCE)
+    timestamp = TIMESTAMP.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    rng = random.Random(20240506)
+    for _ in range(500):
+        secret = ''.join(rng.choice('abcdefXYZ0123456789+/') for _ in range(rng.randint(8, 30)))
+        signer = AliyunSigner(secret)
+        url = _random_url(rng)
+        expected = aliyun_add_authentication(url, secret)
+        # 第二次签名使用缓存的模板
+        assert signer.sign(url, timestamp, str(NONCE)) == expected, url
+        assert signer.sign(url, timestamp, str(NONCE)) == expected, url
+
+
+def test_signer_falls_back_for_unusual_urls(monkeypatch):
+    monkeypatch.setattr(aliyun, 'datetime', SimpleNamespace(datetime=_FixedDatetime, timezone=datetime.timezone))
+    monkeypatch.setattr(aliyun.random, 'randint', lambda a, b: NONCE)
+    timestamp = TIMESTAMP.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    signer = AliyunSigner('secret')
+    for url in (
+        'https://iot.cn-shanghai.aliyuncs.com/?Action=Query&Timestamp=2020-01-01T00:00:00Z',
+        'https://iot.cn-shanghai.aliyuncs.com/?Action=Query&SignatureNonce=1',
+        'https://iot.cn-shanghai.aliyuncs.com/?Action=Query&Action=Other',
+        'https://iot.cn-shanghai.aliyuncs.com/?Action=Query#fragment',
+    ):
+        assert signer.sign(url, timestamp, str(NONCE)) == aliyun_add_authentication(url, 'secret'), url
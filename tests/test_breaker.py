@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import breaker
+from breaker import CircuitBreaker, CircuitBreakers
+
+
+def _clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker, 'time', SimpleNamespace(monotonic=lambda: now[0], time=lambda: now[0]))
+    return now
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    _clock(monkeypatch)
+    circuit = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert circuit.allow()
+        circuit.record_failure()
+    # 成功清零连续失败次数
+    circuit.record_success()
+    for _ in range(3):
+        assert circuit.allow()
+        circuit.record_failure()
+    assert circuit.state == 'open'
+    assert not circuit.allow()
+    assert circuit.stats() == {'state': 'open', 'failures': 3, 'opened': 1, 'rejected': 1}
+    assert circuit.retry_after() == 30
+
+
+def test_half_open_probe_closes_or_reopens(monkeypatch):
+    now = _clock(monkeypatch)
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_requests=1)
+    circuit.record_failure()
+    now[0] += 29
+    assert not circuit.allow()
+    assert circuit.retry_after() == 1
+
+    # 超时后只放行一个试探请求
+    now[0] += 1
+    assert circuit.allow()
+    assert circuit.state == 'half_open'
+    assert not circuit.allow()
+    # 试探失败重新打开，重新计时
+    circuit.record_failure()
+    assert circuit.state == 'open'
+    assert circuit.opened == 2
+    assert circuit.retry_after() == 30
+
+    now[0] += 30
+    assert circuit.allow()
+    circuit.record_success()
+    assert circuit.state == 'closed'
+    assert circuit.allow() and circuit.allow()
+
+
+def test_stuck_probe_is_replaced_after_timeout(monkeypatch):
+    now = _clock(monkeypatch)
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    circuit.record_failure()
+    now[0] += 30
+    assert circuit.allow()
+    # 试探请求一直没有结果时，reset_timeout 秒后允许新的试探
+    now[0] += 29
+    assert not circuit.allow()
+    now[0] += 1
+    assert circuit.allow()
+
+
+def test_stale_results_expire_and_are_evicted(monkeypatch):
+    now = _clock(monkeypatch)
+    breakers = CircuitBreakers(stale_max_age=60, stale_max_entries=2)
+    breakers.remember('a', 1)
+    breakers.remember('b', 2)
+    now[0] += 10
+    assert breakers.stale('a').value == 1
+    assert breakers.stale('a').age == 10
+    breakers.remember('c', 3)
+    # 超出条数上限时淘汰最久未保存的条目
+    assert breakers.stale('a') is None
+    now[0] += 55
+    assert breakers.stale('b') is None
+    assert breakers.stale('c').value == 3
+    assert breakers.stats()['stale_served'] == 3
+
+    # 同一主机的熔断器共用，重新加载配置后保留状态
+    circuit = breakers.get('aliyun', 'iot.example.com')
+    circuit.record_failure()
+    assert breakers.get('aliyun', 'iot.example.com') is circuit
+    breakers.reconfigure(CircuitBreakers.config_options({'circuit_failure_threshold': 1}))
+    assert circuit.failure_threshold == 1 and circuit.failures == 1
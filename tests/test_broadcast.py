@@ -0,0 +1,108 @@
+import asyncio
+
+import broadcast
+from broadcast import UpdateBroadcaster
+
+
+def _events(chunks):
+    # 把产出的字节串拆分为 (事件, 数据) 列表
+    events = []
+    for frame in b''.join(chunks).split(b'\n\n'):
+        if frame:
+            event, data = frame.split(b'\n')
+            events.append((event[len(b'event: '):].decode(), data[len(b'data: '):]))
+    return events
+
+
+async def _subscribe(broadcaster, ids=None):
+    chunks = []
+    async for chunk in broadcaster.stream(ids):
+        chunks.append(chunk)
+    return _events(chunks)
+
+
+async def _started(broadcaster, count):
+    while broadcaster.subscribers < count:
+        await asyncio.sleep(0)
+
+
+async def _settle():
+    # 被唤醒的订阅者需要经过几轮事件循环才能取走消息
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_fan_out_encodes_each_update_once(monkeypatch):
+    encoded = []
+    sse_frame = broadcast.sse_frame
+    monkeypatch.setattr(broadcast, 'sse_frame', lambda event, data: encoded.append(event) or sse_frame(event, data))
+
+    async def run():
+        broadcaster = UpdateBroadcaster()
+        subscribers = [asyncio.ensure_future(_subscribe(broadcaster)) for _ in range(1000)]
+        await _started(broadcaster, 1000)
+        for i in range(10):
+            broadcaster.publish('reading', f'dev-{i}', {'id': f'dev-{i}', 'data': {'temp': i}})
+            # 每条消息发布后让订阅者取走，避免被合并
+            await _settle()
+        broadcaster.close()
+        return await asyncio.gather(*subscribers), broadcaster.stats()
+
+    results, stats = asyncio.run(run())
+    expected = [('reading', broadcast.fastjson.dumps({'id': f'dev-{i}', 'data': {'temp': i}})) for i in range(10)]
+    assert all(events == expected for events in results)
+    # 编码次数与订阅者数量无关
+    assert len(encoded) == 10
+    assert stats['subscribers'] == 0
+    assert stats['delivered'] == 10 * 1000
+
+
+def test_slow_subscriber_receives_latest_per_device():
+    async def run():
+        broadcaster = UpdateBroadcaster()
+        subscriber = asyncio.ensure_future(_subscribe(broadcaster))
+        filtered = asyncio.ensure_future(_subscribe(broadcaster, ids=['dev-1']))
+        await _started(broadcaster, 2)
+        # 订阅者没有机会读取期间连续发布多条消息
+        for temp in range(5):
+            broadcaster.publish('reading', 'dev-1', {'temp': temp})
+            broadcaster.publish('reading', 'dev-2', {'temp': temp})
+        broadcaster.publish('alert', 'dev-1', {'level': 2})
+        await _settle()
+        broadcaster.close()
+        return await subscriber, await filtered, broadcaster.stats()
+
+    events, filtered, stats = asyncio.run(run())
+    assert events == [('reading', b'{"temp":4}'), ('reading', b'{"temp":4}'), ('alert', b'{"level":2}')]
+    assert filtered == [('reading', b'{"temp":4}'), ('alert', b'{"level":2}')]
+    assert stats['coalesced'] == 8 + 4
+
+
+def test_subscriber_behind_buffer_is_told_to_resync():
+    async def run():
+        broadcaster = UpdateBroadcaster(buffer_size=3)
+        subscriber = asyncio.ensure_future(_subscribe(broadcaster))
+        await _started(broadcaster, 1)
+        for i in range(5):
+            broadcaster.publish('reading', f'dev-{i}', {'temp': i})
+        await _settle()
+        broadcaster.publish('reading', 'dev-9', {'temp': 9})
+        await _settle()
+        broadcaster.close()
+        return await subscriber, broadcaster.stats()
+
+    events, stats = asyncio.run(run())
+    assert events == [('resync', b'{}'), ('reading', b'{"temp":9}')]
+    assert stats['resyncs'] == 1
+
+
+def test_publish_without_subscribers_keeps_no_backlog():
+    async def run():
+        broadcaster = UpdateBroadcaster()
+        for i in range(100):
+            broadcaster.publish('reading', 'dev-1', {'temp': i})
+        return broadcaster
+
+    broadcaster = asyncio.run(run())
+    assert broadcaster.published == 100
+    assert not broadcaster._log
@@ -0,0 +1,49 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import fastapp
+from snapshot import SnapshotCache
+
+
+def _client(tmp_path, monkeypatch, data):
+    (tmp_path / 'final.json').write_text(json.dumps(data), encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    # 不进入 lifespan，只设置该接口用到的状态；阈值设得很小，使文件走流式返回
+    monkeypatch.setattr(fastapp.app.state, 'snapshot_cache', SnapshotCache(), raising=False)
+    monkeypatch.setattr(fastapp.app.state, 'stream_threshold', 1, raising=False)
+    return TestClient(fastapp.app)
+
+
+def test_streamed_file_has_signature_etag(tmp_path, monkeypatch):
+    data = {'1': [{'time': 1, 'temp': 20}, {'time': 2, 'temp': 21}], '2': [{'time': 1, 'temp': 30}]}
+    client = _client(tmp_path, monkeypatch, data)
+
+    response = client.get('/GetDVData')
+    assert response.status_code == 200
+    assert response.json() == data
+    etag = response.headers['etag']
+
+    # 与整体加载时的快照 ETag 相同，切换阈值不会让客户端缓存失效
+    assert etag == SnapshotCache().get(str(tmp_path / 'final.json')).etag
+
+    filtered = client.get('/GetDVData', params={'id': '1', 'start': 2})
+    assert filtered.status_code == 200
+    assert filtered.json() == {'1': [{'time': 2, 'temp': 21}]}
+    assert filtered.headers['etag'] == etag
+
+    for params in ({}, {'id': '1'}):
+        response = client.get('/GetDVData', params=params, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+
+
+def test_streamed_file_etag_changes_with_file(tmp_path, monkeypatch):
+    client = _client(tmp_path, monkeypatch, {'1': {'temp': 20}})
+    etag = client.get('/GetDVData').headers['etag']
+
+    (tmp_path / 'final.json').write_text(json.dumps({'1': {'temp': 25}}), encoding='utf-8')
+    response = client.get('/GetDVData', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json() == {'1': {'temp': 25}}
+    assert response.headers['etag'] != etag
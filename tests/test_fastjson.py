@@ -0,0 +1,68 @@
+import importlib.util
+import json
+import math
+import os
+import sys
+import time
+
+import pytest
+
+import fastjson
+from reading import Reading
+
+
+def _fallback(monkeypatch):
+    # 模拟未安装 orjson：导入 orjson 时抛出 ImportError，另外加载一份 fastjson 模块
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    spec = importlib.util.spec_from_file_location('fastjson_fallback', fastjson.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=['default', 'fallback'])
+def backend(request, monkeypatch):
+    return fastjson if request.param == 'default' else _fallback(monkeypatch)
+
+
+def test_fallback_uses_stdlib(monkeypatch):
+    assert _fallback(monkeypatch).BACKEND == 'json'
+
+
+def test_round_trip(backend):
+    data = {'设备': [1, 2.5, None, True, 'x'], 'nested': {'a': []}}
+    encoded = backend.dumps(data)
+    assert encoded == json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    assert backend.loads(encoded) == data
+    assert backend.loads(memoryview(encoded)) == data
+    assert backend.loads(encoded.decode('utf-8')) == data
+
+
+def test_non_finite_floats_are_written_as_null(backend):
+    reading = Reading.from_pairs([('temp', 'nan'), ('strain', 'inf')], 1)
+    encoded = backend.dumps({'values': [math.nan, math.inf, -math.inf, 1.5], 'reading': reading, 'peak': math.nan})
+    assert encoded == b'{"values":[null,null,null,1.5],"reading":{"temp":null,"strain":null,"time":1},"peak":null}'
+
+
+def test_stdlib_non_finite_tokens_are_accepted(backend):
+    # 旧版本由标准库写出的文件中可能含有 NaN 和 Infinity
+    data = backend.loads(b'{"temp": NaN, "max": Infinity, "min": -Infinity, "ok": 1}')
+    assert math.isnan(data['temp'])
+    assert data['max'] == math.inf and data['min'] == -math.inf
+    assert data['ok'] == 1
+    with pytest.raises(json.JSONDecodeError):
+        backend.loads(b'{"temp": }')
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='性能测试，设置 BENCHMARK=1 运行')
+def test_backend_benchmark(monkeypatch):
+    data = {f'dev-{i}': [{'time': t, 'temp': 20.5 + t, 'strain': i * 0.1, 'status': '正常'} for t in range(10)]
+            for i in range(2000)}
+    for module in (fastjson, _fallback(monkeypatch)):
+        started = time.perf_counter()
+        encoded = module.dumps(data)
+        dumped = time.perf_counter() - started
+        started = time.perf_counter()
+        module.loads(encoded)
+        loaded = time.perf_counter() - started
+        print(f'\n{module.BACKEND}: {len(encoded) / 1024:.0f} KB，序列化 {dumped * 1000:.1f} ms，解析 {loaded * 1000:.1f} ms')
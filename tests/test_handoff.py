@@ -0,0 +1,71 @@
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from handoff import HANDOFF_ENV, reuse_port_supported
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_gui_can_import_handoff_without_server_dependencies():
+    # GUI 以 server.handoff 导入，服务端依赖未安装时也不能失败
+    code = ('import sys\n'
+            'for name in ("uvicorn", "fastapi", "httpx", "numpy"):\n'
+            '    sys.modules[name] = None\n'
+            'from server.handoff import READY_MARKER, DRAIN_MARKER, DRAINED_MARKER, HANDOFF_ENV, reuse_port_supported\n'
+            'reuse_port_supported()\n')
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+def test_server_announces_the_same_markers():
+    import graceful
+    import handoff
+
+    assert graceful.READY_MARKER is handoff.READY_MARKER
+    assert graceful.DRAIN_MARKER is handoff.DRAIN_MARKER
+    assert graceful.DRAINED_MARKER is handoff.DRAINED_MARKER
+
+
+def _listening(port=0):
+    import graceful
+
+    sock = graceful.bind_socket('127.0.0.1', port, handoff=False)
+    sock.listen()
+    return sock
+
+
+@pytest.mark.skipif(not reuse_port_supported(), reason='平台不支持 SO_REUSEPORT')
+def test_port_in_use_is_shared_only_during_handoff(monkeypatch):
+    import graceful
+
+    monkeypatch.delenv(HANDOFF_ENV, raising=False)
+    first = _listening()
+    port = first.getsockname()[1]
+    try:
+        # 误启动的第二个实例不能与正在运行的进程共享端口
+        with pytest.raises(OSError):
+            graceful.bind_socket('127.0.0.1', port)
+        # GUI 平滑重启启动的新进程可以
+        monkeypatch.setenv(HANDOFF_ENV, '1234')
+        second = graceful.bind_socket('127.0.0.1', port)
+        second.listen()
+        second.close()
+    finally:
+        first.close()
+
+
+@pytest.mark.skipif(not reuse_port_supported(), reason='平台不支持 SO_REUSEPORT')
+def test_normal_start_still_allows_a_later_handoff(monkeypatch):
+    import graceful
+
+    monkeypatch.delenv(HANDOFF_ENV, raising=False)
+    first = _listening()
+    try:
+        # 之后平滑重启的新进程需要旧进程的套接字同样设置了 SO_REUSEPORT
+        assert first.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT) == 1
+        graceful.bind_socket('127.0.0.1', first.getsockname()[1], handoff=True).close()
+    finally:
+        first.close()
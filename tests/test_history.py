@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from history import ReadingStore
+from reading import Reading
+
+DAY = 86400.0
+
+
+def _store(tmp_path, **kwargs):
+    store = ReadingStore(str(tmp_path / 'history.db'), **kwargs)
+    store.open()
+    return store
+
+
+def _add(store, device_id, *times):
+    for timestamp in times:
+        store.add(device_id, Reading.from_pairs([('temp', 20.0)], timestamp))
+
+
+def test_prune_deletes_readings_older_than_retention(tmp_path):
+    store = _store(tmp_path, retention=7 * DAY)
+    now = 1_700_000_000.0
+    # 华为云读数的时间为秒，阿里云为毫秒
+    _add(store, 'huawei-1', now - 8 * DAY, now - 6 * DAY, now)
+    _add(store, 'aliyun-1', (now - 8 * DAY) * 1000, (now - 6 * DAY) * 1000, now * 1000)
+    store._write(list(store._pending))
+    store._pending.clear()
+
+    assert store.prune(now) == 2
+    assert [t for t, _ in store.query('huawei-1', 'temp')] == [now - 6 * DAY, now]
+    assert [t for t, _ in store.query('aliyun-1', 'temp')] == [(now - 6 * DAY) * 1000, now * 1000]
+    assert store.prune(now) == 0
+    assert store.stats()['pruned'] == 2
+    asyncio.run(store.aclose())
+
+
+def test_background_task_prunes_periodically(tmp_path):
+    store = _store(tmp_path, retention=DAY, flush_interval=0.01, prune_interval=0.05)
+    now = time.time()
+
+    async def run():
+        store.start()
+        _add(store, 'dev-1', now - 2 * DAY, now)
+        # 启动后立即清理一次，之后每 prune_interval 秒清理一次
+        await asyncio.sleep(0.2)
+        _add(store, 'dev-1', now - 3 * DAY)
+        await asyncio.sleep(0.2)
+        remaining = store.query('dev-1', 'temp')
+        await store.aclose()
+        return remaining
+
+    assert [t for t, _ in asyncio.run(run())] == [now]
+    assert store.stats()['pruned'] == 2
+
+
+def test_zero_retention_keeps_everything(tmp_path):
+    store = _store(tmp_path, retention=0, flush_interval=0.01, prune_interval=0.01)
+
+    async def run():
+        store.start()
+        _add(store, 'dev-1', 1.0, 2.0)
+        await asyncio.sleep(0.1)
+        remaining = store.query('dev-1', 'temp')
+        await store.aclose()
+        return remaining
+
+    assert len(asyncio.run(run())) == 2
+    assert store.stats()['pruned'] == 0
+
+
+def test_from_config_reads_retention():
+    store = ReadingStore.from_config({'history_retention': 3600, 'history_prune_interval': 60})
+    assert (store.retention, store.prune_interval) == (3600, 60)
+    assert ReadingStore.from_config({}).retention == 30 * DAY
+    assert ReadingStore.from_config({'history_path': ''}) is None
@@ -0,0 +1,100 @@
+import asyncio
+import gzip
+import zlib
+
+from fastapi import Request
+
+import httpcache
+import snapshot
+from httpcache import accepted_encoding, snapshot_response
+from snapshot import Snapshot
+
+
+def _request(**headers):
+    return Request({
+        'type': 'http', 'method': 'GET', 'path': '/data', 'query_string': b'',
+        'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+def _snapshot(data):
+    return Snapshot('final.json', data, snapshot.fastjson.dumps(data), (1, 2, 3), 1)
+
+
+def _respond(snap, **headers):
+    return asyncio.run(snapshot_response(_request(**headers), snap))
+
+
+def _with_brotli(monkeypatch):
+    # 测试环境不一定安装 brotli，用 zlib 代替 br 的压缩函数，只检查协商逻辑
+    compressors = {'br': lambda body: zlib.compress(body, 6), 'gzip': snapshot.COMPRESSORS['gzip']}
+    monkeypatch.setattr(snapshot, 'COMPRESSORS', compressors)
+    monkeypatch.setattr(httpcache, 'COMPRESSORS', compressors)
+
+
+DATA = {f'dev-{i}': {'temp': 20.5, 'strain': i, 'time': 1700000000} for i in range(200)}
+
+
+def test_accepted_encoding_follows_preference_and_quality(monkeypatch):
+    _with_brotli(monkeypatch)
+    assert accepted_encoding('gzip, deflate, br') == 'br'
+    assert accepted_encoding('gzip, br;q=0') == 'gzip'
+    assert accepted_encoding('identity') is None
+    assert accepted_encoding('*') == 'br'
+    assert accepted_encoding('') is None
+
+
+def test_gzip_variant_is_smaller_and_cached(monkeypatch):
+    snap = _snapshot(DATA)
+    response = _respond(snap, accept_encoding='gzip')
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['etag'] == f'{snap.etag[:-1]}-gzip"'
+    assert gzip.decompress(response.body) == snap.body
+    # 压缩后的响应体显著小于原始数据
+    assert len(response.body) < len(snap.body) / 5
+
+    # 同一快照只压缩一次
+    calls = []
+    compress = snapshot.COMPRESSORS['gzip']
+    monkeypatch.setitem(snapshot.COMPRESSORS, 'gzip', lambda body: calls.append(1) or compress(body))
+    assert _respond(snap, accept_encoding='gzip').body == response.body
+    assert calls == []
+
+
+def test_br_preferred_when_accepted(monkeypatch):
+    _with_brotli(monkeypatch)
+    snap = _snapshot(DATA)
+    response = _respond(snap, accept_encoding='gzip, br')
+    assert response.headers['content-encoding'] == 'br'
+    assert response.headers['etag'] == f'{snap.etag[:-1]}-br"'
+    assert zlib.decompress(response.body) == snap.body
+    assert _respond(snap, accept_encoding='gzip').headers['content-encoding'] == 'gzip'
+
+
+def test_uncompressed_when_not_accepted_or_small():
+    snap = _snapshot(DATA)
+    response = _respond(snap)
+    assert 'content-encoding' not in response.headers
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['etag'] == snap.etag
+    assert response.body == snap.body
+
+    small = _snapshot({'dev-1': {'temp': 20}})
+    assert 'content-encoding' not in _respond(small, accept_encoding='gzip').headers
+
+
+def test_not_modified_for_every_variant(monkeypatch):
+    _with_brotli(monkeypatch)
+    snap = _snapshot(DATA)
+    for encoding in ('gzip', 'br'):
+        etag = _respond(snap, accept_encoding=encoding).headers['etag']
+        for if_none_match in (etag, f'W/{etag}', f'"other", {etag}'):
+            response = _respond(snap, accept_encoding=encoding, if_none_match=if_none_match)
+            assert response.status_code == 304
+            assert response.body == b''
+            assert response.headers['vary'] == 'Accept-Encoding'
+
+    # 其他快照的 ETag 或未知的压缩后缀不匹配
+    assert _respond(snap, accept_encoding='gzip', if_none_match=f'{snap.etag[:-1]}-zstd"').status_code == 200
+    assert _respond(snap, accept_encoding='gzip', if_none_match='"1-2-4-gzip"').status_code == 200
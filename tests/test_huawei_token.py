@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+
+import httpx
+
+from huawei import HuaweiIAMTokenManager
+
+
+class _StubIAM:
+    """IAM 接口桩：每次请求返回新的 Token，过期时间为当前时间加 `lifetime` 秒"""
+
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.status = 201
+        self.requests = []
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+
+    async def _handle(self, request):
+        self.requests.append(request)
+        # 模拟网络延迟，使并发请求在 Token 返回前全部到达
+        await asyncio.sleep(0.05)
+        if self.status != 201:
+            return httpx.Response(self.status, text='IAM unavailable')
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.lifetime)
+        return httpx.Response(
+            201,
+            headers={'X-Subject-Token': f'token-{len(self.requests)}'},
+            json={'token': {'expires_at': expires_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}}
+        )
+
+    async def post(self, url, upstream=None, **kwargs):
+        return await self.client.post(url, **kwargs)
+
+
+def _manager(lifetime, refresh_margin=300):
+    iam = _StubIAM(lifetime)
+    manager = HuaweiIAMTokenManager(refresh_margin=refresh_margin)
+    manager.client = iam
+    manager.set_default_credentials('user', 'password', 'cn-north-4', 'domain')
+    return manager, iam
+
+
+def test_concurrent_calls_share_one_iam_request():
+    async def run():
+        manager, iam = _manager(lifetime=3600)
+        tokens = await asyncio.gather(
+            *[manager.get_default_token() for _ in range(50)],
+            *[manager.get_iam_token('user', 'password', 'cn-north-4', 'domain') for _ in range(50)]
+        )
+        await iam.client.aclose()
+        return tokens, iam
+
+    tokens, iam = asyncio.run(run())
+    assert set(tokens) == {'token-1'}
+    assert len(iam.requests) == 1
+    assert str(iam.requests[0].url) == 'https://iam.cn-north-4.myhuaweicloud.com/v3/auth/tokens'
+
+
+def test_token_inside_margin_is_refreshed_once_in_background():
+    async def run():
+        # Token 有效期短于续期提前量，取得后即处于续期区间
+        manager, iam = _manager(lifetime=60, refresh_margin=300)
+        first = await manager.get_default_token()
+        assert len(iam.requests) == 1
+
+        # 续期期间的调用继续使用旧 Token，并且只触发一次续期
+        stale = await asyncio.gather(*[manager.get_default_token() for _ in range(20)])
+        assert set(stale) == {first}
+        await asyncio.sleep(0.2)
+        assert len(iam.requests) == 2
+
+        refreshed = await manager.get_default_token()
+        await iam.client.aclose()
+        return first, refreshed
+
+    first, refreshed = asyncio.run(run())
+    assert first == 'token-1'
+    assert refreshed == 'token-2'
+
+
+def test_failed_background_refresh_backs_off():
+    async def run():
+        manager, iam = _manager(lifetime=60, refresh_margin=300)
+        manager.retry_interval = 0.3
+        first = await manager.get_default_token()
+
+        # IAM 暂时不可用：续期失败后旧 Token 继续可用，退避期间不再请求 IAM
+        iam.status = 500
+        for _ in range(5):
+            assert set(await asyncio.gather(*[manager.get_default_token() for _ in range(20)])) == {first}
+            await asyncio.sleep(0.06)
+        assert len(iam.requests) == 2
+
+        # 退避结束后再次续期，IAM 恢复后取得新 Token
+        iam.status = 201
+        await asyncio.sleep(0.3)
+        assert await manager.get_default_token() == first
+        await asyncio.sleep(0.1)
+        refreshed = await manager.get_default_token()
+        await iam.client.aclose()
+        return first, refreshed, iam
+
+    first, refreshed, iam = asyncio.run(run())
+    assert len(iam.requests) == 3
+    assert refreshed == 'token-3' != first
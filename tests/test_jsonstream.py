@@ -0,0 +1,92 @@
+import json
+import time
+import tracemalloc
+
+import fastjson
+from jsonstream import filter_data, stream_filtered
+
+NOTE = 'x' * 2000
+
+
+def _write_history(path, devices, readings):
+    # 逐条写入，生成文件时也不占用与文件大小相当的内存
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{')
+        for device in range(devices):
+            file.write(',' if device else '')
+            file.write(f'"dev-{device}":[')
+            for index in range(readings):
+                file.write(',' if index else '')
+                file.write(json.dumps({'time': index, 'temp': index % 50 + 0.5, 'note': NOTE}))
+            file.write(']')
+        file.write(',"latest":{"time":3,"temp":1.5}}')
+
+
+def _peak_memory(path, **kwargs):
+    tracemalloc.start()
+    try:
+        size = sum(len(part) for part in stream_filtered(str(path), **kwargs))
+        return size, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_stream_filtered_matches_in_memory_filter(tmp_path):
+    path = tmp_path / 'final.json'
+    _write_history(path, devices=3, readings=20)
+    data = fastjson.load_file(str(path))
+
+    for kwargs in ({}, {'ids': ['dev-1', 'latest']}, {'start': 5, 'end': 9}, {'ids': ['dev-2'], 'start': 15},
+                   {'end': 3}, {'ids': ['missing']}):
+        body = b''.join(stream_filtered(str(path), chunk_size=4096, **kwargs))
+        assert fastjson.loads(body) == filter_data(data, **kwargs), kwargs
+
+
+def test_stream_filtered_memory_is_bounded(tmp_path):
+    path = tmp_path / 'final.json'
+    _write_history(path, devices=4, readings=4000)
+    file_size = path.stat().st_size
+    assert file_size > 30 * 1024 * 1024
+
+    for kwargs in ({}, {'ids': ['dev-1']}, {'start': 10, 'end': 2000}):
+        size, peak = _peak_memory(path, **kwargs)
+        assert size > 0
+        # 峰值只取决于读取块和单条读数的大小，与文件大小无关
+        assert peak < 2 * 1024 * 1024, (kwargs, peak)
+
+
+def _write_final(path, devices):
+    # final.json 中每个设备的值为一条读数，字符串中含有转义的引号和反斜杠
+    data = {
+        f'dev-{device}': {'time': device, 'temp': device + 0.5, 'label': 'n' * 60,
+                          'note': 'say \\"hi\\" ' * (device % 7) + '\\\\' + '"' * (device % 3),
+                          'tags': ['a', {'b': '[{'}]}
+        for device in range(200)
+    }
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return data
+
+
+def test_stream_filtered_dict_values_across_chunk_boundaries(tmp_path):
+    path = tmp_path / 'final.json'
+    data = _write_final(path, 200)
+
+    # 不同的块大小让长字符串和转义符落在块边界的不同位置
+    for chunk_size in (7, 64, 333, 1000):
+        for kwargs in ({'ids': ['dev-5']}, {'ids': ['dev-0', 'dev-199']}, {'start': 10, 'end': 12}, {}):
+            body = b''.join(stream_filtered(str(path), chunk_size=chunk_size, **kwargs))
+            assert fastjson.loads(body) == filter_data(data, **kwargs), (chunk_size, kwargs)
+
+
+def test_stream_filtered_skips_truncated_strings_in_linear_time(tmp_path):
+    path = tmp_path / 'final.json'
+    long_string = 'v' * 60
+    path.write_text(json.dumps({
+        f'dev-{device}': {'time': device, 'readings': {f'k{i}': long_string for i in range(40)}}
+        for device in range(200)
+    }), encoding='utf-8')
+
+    started = time.monotonic()
+    body = b''.join(stream_filtered(str(path), ids=['dev-5'], chunk_size=1000))
+    assert fastjson.loads(body)['dev-5']['time'] == 5
+    assert time.monotonic() - started < 5
@@ -0,0 +1,89 @@
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller
+
+from mailer import MailWorker
+
+
+class _Recorder:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 OK'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = _Recorder()
+    controller = Controller(handler, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+async def _wait_for(jobs, timeout=10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while any(job.status == 'queued' for job in jobs):
+        assert asyncio.get_running_loop().time() < deadline, [job.to_dict() for job in jobs]
+        await asyncio.sleep(0.05)
+
+
+def test_jobs_reuse_one_connection(smtp_server):
+    controller, handler = smtp_server
+
+    async def run():
+        worker = MailWorker(controller.hostname, controller.port, sender='alerts@example.com')
+        worker.start()
+        jobs = [worker.submit(f'subject {i}', [f'user{i}@example.com'], 'body') for i in range(5)]
+        await _wait_for(jobs)
+        await worker.aclose()
+        return worker, jobs
+
+    worker, jobs = asyncio.run(run())
+    assert [job.status for job in jobs] == ['sent'] * 5
+    assert len(handler.envelopes) == 5
+    assert worker.connections == 1
+
+
+def test_unencodable_address_fails_only_that_job(smtp_server):
+    controller, handler = smtp_server
+
+    async def run():
+        worker = MailWorker(controller.hostname, controller.port, sender='alerts@example.com')
+        worker.start()
+        jobs = [
+            worker.submit('first', ['first@example.com'], 'body'),
+            worker.submit('bad', ['用户@例子.cn'], 'body'),
+            worker.submit('last', ['last@example.com'], 'body'),
+        ]
+        await _wait_for(jobs)
+        await worker.aclose()
+        return worker, jobs
+
+    worker, jobs = asyncio.run(run())
+    assert [job.status for job in jobs] == ['sent', 'failed', 'sent']
+    assert jobs[1].error
+    assert [envelope.rcpt_tos for envelope in handler.envelopes] == [['first@example.com'], ['last@example.com']]
+    assert worker.stats()['failed'] == 1
+
+
+def test_send_mail_request_rejects_invalid_address():
+    pydantic = pytest.importorskip('pydantic')
+    pytest.importorskip('email_validator')
+    from fastapp import SendMailRequest
+
+    with pytest.raises(pydantic.ValidationError):
+        SendMailRequest(subject='s', address='not-an-address', body='b')
+    assert SendMailRequest(subject='s', address='user@example.com', body='b').address == 'user@example.com'
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from metrics import MetricsRegistry
+from proxy_cache import ProxyResponseCache
+from snapshot import SnapshotCache
+
+
+def _families(body):
+    return {
+        line.split()[2]: line.split()[3]
+        for line in body.decode('utf-8').splitlines() if line.startswith('# TYPE ')
+    }
+
+
+def test_cumulative_component_stats_are_counters(tmp_path):
+    snapshot_cache = SnapshotCache()
+    (tmp_path / 'final.json').write_text('{}', encoding='utf-8')
+    snapshot_cache.get(str(tmp_path / 'final.json'))
+    snapshot_cache.get(str(tmp_path / 'final.json'))
+    state = SimpleNamespace(snapshot_cache=snapshot_cache, proxy_cache=ProxyResponseCache())
+
+    body = MetricsRegistry().render(state)
+    families = _families(body)
+    for name in ('hits', 'misses', 'reloads', 'errors'):
+        assert families[f'fastapp_snapshot_cache_{name}_total'] == 'counter'
+        assert f'fastapp_snapshot_cache_{name}' not in families
+    for name in ('hits', 'misses', 'coalesced', 'evictions'):
+        assert families[f'fastapp_proxy_cache_{name}_total'] == 'counter'
+    # 当前值仍为 gauge
+    assert families['fastapp_snapshot_cache_hit_rate'] == 'gauge'
+    assert families['fastapp_proxy_cache_entries'] == 'gauge'
+    assert b'fastapp_snapshot_cache_hits_total 1\n' in body
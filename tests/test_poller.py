@@ -0,0 +1,78 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import poller
+from poller import DevicePoller
+
+
+def _poll(monkeypatch, results):
+    results = iter(results)
+
+    async def fetch_device(state, device, *credentials):
+        return next(results)
+
+    monkeypatch.setattr(poller, 'fetch_device', fetch_device)
+    device = SimpleNamespace(id='bridge-1')
+    instance = DevicePoller(SimpleNamespace(reading_store=None), [device], interval=10, jitter=0)
+
+    async def run():
+        for _ in range(3):
+            await instance._poll('bridge-1', time.monotonic(), time.monotonic())
+    asyncio.run(run())
+    return instance
+
+
+def test_stale_result_counts_as_failure(monkeypatch):
+    instance = _poll(monkeypatch, [
+        ([{'temp': 20}], None),
+        ([{'temp': 20}], 30.0),
+        ([{'temp': 20}], 40.0),
+    ])
+    assert instance.readings == {'bridge-1': {'temp': 20}}
+    assert instance.polls == 1
+    assert instance.stats()['stale'] == 2
+    assert instance.stats()['failing'] == {'bridge-1': 2}
+    # 按失败退避，下次请求不早于 10 * 2 ** 2 秒之后
+    assert max(anchor for _, anchor, _ in instance._heap) - time.monotonic() > 30
+
+
+def test_fresh_result_after_stale_resets_backoff(monkeypatch):
+    instance = _poll(monkeypatch, [
+        ([{'temp': 20}], None),
+        ([{'temp': 20}], 30.0),
+        ([{'temp': 25}], None),
+    ])
+    assert instance.readings == {'bridge-1': {'temp': 25}}
+    assert instance.stats()['failing'] == {}
+
+
+def test_from_config_uses_request_cycle_credentials():
+    state = SimpleNamespace(device_list=SimpleNamespace(devices=[]))
+    credentials = {
+        'access-key-secret': 'cycle-secret',
+        'huawei_iam_username': 'poller', 'huawei_iam_password': 'password',
+        'huawei_iam_domain': 'domain', 'huawei_iam_area': 'cn-north-4'
+    }
+    config = [{'setting': 'request_cycle', 'enabled': True, **credentials}]
+    instance = DevicePoller.from_config(state, config)
+    assert instance.aliyun_signer is not None
+    assert instance.huawei_credentials == ('poller', 'password', 'cn-north-4', 'domain')
+
+    # 未填写时使用 api 配置项中的凭据；凭据不完整时不使用
+    config = [{'setting': 'request_cycle', 'enabled': True, 'access-key-secret': '', 'huawei_iam_username': 'poller'}]
+    instance = DevicePoller.from_config(state, config)
+    assert instance.aliyun_signer is None
+    assert instance.huawei_credentials is None
+
+    assert DevicePoller.from_config(state, [{'setting': 'request_cycle', **credentials}]) is None
+
+
+def test_backoff_is_capped_after_many_failures(monkeypatch):
+    instance = _poll(monkeypatch, [([{'temp': 20}], 30.0)] * 3)
+    instance._failures['bridge-1'] = 5000
+
+    asyncio.run(instance._poll('bridge-1', time.monotonic(), time.monotonic()))
+    assert instance.stats()['failing'] == {'bridge-1': 5001}
+    delay = max(anchor for _, anchor, _ in instance._heap) - time.monotonic()
+    assert instance.max_backoff - 5 < delay <= instance.max_backoff
@@ -0,0 +1,191 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from aliyun import AliyunSigner
+from breaker import CircuitBreakers
+from proxy import fetch_aliyun, fetch_huawei
+from proxy_cache import ProxyResponseCache
+from ratelimit import UpstreamRateLimits
+
+ALIYUN_URL = 'https://iot.cn-shanghai.aliyuncs.com/?Action={action}&AccessKeyId=key&IotId=dev-1'
+
+
+class _RecordingUpstream:
+    """记录调用参数的上游客户端桩，按顺序返回预设的结果"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    async def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        await asyncio.sleep(0)
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _state(upstream, **breaker_options):
+    return SimpleNamespace(
+        upstream=upstream,
+        aliyun_signer=AliyunSigner('secret'),
+        proxy_cache=ProxyResponseCache(ttl=60),
+        circuit_breakers=CircuitBreakers(**breaker_options),
+        rate_limits=UpstreamRateLimits(),
+        request_log=SimpleNamespace(log=lambda **fields: None)
+    )
+
+
+def _aliyun_response():
+    return httpx.Response(200, json={'Success': True, 'Data': {'List': {'PropertyStatusInfo': []}}})
+
+
+def test_only_idempotent_aliyun_actions_are_hedged():
+    upstream = _RecordingUpstream(_aliyun_response())
+    state = _state(upstream)
+
+    async def run():
+        await fetch_aliyun(state, ALIYUN_URL.format(action='QueryDevicePropertyStatus'))
+        await fetch_aliyun(state, ALIYUN_URL.format(action='SetDeviceProperty'))
+    asyncio.run(run())
+
+    hedged = [kwargs['hedge'] for _, kwargs in upstream.calls]
+    assert hedged == [True, False]
+    # 对冲请求通过同一个限流器取得令牌
+    assert all(kwargs['admit']() for _, kwargs in upstream.calls)
+
+
+class _TokenManager:
+    """华为云 Token 管理器桩，Token 为用户名"""
+
+    username = 'default'
+    default_credentials = ('default', 'password', 'cn-north-4', 'domain')
+
+    async def get_default_token(self):
+        return self.username
+
+    async def get_iam_token(self, username, password, area, domain_name):
+        return username
+
+
+def _huawei_state(upstream):
+    state = _state(upstream)
+    state.huawei_token_manager = _TokenManager()
+    return state
+
+
+def test_concurrent_requests_are_coalesced():
+    upstream = _RecordingUpstream(_aliyun_response())
+    state = _state(upstream)
+    url = ALIYUN_URL.format(action='QueryDevicePropertyStatus')
+
+    async def run():
+        results = await asyncio.gather(*[fetch_aliyun(state, url) for _ in range(10)])
+        # 缓存有效期内的请求直接命中，参数顺序不同的 URL 规范化后命中同一条缓存
+        reordered = 'https://IOT.cn-shanghai.aliyuncs.com/?IotId=dev-1&AccessKeyId=key&Action=QueryDevicePropertyStatus'
+        results.append(await fetch_aliyun(state, reordered))
+        return results
+    results = asyncio.run(run())
+
+    assert len(upstream.calls) == 1
+    assert all(result == results[0] for result in results)
+    stats = state.proxy_cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 9, 1)
+
+
+def test_cache_key_includes_credentials():
+    upstream = _RecordingUpstream(_aliyun_response())
+    state = _state(upstream)
+    url = ALIYUN_URL.format(action='QueryDevicePropertyStatus')
+
+    async def run():
+        await fetch_aliyun(state, url)
+        await fetch_aliyun(state, url, AliyunSigner('other-secret'))
+        await fetch_aliyun(state, url, AliyunSigner('secret'))
+    asyncio.run(run())
+    # 同一 AccessKeyId 使用不同密钥时分别请求上游，密钥相同的签名器共享结果
+    assert len(upstream.calls) == 2
+
+    upstream = _RecordingUpstream(httpx.Response(200, json={'shadow': []}))
+    state = _huawei_state(upstream)
+    url = 'https://iotda.cn-north-4.myhuaweicloud.com/v5/iot/project/devices/dev-1/shadow'
+
+    async def run():
+        await fetch_huawei(state, url)
+        await fetch_huawei(state, url, ('poller', 'password', 'cn-north-4', 'domain'))
+        await fetch_huawei(state, url, _TokenManager.default_credentials)
+    asyncio.run(run())
+    assert [kwargs['headers']['X-Auth-Token'] for _, kwargs in upstream.calls] == ['default', 'poller']
+    # 缓存键中不包含凭据本身
+    assert all('password' not in repr(key) for key in state.proxy_cache._entries)
+
+
+def test_lru_eviction():
+    cache = ProxyResponseCache(ttl=60, max_entries=2)
+    fetched = []
+
+    def fetcher(value):
+        async def fetch():
+            fetched.append(value)
+            return value
+        return fetch
+
+    async def run():
+        await cache.get_or_fetch('a', fetcher('a'))
+        await cache.get_or_fetch('b', fetcher('b'))
+        # 访问 a 之后 b 成为最久未使用的条目
+        assert await cache.get_or_fetch('a', fetcher('a2')) == 'a'
+        await cache.get_or_fetch('c', fetcher('c'))
+        assert await cache.get_or_fetch('a', fetcher('a3')) == 'a'
+        assert await cache.get_or_fetch('b', fetcher('b2')) == 'b2'
+    asyncio.run(run())
+
+    assert fetched == ['a', 'b', 'c', 'b2']
+    stats = cache.stats()
+    assert stats['evictions'] == 2
+    assert stats['entries'] == 2
+
+
+def test_stale_result_served_while_upstream_fails():
+    upstream = _RecordingUpstream(_aliyun_response(), httpx.Response(500, json={}), httpx.ConnectError('refused'))
+    state = _state(upstream, failure_threshold=2, reset_timeout=60)
+    state.proxy_cache = ProxyResponseCache(ttl=0)
+    url = ALIYUN_URL.format(action='QueryDevicePropertyStatus')
+
+    async def run():
+        return [await fetch_aliyun(state, url) for _ in range(4)]
+    results = asyncio.run(run())
+
+    fresh = results[0]
+    assert fresh[0] == 200 and fresh[2] is None
+    # 上游返回 500 和连接失败时返回旧结果，连续失败后熔断，熔断期间不再请求上游
+    for status_code, data, age in results[1:]:
+        assert (status_code, data) == (200, fresh[1])
+        assert age is not None and age >= 0
+    assert len(upstream.calls) == 3
+    stats = state.circuit_breakers.stats()
+    assert stats['circuits']['aliyun:iot.cn-shanghai.aliyuncs.com']['state'] == 'open'
+    assert stats['stale_served'] == 3
+
+
+def test_open_circuit_without_stale_result_is_rejected():
+    upstream = _RecordingUpstream(httpx.Response(500, json={}))
+    state = _state(upstream, failure_threshold=1, reset_timeout=60)
+    url = ALIYUN_URL.format(action='QueryDevicePropertyStatus')
+
+    async def run():
+        first = await fetch_aliyun(state, url)
+        with pytest.raises(HTTPException) as exc_info:
+            await fetch_aliyun(state, url)
+        return first, exc_info.value
+    first, error = asyncio.run(run())
+
+    assert first[0] == 500
+    assert error.status_code == 503
+    assert int(error.headers['Retry-After']) == 60
+    assert len(upstream.calls) == 1
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from ratelimit import FairRateLimiter, RateLimitExceeded, UpstreamRateLimits
+
+
+class _QuotaUpstream:
+    """按令牌桶执行 QPS 配额的上游桩，超出配额的请求计为被限流"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self.served = 0
+        self.throttled = 0
+
+    async def call(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # 允许计时误差带来的少量偏差
+        if self._tokens < 0.9:
+            self.throttled += 1
+        else:
+            self._tokens -= 1
+            self.served += 1
+        await asyncio.sleep(0)
+
+
+def test_burst_is_smoothed_into_quota():
+    async def run():
+        upstream = _QuotaUpstream(rate=50, burst=5)
+        limiter = FairRateLimiter(rate=50, burst=5)
+
+        async def request(i):
+            wait = await limiter.acquire(flow=i % 4)
+            await upstream.call()
+            return wait
+
+        started = time.monotonic()
+        waits = await asyncio.gather(*[request(i) for i in range(60)])
+        return upstream, limiter, waits, time.monotonic() - started
+
+    upstream, limiter, waits, elapsed = asyncio.run(run())
+    assert upstream.throttled == 0
+    assert upstream.served == 60
+    # 突发额度之外的 55 个请求按 50 个每秒放行
+    assert 1.0 <= elapsed < 2.0
+    assert waits.count(0.0) == 5
+    stats = limiter.stats()
+    assert stats['granted'] == 60
+    assert stats['queued'] == 55
+    assert stats['max_wait'] == max(waits)
+
+
+def test_tokens_refill_at_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+
+    async def run():
+        limiter = FairRateLimiter(rate=100, burst=10)
+        for _ in range(10):
+            assert await limiter.acquire() == 0.0
+        assert limiter.stats()['tokens'] == 0
+        # 0.05 秒补充 5 个令牌
+        now[0] += 0.05
+        for _ in range(5):
+            assert await limiter.acquire() == 0.0
+        assert limiter.stats()['tokens'] == 0
+        # 长时间空闲后最多积累 burst 个令牌
+        now[0] += 10
+        limiter._refill()
+        assert limiter.stats()['tokens'] == 10
+
+    asyncio.run(run())
+
+
+def test_flows_are_served_round_robin():
+    async def run():
+        limiter = FairRateLimiter(rate=100, burst=1)
+        await limiter.acquire('busy')
+        order = []
+
+        async def request(flow):
+            await limiter.acquire(flow)
+            order.append(flow)
+
+        # 大量请求先到达的流不会让后到的流一直等待
+        tasks = [asyncio.ensure_future(request('busy')) for _ in range(20)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(request('quiet')) for _ in range(2)]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    assert [i for i, flow in enumerate(order) if flow == 'quiet'] == [1, 3]
+
+
+def test_rejects_when_expected_wait_too_long():
+    async def run():
+        limiter = FairRateLimiter(rate=10, burst=1, max_wait=0.5)
+        await limiter.acquire()
+        tasks = [asyncio.ensure_future(limiter.acquire()) for _ in range(5)]
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            await limiter.acquire()
+        assert exc_info.value.retry_after > 0.5
+        await asyncio.gather(*tasks)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats['rejected'] == 1
+    assert stats['granted'] == 6
+
+
+def test_limits_are_per_upstream_and_credential():
+    async def run():
+        limits = UpstreamRateLimits({'aliyun': {'rate': 1, 'burst': 1}}, max_wait=0.1)
+        await limits.acquire('aliyun', 'key-a')
+        # 同一凭据的配额已用完，其他凭据和未配置速率的上游不受影响
+        with pytest.raises(RateLimitExceeded):
+            await limits.acquire('aliyun', 'key-a')
+        assert await limits.acquire('aliyun', 'key-b') == 0.0
+        for _ in range(5):
+            assert await limits.acquire('huawei', 'user') == 0.0
+        assert limits.limiter('huawei', 'user') is None
+        await limits.aclose()
+        return limits.stats()
+
+    stats = asyncio.run(run())
+    assert set(stats) == {'aliyun:key-a', 'aliyun:key-b'}
+
+
+def test_try_acquire_never_queues(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    limits = UpstreamRateLimits({'aliyun': {'rate': 10, 'burst': 2}})
+    assert limits.try_acquire('aliyun', 'key-a')
+    assert limits.try_acquire('aliyun', 'key-a')
+    assert not limits.try_acquire('aliyun', 'key-a')
+    now[0] += 0.1
+    assert limits.try_acquire('aliyun', 'key-a')
+    # 未配置速率的上游不限流
+    assert limits.try_acquire('huawei', 'user')
+    assert limits.stats()['aliyun:key-a']['granted'] == 3
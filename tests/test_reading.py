@@ -0,0 +1,15 @@
+import math
+
+from reading import Reading
+
+
+def test_peak_ignores_time_and_non_numeric_values():
+    reading = Reading.from_pairs([('time', 1700000000), ('strain', '12.5'), ('temp', 35), ('status', 'ok')], 1700000001)
+    assert reading.peak == 35
+    assert reading.time == 1700000001
+    assert dict(reading) == {'strain': 12.5, 'temp': 35.0, 'status': 'ok', 'time': 1700000001}
+
+
+def test_peak_is_nan_without_measurements():
+    reading = Reading.from_pairs([('time', 1700000000), ('status', 'ok')], 1700000000)
+    assert math.isnan(reading.peak)
@@ -0,0 +1,82 @@
+import asyncio
+import gzip
+import os
+import time
+
+import pytest
+
+import fastjson
+from reqlog import RequestLogWriter
+
+
+def _log_all(writer, count, per_tick=50):
+    async def run():
+        writer.start()
+        for i in range(count):
+            writer.log(provider='aliyun', url=f'https://iot.example.com/?n={i}', status=200, n=i)
+            if i % per_tick == per_tick - 1:
+                # 让后台任务有机会写入，模拟请求之间的间隔
+                await asyncio.sleep(0.001)
+        await writer.aclose()
+    asyncio.run(run())
+
+
+def _records(path):
+    records = []
+    for name in sorted(os.listdir(path.parent)):
+        file = path.parent / name
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(file, 'rb') as lines:
+            records += [fastjson.loads(line) for line in lines]
+    return records
+
+
+def test_records_are_written_in_batches(tmp_path):
+    path = tmp_path / 'log_req.txt'
+    writer = RequestLogWriter(str(path), batch_size=100, flush_interval=10)
+    _log_all(writer, 1000, per_tick=100)
+
+    stats = writer.stats()
+    assert stats['written'] == 1000
+    assert stats['dropped'] == 0
+    # 按条数触发写入，每批写入多条记录
+    assert stats['batches'] <= 20
+    assert [record['n'] for record in _records(path)] == list(range(1000))
+
+
+def test_rotation_compresses_without_losing_records(tmp_path):
+    path = tmp_path / 'log_req.txt'
+    writer = RequestLogWriter(str(path), batch_size=50, flush_interval=10, max_bytes=8 * 1024, backup_count=1000)
+    _log_all(writer, 3000)
+
+    names = os.listdir(tmp_path)
+    rotated = [name for name in names if name != 'log_req.txt']
+    assert writer.stats()['rotations'] == len(rotated) > 5
+    # 轮转出的文件都已压缩，没有遗留未压缩的中间文件
+    assert all(name.endswith('.gz') for name in rotated)
+    assert sorted(record['n'] for record in _records(path)) == list(range(3000))
+
+
+def test_rotation_keeps_newest_backups(tmp_path):
+    path = tmp_path / 'log_req.txt'
+    writer = RequestLogWriter(str(path), batch_size=50, flush_interval=10, max_bytes=8 * 1024, backup_count=3)
+    _log_all(writer, 3000)
+
+    assert writer.stats()['rotations'] > 3
+    assert len(os.listdir(tmp_path)) == 4
+    # 保留的是最近轮转的文件，记录是连续的最后一段
+    numbers = sorted(record['n'] for record in _records(path))
+    assert numbers == list(range(numbers[0], 3000))
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='性能测试，设置 BENCHMARK=1 运行')
+def test_log_throughput_benchmark(tmp_path):
+    path = tmp_path / 'log_req.txt'
+    writer = RequestLogWriter(str(path), max_bytes=64 * 1024 * 1024)
+    count = 200_000
+
+    started = time.perf_counter()
+    _log_all(writer, count, per_tick=1000)
+    elapsed = time.perf_counter() - started
+    print(f'\n写入 {count} 条请求日志耗时 {elapsed:.2f} 秒，{count / elapsed:.0f} 条/秒，{writer.stats()["batches"]} 批')
+    assert writer.stats()['written'] == count
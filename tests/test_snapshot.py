@@ -0,0 +1,234 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+import snapshot
+from snapshot import SnapshotCache
+from workers import FileLock, SharedSnapshots
+
+
+def _write(path, data):
+    path.write_text(json.dumps(data), encoding='utf-8')
+
+
+def test_unpublish_falls_back_to_file(tmp_path):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    cache = SnapshotCache()
+
+    cache.publish(str(path), {'1': {'temp': 25}})
+    assert cache.get(str(path)).data == {'1': {'temp': 25}}
+
+    cache.unpublish(str(path))
+    assert cache.get_published(str(path)) is None
+    assert cache.get(str(path)).data == {'1': {'temp': 20}}
+
+
+def test_unpublish_clears_shared_snapshot(tmp_path):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    leader = SnapshotCache(SharedSnapshots(str(tmp_path)))
+    follower = SnapshotCache(SharedSnapshots(str(tmp_path)))
+
+    leader.publish(str(path), {'1': {'temp': 25}})
+    assert follower.get(str(path)).data == {'1': {'temp': 25}}
+
+    leader.unpublish(str(path))
+    assert follower.get_published(str(path)) is None
+    assert follower.get(str(path)).data == {'1': {'temp': 20}}
+    assert str(path) in follower.stats()['files']
+
+    # 撤销后再次发布，其他进程读到新版本
+    leader.publish(str(path), {'1': {'temp': 30}})
+    assert follower.get(str(path)).data == {'1': {'temp': 30}}
+
+
+def test_file_snapshot_loaded_once_across_workers(tmp_path, monkeypatch):
+    path = tmp_path / 'output.json'
+    _write(path, {'1': {'temp': 20}})
+    first = SnapshotCache(SharedSnapshots(str(tmp_path)))
+    second = SnapshotCache(SharedSnapshots(str(tmp_path)))
+
+    loads = []
+    load_file = snapshot.fastjson.load_file
+    monkeypatch.setattr(snapshot.fastjson, 'load_file', lambda p: loads.append(p) or load_file(p))
+
+    loaded = first.get(str(path))
+    mapped = second.get(str(path))
+    assert loads == [str(path)]
+    assert mapped.etag == loaded.etag
+    assert bytes(mapped.body) == loaded.body
+    assert mapped.data == {'1': {'temp': 20}}
+    assert second.stats()['mapped'] == 1
+
+    # 文件变化后由先发现的进程重新加载，另一个进程映射新版本
+    _write(path, {'1': {'temp': 25}})
+    assert second.get(str(path)).data == {'1': {'temp': 25}}
+    assert first.get(str(path)).data == {'1': {'temp': 25}}
+    assert len(loads) == 2
+
+
+def _counting_loads(monkeypatch):
+    loads = []
+    load_file = snapshot.fastjson.load_file
+    monkeypatch.setattr(snapshot.fastjson, 'load_file', lambda p: loads.append(p) or load_file(p))
+    return loads
+
+
+def test_unchanged_file_is_served_from_cache(tmp_path, monkeypatch):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    loads = _counting_loads(monkeypatch)
+    cache = SnapshotCache()
+
+    first = cache.get(str(path))
+    for _ in range(5):
+        assert cache.get(str(path)) is first
+    assert loads == [str(path)]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['reloads']) == (5, 1, 1)
+    assert first.etag == snapshot.signature_etag(snapshot.file_signature(str(path)))
+
+
+def test_signature_change_reloads(tmp_path, monkeypatch):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    loads = _counting_loads(monkeypatch)
+    cache = SnapshotCache()
+    previous = cache.get(str(path))
+
+    # 只有 mtime 变化
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    current = cache.get(str(path))
+    assert current is not previous and current.etag != previous.etag
+
+    # 只有大小变化：恢复原来的 mtime
+    mtime = os.stat(path).st_mtime_ns
+    _write(path, {'1': {'temp': 200}})
+    os.utime(path, ns=(mtime, mtime))
+    previous, current = current, cache.get(str(path))
+    assert current is not previous and current.data == {'1': {'temp': 200}}
+
+    # 只有 inode 变化：原子替换为大小和 mtime 都相同的新文件
+    replacement = tmp_path / 'final.json.tmp'
+    _write(replacement, {'1': {'temp': 300}})
+    os.utime(replacement, ns=(mtime, mtime))
+    os.replace(replacement, path)
+    previous, current = current, cache.get(str(path))
+    assert current is not previous and current.data == {'1': {'temp': 300}}
+
+    assert len(loads) == 4
+    assert current.version > previous.version
+    assert cache.stats()['reloads'] == 4
+
+
+def test_invalid_file_keeps_previous_snapshot(tmp_path):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    cache = SnapshotCache()
+    previous = cache.get(str(path))
+
+    # 写了一半的文件
+    path.write_text('{"1": {"temp"', encoding='utf-8')
+    assert cache.get(str(path)) is previous
+    assert cache.stats()['errors'] == 1
+
+    _write(path, {'1': {'temp': 25}})
+    assert cache.get(str(path)).data == {'1': {'temp': 25}}
+
+    # 没有旧快照时抛出异常
+    path.write_text('{', encoding='utf-8')
+    with pytest.raises(ValueError):
+        SnapshotCache().get(str(path))
+
+
+def test_index_built_once_per_snapshot(tmp_path):
+    path = tmp_path / 'final.json'
+    _write(path, {'1': {'temp': 20}})
+    cache = SnapshotCache()
+    built = []
+
+    def indexer(data):
+        built.append(data)
+        return len(data)
+
+    assert cache.get(str(path), indexer).index == 1
+    assert cache.get(str(path), indexer).index == 1
+    _write(path, {'1': {'temp': 20}, '2': {'temp': 30}})
+    assert cache.get(str(path), indexer).index == 2
+    assert len(built) == 2
+
+
+def _worker_get(directory, path, log, barrier, results):
+    # 在 fork 出的工作进程中执行：记录本进程的加载次数并返回读到的数据
+    load_file = snapshot.fastjson.load_file
+
+    def counting_load(p):
+        with open(log, 'a') as file:
+            file.write(f'{os.getpid()}\n')
+        time.sleep(0.2)
+        return load_file(p)
+
+    snapshot.fastjson.load_file = counting_load
+    cache = SnapshotCache(SharedSnapshots(directory))
+    barrier.wait()
+    loaded = asyncio.run(cache.aget(path))
+    results.put((loaded.data, loaded.etag))
+
+
+def test_concurrent_workers_load_file_once(tmp_path):
+    path = tmp_path / 'output.json'
+    _write(path, {str(i): {'temp': i} for i in range(100)})
+    log = tmp_path / 'loads.log'
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(4)
+    results = context.Queue()
+    workers = [
+        context.Process(target=_worker_get, args=(str(tmp_path), str(path), str(log), barrier, results))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=30)
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert len(log.read_text().split()) == 1
+    assert all(outcome == outcomes[0] for outcome in outcomes)
+    assert outcomes[0][0] == {str(i): {'temp': i} for i in range(100)}
+
+
+def test_aget_waits_for_load_lock_off_the_event_loop(tmp_path):
+    path = tmp_path / 'output.json'
+    _write(path, {'1': {'temp': 20}})
+    cache = SnapshotCache(SharedSnapshots(str(tmp_path)))
+    # 模拟其他进程正在加载：持有加载锁 0.3 秒
+    other = FileLock(str(tmp_path / 'loads.lock'))
+    other.acquire()
+    threading.Timer(0.3, other.release).start()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        loaded = await cache.aget(str(path))
+        task.cancel()
+        return loaded, ticks
+
+    loaded, ticks = asyncio.run(run())
+    assert loaded.data == {'1': {'temp': 20}}
+    # 等待锁期间事件循环仍在运行
+    assert ticks >= 10
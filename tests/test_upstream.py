@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import httpx
+
+from ratelimit import FairRateLimiter
+from upstream import UpstreamClient
+
+LATENCY = 0.2
+
+
+class _SlowUpstream:
+    """每个请求耗时 LATENCY 秒的上游桩，记录同时处理的最大请求数"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+
+    async def __call__(self, request):
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(LATENCY)
+        finally:
+            self.active -= 1
+        return httpx.Response(200, json={'host': request.url.host})
+
+
+def _client(upstream, **kwargs):
+    client = UpstreamClient(adaptive_timeout=False, **kwargs)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    return client
+
+
+def _timed_gets(client, urls):
+    async def run():
+        started = time.monotonic()
+        responses = await asyncio.gather(*[client.get(url, upstream='aliyun') for url in urls])
+        elapsed = time.monotonic() - started
+        await client.aclose()
+        return responses, elapsed
+    return asyncio.run(run())
+
+
+def test_parallel_calls_take_one_upstream_latency():
+    upstream = _SlowUpstream()
+    client = _client(upstream)
+    responses, elapsed = _timed_gets(client, [f'https://iot-{i % 2}.example.com/?n={i}' for i in range(20)])
+
+    assert [r.status_code for r in responses] == [200] * 20
+    assert upstream.max_active == 20
+    # 20 个并发请求的总耗时约为一次上游耗时，而不是 20 次
+    assert elapsed < LATENCY * 3
+
+
+def test_connections_per_host_are_limited():
+    upstream = _SlowUpstream()
+    client = _client(upstream, max_connections_per_host=5)
+    responses, elapsed = _timed_gets(client, [f'https://iot.example.com/?n={i}' for i in range(20)])
+
+    assert len(responses) == 20
+    assert upstream.max_active == 5
+    assert elapsed >= LATENCY * 4
+    assert client.stats()['hosts']['iot.example.com']['samples'] == 20
+
+
+def _hedged_get(admit):
+    upstream = _SlowUpstream()
+    client = _client(upstream, hedge=True, hedge_budget=1.0)
+    # 历史耗时远小于本次请求，原请求超过 p95 后发送对冲请求
+    for _ in range(20):
+        client._latency('iot.example.com').add(0.01)
+
+    async def run():
+        response = await client.get('https://iot.example.com/', upstream='aliyun', hedge=True, admit=admit)
+        await client.aclose()
+        return response
+    assert asyncio.run(run()).status_code == 200
+    return upstream, client
+
+
+def test_hedge_takes_a_rate_limit_token():
+    limiter = FairRateLimiter(rate=1, burst=1)
+    upstream, client = _hedged_get(limiter.try_acquire)
+    assert upstream.requests == 2
+    assert client.stats()['hedged'] == 1
+    assert limiter.stats()['granted'] == 1
+
+    # 限流器没有令牌时不发送对冲请求
+    upstream, client = _hedged_get(limiter.try_acquire)
+    assert upstream.requests == 1
+    assert client.stats()['hedged'] == 0
+    assert limiter.stats()['granted'] == 1
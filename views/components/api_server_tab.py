@@ -10,6 +10,9 @@ class ApiServerTab(QtWidgets.QWidget):
         # 创建布局
         self.layout = QtWidgets.QVBoxLayout(self)
         
+        # 界面上没有对应控件的高级设置（如上游连接池参数），保存时原样写回
+        self.extra_config = {}
+        
         # 创建启用选项
         self._create_enable_option()
         
@@ -141,10 +144,15 @@ class ApiServerTab(QtWidgets.QWidget):
         self.huawei_password.setText(config_item.get('huawei_iam_password', ''))
         self.huawei_domain.setText(config_item.get('huawei_iam_domain', ''))
         self.huawei_area.setText(config_item.get('huawei_iam_area', ''))
+        
+        # 保留高级设置
+        self.extra_config = {}
+        known_keys = self.get_config().keys()
+        self.extra_config = {k: v for k, v in config_item.items() if k not in known_keys}
     
     def get_config(self):
         """获取当前配置"""
-        return {
+        config = {
             'setting': 'api',
             'enabled': self.api_enabled.isChecked(),
             'port': int(self.port_input.text() or 5200),
@@ -153,4 +161,6 @@ class ApiServerTab(QtWidgets.QWidget):
             'huawei_iam_password': self.huawei_password.text(),
             'huawei_iam_domain': self.huawei_domain.text(),
             'huawei_iam_area': self.huawei_area.text()
-        }
\ No newline at end of file
+        }
+        config.update(self.extra_config)
+        return config
\ No newline at end of file
@@ -12,6 +12,9 @@ class AutoUpdateTab(QtWidgets.QWidget):
         # 创建布局
         self.layout = QtWidgets.QVBoxLayout(self)
         
+        # 创建启用选项
+        self._create_enable_option()
+        
         # 阿里云AccessKeySecret输入框
         self._create_aliyun_secret_input()
         
@@ -29,9 +32,21 @@ class AutoUpdateTab(QtWidgets.QWidget):
         # 存储JSON数据
         self.json_data = []
         
+        # 界面上没有对应控件的高级设置（如轮询周期、并发数），保存时原样写回
+        self.extra_config = {}
+        
         # 连接信号槽
         self._connect_signals()
     
+    def _create_enable_option(self):
+        """创建启用选项"""
+        enable_layout = QtWidgets.QHBoxLayout()
+        self.cycle_enabled = QtWidgets.QCheckBox('由API服务器定时请求设备（以下凭据留空时使用API服务器的凭据）')
+        self.cycle_enabled.setChecked(False)
+        self.cycle_enabled.setObjectName('auto_update_enabled')
+        enable_layout.addWidget(self.cycle_enabled)
+        self.layout.addLayout(enable_layout)
+    
     def _create_aliyun_secret_input(self):
         """创建阿里云AccessKeySecret输入框"""
         # 创建标签
@@ -167,6 +182,9 @@ class AutoUpdateTab(QtWidgets.QWidget):
     
     def update_from_config(self, config_item):
         """从配置更新UI"""
+        # 更新是否启用
+        self.cycle_enabled.setChecked(config_item.get('enabled', False))
+        
         # 更新阿里云AccessKeySecret
         self.secret_input.setText(config_item.get('access-key-secret', ''))
         
@@ -178,15 +196,23 @@ class AutoUpdateTab(QtWidgets.QWidget):
         
         # 更新JSON数据
         self.json_data = config_item.get('value', [])
+        
+        # 保留高级设置
+        self.extra_config = {}
+        known_keys = self.get_config().keys()
+        self.extra_config = {k: v for k, v in config_item.items() if k not in known_keys}
     
     def get_config(self):
         """获取当前配置"""
-        return {
+        config = {
             'setting': 'request_cycle',
+            'enabled': self.cycle_enabled.isChecked(),
             'access-key-secret': self.secret_input.text(),
             'huawei_iam_username': self.huawei_username.text(),
             'huawei_iam_password': self.huawei_password.text(),
             'huawei_iam_domain': self.huawei_domain.text(),
             'huawei_iam_area': self.huawei_area.text(),
             'value': self.json_data
-        }
\ No newline at end of file
+        }
+        config.update(self.extra_config)
+        return config
\ No newline at end of file
@@ -97,6 +97,17 @@ class DeviceTab(QtWidgets.QWidget):
         device_url_layout.addWidget(self.device_url)
         self.layout.addLayout(device_url_layout)
         
+        # 警报属性
+        alert_property_layout = QtWidgets.QHBoxLayout()
+        alert_property_label = QtWidgets.QLabel('警报属性：')
+        self.alert_property = QtWidgets.QLineEdit()
+        self.alert_property.setPlaceholderText('与阈值比较的属性名，留空时取数值最大的属性')
+        self.alert_property.setStyleSheet('font-family: Microsoft Yahei; font-size: 10pt; font-weight: bold')
+        self.alert_property.setObjectName('alert_property')
+        alert_property_layout.addWidget(alert_property_label)
+        alert_property_layout.addWidget(self.alert_property)
+        self.layout.addLayout(alert_property_layout)
+        
         # 警报阈值 - 黄色
         alert_yellow_layout = QtWidgets.QHBoxLayout()
         alert_yellow_label = QtWidgets.QLabel('黄色警报阈值：')
@@ -148,6 +159,7 @@ class DeviceTab(QtWidgets.QWidget):
         """显示设备详情"""
         self.device_id.setText(device.get('id', ''))
         self.device_url.setText(device.get('url', ''))
+        self.alert_property.setText(device.get('alert_property') or '')
         self.alert_yellow.setText(str(device.get('alert_yellow', '')))
         self.alert_orange.setText(str(device.get('alert_orange', '')))
         self.alert_red.setText(str(device.get('alert_red', '')))
@@ -169,6 +181,7 @@ class DeviceTab(QtWidgets.QWidget):
             'id': f'设备{len(self.devices) + 1}',
             'url': '',
             'type': DeviceType.ALIYUN.value,  # 默认为阿里云设备
+            'alert_property': '',
             'alert_yellow': '',
             'alert_orange': '',
             'alert_red': ''
@@ -207,6 +220,7 @@ class DeviceTab(QtWidgets.QWidget):
             else:
                 device['type'] = DeviceType.ALIYUN.value
                 
+            device['alert_property'] = self.alert_property.text().strip()
             device['alert_yellow'] = self.alert_yellow.text()
             device['alert_orange'] = self.alert_orange.text()
             device['alert_red'] = self.alert_red.text()
@@ -219,6 +233,7 @@ class DeviceTab(QtWidgets.QWidget):
         self.device_id.clear()
         self.device_url.clear()
         self.radio_aliyun.setChecked(True)  # 重置为默认的阿里云设备类型
+        self.alert_property.clear()
         self.alert_yellow.clear()
         self.alert_orange.clear()
         self.alert_red.clear()
@@ -41,6 +41,9 @@ class EmailAlertsTab(QtWidgets.QWidget):
         # 存储收件人和正文设置
         self.recipients = []
         self.body_format = {}
+        
+        # 界面上没有对应控件的高级设置（如警报摘要窗口），保存时原样写回
+        self.extra_config = {}
     
     def _create_server_input(self):
         """创建SMTP服务器输入"""
@@ -175,6 +178,11 @@ class EmailAlertsTab(QtWidgets.QWidget):
         # 保存收件人和正文设置
         self.recipients = config_item.get('receivers', [])
         self.body_format = config_item.get('format', {})
+        
+        # 保留高级设置
+        self.extra_config = {}
+        known_keys = self.get_config().keys()
+        self.extra_config = {k: v for k, v in config_item.items() if k not in known_keys}
     
     def get_config(self):
         """获取当前配置"""
@@ -185,7 +193,7 @@ class EmailAlertsTab(QtWidgets.QWidget):
                 alert_level = i
                 break
         
-        return {
+        config = {
             'setting': 'mail',
             'host': self.server_input.text(),
             'port': int(self.port_input.text() or 465),
@@ -194,4 +202,6 @@ class EmailAlertsTab(QtWidgets.QWidget):
             'alert_level': alert_level,
             'receivers': self.recipients,
             'format': self.body_format
-        }
\ No newline at end of file
+        }
+        config.update(self.extra_config)
+        return config
\ No newline at end of file
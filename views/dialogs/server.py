@@ -1,4 +1,5 @@
 import os
+import signal
 import sys
 import subprocess
 import threading
@@ -8,11 +9,16 @@ from PySide6 import QtWidgets, QtCore
 from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QPainter, QColor, QBrush
 
+from server.handoff import READY_MARKER, DRAIN_MARKER, DRAINED_MARKER, HANDOFF_ENV, reuse_port_supported
+from utils.config_manager import ConfigManager
+
 
 class LogUpdater(QtCore.QObject):
     """日志更新器，用于从服务器进程读取输出并发送信号"""
     log_updated = Signal(str)
-    process_ended = Signal()
+    # 参数为对应的进程，平滑重启时新旧两个进程各有一个日志更新器
+    server_ready = Signal(object)
+    process_ended = Signal(object)
     
     def __init__(self, process):
         super().__init__()
@@ -28,7 +34,10 @@ class LogUpdater(QtCore.QObject):
                     # 非阻塞读取一行
                     line = self.process.stdout.readline()
                     if line:
-                        self.log_updated.emit(line.decode('utf-8', errors='replace'))
+                        text = line.decode('utf-8', errors='replace')
+                        if text.startswith(READY_MARKER):
+                            self.server_ready.emit(self.process)
+                        self.log_updated.emit(text)
                     else:
                         # 如果没有输出，让线程短暂休眠避免CPU占用
                         time.sleep(0.1)
@@ -46,17 +55,26 @@ class LogUpdater(QtCore.QObject):
             self.log_updated.emit(f"日志监控异常: {str(e)}")
         finally:
             # 通知进程已结束
-            self.process_ended.emit()
+            self.process_ended.emit(self.process)
 
 
 class ServerTerminator(QtCore.QObject):
-    """服务器终止器，用于在单独的线程中停止服务器进程，避免GUI阻塞"""
+    """
+    服务器终止器，用于在单独的线程中停止服务器进程，避免GUI阻塞
+    
+    先发送终止信号（Windows 上为 CTRL_BREAK_EVENT），服务器停止接受新连接并处理完正在进行的请求后退出；
+    超过 `drain_timeout` 秒仍未退出时强制结束进程树。
+    """
     termination_status = Signal(str)
     termination_completed = Signal()
     
-    def __init__(self, process):
+    # 排空超时后留给服务器关闭后台任务的时间
+    shutdown_grace = 5
+    
+    def __init__(self, process, drain_timeout=30):
         super().__init__()
         self.process = process
+        self.drain_timeout = drain_timeout
         
     def terminate_process(self):
         """终止进程的方法，在单独线程中运行"""
@@ -75,21 +93,22 @@ class ServerTerminator(QtCore.QObject):
                 parent = psutil.Process(pid)
                 children = parent.children(recursive=True)
                 
-                # 首先尝试温和地终止进程
-                self.termination_status.emit("正在尝试优雅关闭...")
-                
-                # 终止子进程
-                for child in children:
-                    try:
-                        child.terminate()
-                    except:
-                        pass
-                
-                # 终止主进程
-                self.process.terminate()
+                # 首先尝试温和地终止进程，多进程模式下由主进程通知各工作进程
+                self.termination_status.emit("正在尝试优雅关闭，等待正在处理的请求完成...")
+                if sys.platform == 'win32':
+                    # 进程以新进程组启动，CTRL_BREAK_EVENT 会发送给整个进程组
+                    os.kill(pid, signal.CTRL_BREAK_EVENT)
+                else:
+                    self.process.terminate()
                 
-                # 给进程一些时间自行关闭
-                gone, alive = psutil.wait_procs([parent] + children, timeout=3)
+                # 给进程时间处理完已有请求后自行关闭
+                deadline = time.monotonic() + self.drain_timeout + self.shutdown_grace
+                alive = [parent] + children
+                while alive and time.monotonic() < deadline:
+                    gone, alive = psutil.wait_procs(alive, timeout=1)
+                    if parent in alive:
+                        waited = self.drain_timeout + self.shutdown_grace - (deadline - time.monotonic())
+                        self.termination_status.emit(f"等待进程退出... {waited:.0f}/{self.drain_timeout} 秒")
                 
                 # 如果有进程仍然存活，强制终止它们
                 if alive:
@@ -149,6 +168,12 @@ class StartDialog(QtWidgets.QDialog):
         self.terminator_thread = None
         self.server_terminator = None
         
+        # 平滑重启期间仍在处理请求的旧进程，handoff_pending 表示正在等待新进程就绪
+        self.handoff_pending = False
+        self.old_process = None
+        self.old_log_thread = None
+        self.old_log_updater = None
+        
         # 设置UI
         self.setup_ui()
         
@@ -279,6 +304,10 @@ class StartDialog(QtWidgets.QDialog):
             # 环境变量设置
             env = os.environ.copy()
             env['PYTHONUNBUFFERED'] = '1'  # 确保Python输出不缓冲
+            env.pop(HANDOFF_ENV, None)
+            if self.handoff_pending and self.old_process is not None:
+                # 平滑重启：允许新进程与仍在监听的旧进程共享端口
+                env[HANDOFF_ENV] = str(self.old_process.pid)
             
             # 创建进程 - 使用shell=True可以确保在Windows上正确捕获CTRL+C事件
             self.process = subprocess.Popen(
@@ -297,6 +326,7 @@ class StartDialog(QtWidgets.QDialog):
             # 创建日志更新器和线程
             self.log_updater = LogUpdater(self.process)
             self.log_updater.log_updated.connect(self.update_log)
+            self.log_updater.server_ready.connect(self.on_server_ready)
             self.log_updater.process_ended.connect(self.on_process_ended)
             
             self.log_thread = QtCore.QThread()
@@ -331,7 +361,7 @@ class StartDialog(QtWidgets.QDialog):
             self.log_updater.running = False
         
         # 创建终止器并在单独线程中运行
-        self.server_terminator = ServerTerminator(self.process)
+        self.server_terminator = ServerTerminator(self.process, self.server_options()['drain_timeout'])
         self.server_terminator.termination_status.connect(self.log_display.append)
         self.server_terminator.termination_completed.connect(self.on_termination_completed)
         
@@ -358,16 +388,47 @@ class StartDialog(QtWidgets.QDialog):
         # 清空进程引用
         self.process = None
     
-    def on_process_ended(self):
+    def on_process_ended(self, process):
         """当进程自行结束时调用"""
+        if process is self.old_process:
+            # 旧进程排空后退出，由 on_handoff_completed 处理
+            return
+        if process is not self.process:
+            return
+        self.process = None
+        if self.handoff_pending:
+            # 新进程在就绪前退出，旧进程继续提供服务
+            self.handoff_pending = False
+            self.log_display.append("新的服务器进程启动失败，旧进程继续运行")
+            self.process, self.log_updater, self.log_thread = self.old_process, self.old_log_updater, self.old_log_thread
+            self.old_process = self.old_log_updater = self.old_log_thread = None
+            self.update_status("状态: 服务器运行中（重启失败）")
+            self.stop_button.setEnabled(True)
+            self.restart_button.setEnabled(True)
+            return
         self.log_display.append("服务器进程已退出")
         self.update_status("状态: 服务器已停止")
-        
-        # 清空进程引用
-        self.process = None
+    
+    def server_options(self):
+        """读取配置文件中与重启有关的 `api` 配置项，读取失败时使用默认值"""
+        try:
+            config = ConfigManager().load_config(self.config_path or 'settings.json')
+            api_config = next(item for item in config if item.get("setting") == "api")
+        except Exception:
+            api_config = {}
+        return {
+            'workers': int(api_config.get('workers', 1)),
+            'drain_timeout': int(api_config.get('drain_timeout', 30))
+        }
     
     def restart_server(self):
-        """重启服务器"""
+        """
+        重启服务器
+        
+        单进程模式且平台支持 SO_REUSEPORT 时平滑重启：先启动新进程并与旧进程共同监听端口，
+        新进程就绪后旧进程停止接受新连接，处理完正在进行的请求后退出，期间服务不中断。
+        否则先等待旧进程处理完请求并退出，再启动新进程。
+        """
         self.log_display.append("正在重启服务器...")
         self.update_status("状态: 正在重启服务器...")
         
@@ -375,10 +436,26 @@ class StartDialog(QtWidgets.QDialog):
         self.stop_button.setEnabled(False)
         self.restart_button.setEnabled(False)
         
+        options = self.server_options()
+        if self.process and self.process.poll() is None and reuse_port_supported() and options['workers'] <= 1:
+            self.log_display.append("正在启动新的服务器进程，就绪后旧进程将处理完已有请求再退出")
+            self.old_process, self.old_log_updater, self.old_log_thread = self.process, self.log_updater, self.log_thread
+            self.process = None
+            self.handoff_pending = True
+            self.start_server()
+            if self.process is None:
+                self.handoff_pending = False
+                # 新进程未能启动，旧进程继续运行
+                self.process, self.log_updater, self.log_thread = self.old_process, self.old_log_updater, self.old_log_thread
+                self.old_process = self.old_log_updater = self.old_log_thread = None
+                self.stop_button.setEnabled(True)
+                self.restart_button.setEnabled(True)
+            return
+        
         # 如果进程在运行，先停止它
         if self.process and self.process.poll() is None:
             # 创建终止器并连接到重启完成
-            self.server_terminator = ServerTerminator(self.process)
+            self.server_terminator = ServerTerminator(self.process, options['drain_timeout'])
             self.server_terminator.termination_status.connect(self.log_display.append)
             self.server_terminator.termination_completed.connect(self.on_restart_termination_completed)
             
@@ -390,6 +467,40 @@ class StartDialog(QtWidgets.QDialog):
             # 如果进程没有在运行，直接启动新实例
             self.on_restart_termination_completed()
     
+    def on_server_ready(self, process):
+        """新进程开始接受连接后，通知旧进程停止接受新连接并排空"""
+        if process is not self.process or not self.handoff_pending:
+            return
+        self.handoff_pending = False
+        self.log_display.append(f"新的服务器进程已就绪（PID: {process.pid}），旧进程（PID: {self.old_process.pid}）开始处理剩余请求")
+        self.update_status("状态: 旧进程正在处理剩余请求...")
+        self.server_terminator = ServerTerminator(self.old_process, self.server_options()['drain_timeout'])
+        self.server_terminator.termination_status.connect(self.log_display.append)
+        self.server_terminator.termination_completed.connect(self.on_handoff_completed)
+        
+        self.terminator_thread = QtCore.QThread()
+        self.server_terminator.moveToThread(self.terminator_thread)
+        self.terminator_thread.started.connect(self.server_terminator.terminate_process)
+        self.terminator_thread.start()
+    
+    def on_handoff_completed(self):
+        """平滑重启时旧进程退出后调用"""
+        if self.terminator_thread and self.terminator_thread.isRunning():
+            self.terminator_thread.quit()
+            self.terminator_thread.wait()
+        
+        if self.old_log_updater:
+            self.old_log_updater.running = False
+        if self.old_log_thread and self.old_log_thread.isRunning():
+            self.old_log_thread.quit()
+            self.old_log_thread.wait()
+        self.old_process = self.old_log_updater = self.old_log_thread = None
+        
+        self.log_display.append("服务器已重启")
+        self.update_status("状态: 服务器运行中")
+        self.stop_button.setEnabled(True)
+        self.restart_button.setEnabled(True)
+    
     def on_restart_termination_completed(self):
         """当为重启而终止进程完成时调用"""
         # 清理终止器线程
@@ -412,11 +523,28 @@ class StartDialog(QtWidgets.QDialog):
     
     def update_log(self, text):
         """更新日志显示区域"""
+        if text.startswith((READY_MARKER, DRAIN_MARKER, DRAINED_MARKER)):
+            self.show_server_state(text)
+            return
         self.log_display.append(text.rstrip())
         # 滚动到底部
         scrollbar = self.log_display.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
     
+    def show_server_state(self, text):
+        """把服务器输出的状态行转换为可读的日志和状态"""
+        marker, *items = text.split()
+        fields = dict(item.split('=', 1) for item in items if '=' in item)
+        pid = fields.get('pid', '')
+        if marker == READY_MARKER:
+            self.log_display.append(f"服务器进程已就绪（PID: {pid}）")
+        elif marker == DRAIN_MARKER:
+            progress = f"剩余 {fields.get('connections')} 个连接，已等待 {fields.get('elapsed')}/{fields.get('timeout')} 秒"
+            self.log_display.append(f"进程 {pid} 正在处理剩余请求：{progress}")
+            self.update_status(f"状态: 正在排空旧进程（{progress}）")
+        else:
+            self.log_display.append(f"进程 {pid} 已处理完剩余请求，用时 {fields.get('elapsed')} 秒")
+    
     def update_status(self, status):
         """更新状态标签"""
         self.status_label.setText(status)
@@ -429,6 +557,13 @@ class StartDialog(QtWidgets.QDialog):
         if self.log_updater:
             self.log_updater.running = False
         
+        # 平滑重启中的旧进程不再等待排空
+        if self.old_process and self.old_process.poll() is None:
+            try:
+                self.old_process.kill()
+            except Exception as e:
+                self.log_display.append(f"终止旧进程时出错: {str(e)}")
+        
         # 终止服务器进程
         if self.process and self.process.poll() is None:
             try: